@@ -13,6 +13,8 @@ magnetic field of various types of geometric objects:
 * :mod:`~fatiando.gravmag.sphere`: Spheres in Cartesian coordinates
 * :mod:`~fatiando.gravmag.tesseroid`: Tesseroids (spherical prisms) for modeling
   in spherical coordinates
+* :mod:`~fatiando.gravmag.harmonic`: Spherical harmonic synthesis of tesseroid
+  models. Fast for large models at satellite altitude.
 * :mod:`~fatiando.gravmag.talwani`: 2D bodies with polygonal vertical
   cross-sections
 * :mod:`~fatiando.gravmag.half_sph_shell`: Gravity fields of half a spherical
@@ -51,4 +53,4 @@ after modeling.
 
 from fatiando.gravmag import (basin2d, polyprism, prism, talwani, transform,
     harvester, sphere, tensor, fourier, imaging, euler, tesseroid,
-    half_sph_shell, eqlayer)
+    half_sph_shell, eqlayer, harmonic)
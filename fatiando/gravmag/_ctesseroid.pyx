@@ -9,7 +9,7 @@ cimport numpy
 DTYPE = numpy.float
 ctypedef numpy.float_t DTYPE_T
 
-from libc.math cimport sin, cos, sqrt
+from libc.math cimport sqrt, sin, cos, M_PI as pi
 
 from fatiando.constants import MEAN_EARTH_RADIUS
 
@@ -20,405 +20,717 @@ def _scale_nodes(tesseroid, nodes):
     dlat = tesseroid.n - tesseroid.s
     dr = tesseroid.top - tesseroid.bottom
     # Scale the GLQ nodes to the integration limits
-    nodes_lon = d2r*(0.5*dlon*nodes + 0.5*(tesseroid.e + tesseroid.w))
-    nodes_lat = d2r*(0.5*dlat*nodes + 0.5*(tesseroid.n + tesseroid.s))
-    nodes_r = (0.5*dr*nodes +
+    nodes_lon = d2r*(0.5*dlon*nodes[0] + 0.5*(tesseroid.e + tesseroid.w))
+    nodes_lat = d2r*(0.5*dlat*nodes[1] + 0.5*(tesseroid.n + tesseroid.s))
+    nodes_r = (0.5*dr*nodes[2] +
         0.5*(tesseroid.top + tesseroid.bottom + 2.*MEAN_EARTH_RADIUS))
     scale = d2r*dlon*d2r*dlat*dr*0.125
     return nodes_lon, nodes_lat, nodes_r, scale
 
 def potential(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
+    points,
+    numpy.ndarray[numpy.int_t, ndim=1] index,
+    nodes,
+    weights):
     """
     Integrate potential using the Gauss-Legendre Quadrature
     """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
+    cdef unsigned int nlon = len(nodes[0]), nlat = len(nodes[1])
+    cdef unsigned int nr = len(nodes[2]), ndata = len(index)
+    cdef unsigned int i, j, k, l, p
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wlon = weights[0]
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wlat = weights[1]
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wr = weights[2]
     cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlonc, coslonc
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlons = points.sinlon
+    cdef numpy.ndarray[DTYPE_T, ndim=1] coslons = points.coslon
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlats = points.sinlat
+    cdef numpy.ndarray[DTYPE_T, ndim=1] coslats = points.coslat
+    cdef numpy.ndarray[DTYPE_T, ndim=1] radii = points.radii
+    cdef numpy.ndarray[DTYPE_T, ndim=1] radii_sqrs = points.radii_sqr
     cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
+    cdef DTYPE_T scale, kappa, sinlat, coslat, radius, radii_sqr, coslon, l_sqr
     # Put the nodes in the corrent range
     lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
     result = numpy.zeros(ndata, DTYPE)
     # Pre-compute sines, cossines and powers
+    sinlonc = numpy.sin(lonc)
+    coslonc = numpy.cos(lonc)
     sinlatc = numpy.sin(latc)
     coslatc = numpy.cos(latc)
     # Start the numerical integration
     for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            for j in xrange(order):
-                for k in xrange(order):
+        p = index[l]
+        sinlat = sinlats[p]
+        coslat = coslats[p]
+        radius = radii[p]
+        radii_sqr = radii_sqrs[p]
+        for i in xrange(nlon):
+            coslon = coslons[p]*coslonc[i] + sinlons[p]*sinlonc[i]
+            for j in xrange(nlat):
+                for k in xrange(nr):
                     l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
+                             2.*radius*rc[k]*(
                                 sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
                     kappa = (rc[k]**2)*coslatc[j]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
+                    result[l] = result[l] + (wlon[i]*wlat[j]*wr[k]*
                         kappa/sqrt(l_sqr))
         result[l] = result[l]*scale
     return result
 
 def gx(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
+    points,
+    numpy.ndarray[numpy.int_t, ndim=1] index,
+    nodes,
+    weights):
     """
     Integrate gx using the Gauss-Legendre Quadrature
     """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
+    cdef unsigned int nlon = len(nodes[0]), nlat = len(nodes[1])
+    cdef unsigned int nr = len(nodes[2]), ndata = len(index)
+    cdef unsigned int i, j, k, l, p
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wlon = weights[0]
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wlat = weights[1]
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wr = weights[2]
     cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlonc, coslonc
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlons = points.sinlon
+    cdef numpy.ndarray[DTYPE_T, ndim=1] coslons = points.coslon
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlats = points.sinlat
+    cdef numpy.ndarray[DTYPE_T, ndim=1] coslats = points.coslat
+    cdef numpy.ndarray[DTYPE_T, ndim=1] radii = points.radii
+    cdef numpy.ndarray[DTYPE_T, ndim=1] radii_sqrs = points.radii_sqr
     cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
+    cdef DTYPE_T scale, kappa, sinlat, coslat, radius, radii_sqr, coslon, l_sqr
     cdef DTYPE_T kphi
     # Put the nodes in the corrent range
     lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
     result = numpy.zeros(ndata, DTYPE)
     # Pre-compute sines, cossines and powers
+    sinlonc = numpy.sin(lonc)
+    coslonc = numpy.cos(lonc)
     sinlatc = numpy.sin(latc)
     coslatc = numpy.cos(latc)
     # Start the numerical integration
     for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            for j in xrange(order):
+        p = index[l]
+        sinlat = sinlats[p]
+        coslat = coslats[p]
+        radius = radii[p]
+        radii_sqr = radii_sqrs[p]
+        for i in xrange(nlon):
+            coslon = coslons[p]*coslonc[i] + sinlons[p]*sinlonc[i]
+            for j in xrange(nlat):
                 kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
-                for k in xrange(order):
+                for k in xrange(nr):
                     l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
+                             2.*radius*rc[k]*(
                                 sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
                     kappa = (rc[k]**2)*coslatc[j]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
+                    result[l] = result[l] + (wlon[i]*wlat[j]*wr[k]*
                         kappa*rc[k]*kphi/(l_sqr**1.5))
         result[l] = result[l]*scale
     return result
 
 def gy(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
+    points,
+    numpy.ndarray[numpy.int_t, ndim=1] index,
+    nodes,
+    weights):
     """
     Integrate gy using the Gauss-Legendre Quadrature
     """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
+    cdef unsigned int nlon = len(nodes[0]), nlat = len(nodes[1])
+    cdef unsigned int nr = len(nodes[2]), ndata = len(index)
+    cdef unsigned int i, j, k, l, p
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wlon = weights[0]
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wlat = weights[1]
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wr = weights[2]
     cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlonc, coslonc
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlons = points.sinlon
+    cdef numpy.ndarray[DTYPE_T, ndim=1] coslons = points.coslon
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlats = points.sinlat
+    cdef numpy.ndarray[DTYPE_T, ndim=1] coslats = points.coslat
+    cdef numpy.ndarray[DTYPE_T, ndim=1] radii = points.radii
+    cdef numpy.ndarray[DTYPE_T, ndim=1] radii_sqrs = points.radii_sqr
     cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
+    cdef DTYPE_T scale, kappa, sinlat, coslat, radius, radii_sqr, coslon, l_sqr
     cdef DTYPE_T sinlon
     # Put the nodes in the corrent range
     lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
     result = numpy.zeros(ndata, DTYPE)
     # Pre-compute sines, cossines and powers
+    sinlonc = numpy.sin(lonc)
+    coslonc = numpy.cos(lonc)
     sinlatc = numpy.sin(latc)
     coslatc = numpy.cos(latc)
     # Start the numerical integration
     for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            sinlon = sin(lonc[i] - lons[l])
-            for j in xrange(order):
-                for k in xrange(order):
+        p = index[l]
+        sinlat = sinlats[p]
+        coslat = coslats[p]
+        radius = radii[p]
+        radii_sqr = radii_sqrs[p]
+        for i in xrange(nlon):
+            coslon = coslons[p]*coslonc[i] + sinlons[p]*sinlonc[i]
+            sinlon = sinlonc[i]*coslons[p] - coslonc[i]*sinlons[p]
+            for j in xrange(nlat):
+                for k in xrange(nr):
                     l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
+                             2.*radius*rc[k]*(
                                 sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
                     kappa = (rc[k]**2)*coslatc[j]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
+                    result[l] = result[l] + (wlon[i]*wlat[j]*wr[k]*
                         kappa*rc[k]*coslatc[j]*sinlon/(l_sqr**1.5))
         result[l] = result[l]*scale
     return result
 
 def gz(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
+    points,
+    numpy.ndarray[numpy.int_t, ndim=1] index,
+    nodes,
+    weights):
     """
     Integrate gz using the Gauss-Legendre Quadrature
     """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
+    cdef unsigned int nlon = len(nodes[0]), nlat = len(nodes[1])
+    cdef unsigned int nr = len(nodes[2]), ndata = len(index)
+    cdef unsigned int i, j, k, l, p
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wlon = weights[0]
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wlat = weights[1]
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wr = weights[2]
     cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlonc, coslonc
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlons = points.sinlon
+    cdef numpy.ndarray[DTYPE_T, ndim=1] coslons = points.coslon
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlats = points.sinlat
+    cdef numpy.ndarray[DTYPE_T, ndim=1] coslats = points.coslat
+    cdef numpy.ndarray[DTYPE_T, ndim=1] radii = points.radii
+    cdef numpy.ndarray[DTYPE_T, ndim=1] radii_sqrs = points.radii_sqr
     cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
+    cdef DTYPE_T scale, kappa, sinlat, coslat, radius, radii_sqr, coslon, l_sqr
     cdef DTYPE_T cospsi
     # Put the nodes in the corrent range
     lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
     result = numpy.zeros(ndata, DTYPE)
     # Pre-compute sines, cossines and powers
+    sinlonc = numpy.sin(lonc)
+    coslonc = numpy.cos(lonc)
     sinlatc = numpy.sin(latc)
     coslatc = numpy.cos(latc)
     # Start the numerical integration
     for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            for j in xrange(order):
+        p = index[l]
+        sinlat = sinlats[p]
+        coslat = coslats[p]
+        radius = radii[p]
+        radii_sqr = radii_sqrs[p]
+        for i in xrange(nlon):
+            coslon = coslons[p]*coslonc[i] + sinlons[p]*sinlonc[i]
+            for j in xrange(nlat):
                 cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-                for k in xrange(order):
+                for k in xrange(nr):
                     l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
+                             2.*radius*rc[k]*(
                                 sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
                     kappa = (rc[k]**2)*coslatc[j]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
-                        kappa*(rc[k]*cospsi - radii[l])/(l_sqr**1.5))
+                    result[l] = result[l] + (wlon[i]*wlat[j]*wr[k]*
+                        kappa*(rc[k]*cospsi - radius)/(l_sqr**1.5))
         result[l] = result[l]*scale
     return result
 
 def gxx(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
+    points,
+    numpy.ndarray[numpy.int_t, ndim=1] index,
+    nodes,
+    weights):
     """
     Integrate gxx using the Gauss-Legendre Quadrature
     """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
+    cdef unsigned int nlon = len(nodes[0]), nlat = len(nodes[1])
+    cdef unsigned int nr = len(nodes[2]), ndata = len(index)
+    cdef unsigned int i, j, k, l, p
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wlon = weights[0]
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wlat = weights[1]
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wr = weights[2]
     cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlonc, coslonc
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlons = points.sinlon
+    cdef numpy.ndarray[DTYPE_T, ndim=1] coslons = points.coslon
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlats = points.sinlat
+    cdef numpy.ndarray[DTYPE_T, ndim=1] coslats = points.coslat
+    cdef numpy.ndarray[DTYPE_T, ndim=1] radii = points.radii
+    cdef numpy.ndarray[DTYPE_T, ndim=1] radii_sqrs = points.radii_sqr
     cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
+    cdef DTYPE_T scale, kappa, sinlat, coslat, radius, radii_sqr, coslon, l_sqr
     cdef DTYPE_T kphi
     # Put the nodes in the corrent range
     lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
     result = numpy.zeros(ndata, DTYPE)
     # Pre-compute sines, cossines and powers
+    sinlonc = numpy.sin(lonc)
+    coslonc = numpy.cos(lonc)
     sinlatc = numpy.sin(latc)
     coslatc = numpy.cos(latc)
     # Start the numerical integration
     for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            for j in xrange(order):
+        p = index[l]
+        sinlat = sinlats[p]
+        coslat = coslats[p]
+        radius = radii[p]
+        radii_sqr = radii_sqrs[p]
+        for i in xrange(nlon):
+            coslon = coslons[p]*coslonc[i] + sinlons[p]*sinlonc[i]
+            for j in xrange(nlat):
                 kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
-                for k in xrange(order):
+                for k in xrange(nr):
                     l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
+                             2.*radius*rc[k]*(
                                 sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
                     kappa = (rc[k]**2)*coslatc[j]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
+                    result[l] = result[l] + (wlon[i]*wlat[j]*wr[k]*
                         kappa*(3.*((rc[k]*kphi)**2) - l_sqr)/(l_sqr**2.5))
         result[l] = result[l]*scale
     return result
 
 def gxy(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
+    points,
+    numpy.ndarray[numpy.int_t, ndim=1] index,
+    nodes,
+    weights):
     """
     Integrate gxy using the Gauss-Legendre Quadrature
     """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
+    cdef unsigned int nlon = len(nodes[0]), nlat = len(nodes[1])
+    cdef unsigned int nr = len(nodes[2]), ndata = len(index)
+    cdef unsigned int i, j, k, l, p
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wlon = weights[0]
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wlat = weights[1]
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wr = weights[2]
     cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlonc, coslonc
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlons = points.sinlon
+    cdef numpy.ndarray[DTYPE_T, ndim=1] coslons = points.coslon
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlats = points.sinlat
+    cdef numpy.ndarray[DTYPE_T, ndim=1] coslats = points.coslat
+    cdef numpy.ndarray[DTYPE_T, ndim=1] radii = points.radii
+    cdef numpy.ndarray[DTYPE_T, ndim=1] radii_sqrs = points.radii_sqr
     cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
+    cdef DTYPE_T scale, kappa, sinlat, coslat, radius, radii_sqr, coslon, l_sqr
     cdef DTYPE_T kphi, sinlon
     # Put the nodes in the corrent range
     lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
     result = numpy.zeros(ndata, DTYPE)
     # Pre-compute sines, cossines and powers
+    sinlonc = numpy.sin(lonc)
+    coslonc = numpy.cos(lonc)
     sinlatc = numpy.sin(latc)
     coslatc = numpy.cos(latc)
     # Start the numerical integration
     for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            sinlon = sin(lonc[i] - lons[l])
-            for j in xrange(order):
+        p = index[l]
+        sinlat = sinlats[p]
+        coslat = coslats[p]
+        radius = radii[p]
+        radii_sqr = radii_sqrs[p]
+        for i in xrange(nlon):
+            coslon = coslons[p]*coslonc[i] + sinlons[p]*sinlonc[i]
+            sinlon = sinlonc[i]*coslons[p] - coslonc[i]*sinlons[p]
+            for j in xrange(nlat):
                 kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
-                for k in xrange(order):
+                for k in xrange(nr):
                     l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
+                             2.*radius*rc[k]*(
                                 sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
                     kappa = (rc[k]**2)*coslatc[j]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
+                    result[l] = result[l] + (wlon[i]*wlat[j]*wr[k]*
                         kappa*3.*(rc[k]**2)*kphi*coslatc[j]*sinlon/(l_sqr**2.5))
         result[l] = result[l]*scale
     return result
 
 def gxz(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
+    points,
+    numpy.ndarray[numpy.int_t, ndim=1] index,
+    nodes,
+    weights):
     """
     Integrate gxz using the Gauss-Legendre Quadrature
     """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
+    cdef unsigned int nlon = len(nodes[0]), nlat = len(nodes[1])
+    cdef unsigned int nr = len(nodes[2]), ndata = len(index)
+    cdef unsigned int i, j, k, l, p
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wlon = weights[0]
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wlat = weights[1]
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wr = weights[2]
     cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlonc, coslonc
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlons = points.sinlon
+    cdef numpy.ndarray[DTYPE_T, ndim=1] coslons = points.coslon
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlats = points.sinlat
+    cdef numpy.ndarray[DTYPE_T, ndim=1] coslats = points.coslat
+    cdef numpy.ndarray[DTYPE_T, ndim=1] radii = points.radii
+    cdef numpy.ndarray[DTYPE_T, ndim=1] radii_sqrs = points.radii_sqr
     cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
+    cdef DTYPE_T scale, kappa, sinlat, coslat, radius, radii_sqr, coslon, l_sqr
     cdef DTYPE_T kphi, cospsi
     # Put the nodes in the corrent range
     lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
     result = numpy.zeros(ndata, DTYPE)
     # Pre-compute sines, cossines and powers
+    sinlonc = numpy.sin(lonc)
+    coslonc = numpy.cos(lonc)
     sinlatc = numpy.sin(latc)
     coslatc = numpy.cos(latc)
     # Start the numerical integration
     for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            for j in xrange(order):
+        p = index[l]
+        sinlat = sinlats[p]
+        coslat = coslats[p]
+        radius = radii[p]
+        radii_sqr = radii_sqrs[p]
+        for i in xrange(nlon):
+            coslon = coslons[p]*coslonc[i] + sinlons[p]*sinlonc[i]
+            for j in xrange(nlat):
                 kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
                 cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-                for k in xrange(order):
+                for k in xrange(nr):
                     l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
+                             2.*radius*rc[k]*(
                                 sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
                     kappa = (rc[k]**2)*coslatc[j]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
-                        kappa*3.*rc[k]*kphi*(rc[k]*cospsi - radii[l])/
+                    result[l] = result[l] + (wlon[i]*wlat[j]*wr[k]*
+                        kappa*3.*rc[k]*kphi*(rc[k]*cospsi - radius)/
                         (l_sqr**2.5))
         result[l] = result[l]*scale
     return result
 
 def gyy(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
+    points,
+    numpy.ndarray[numpy.int_t, ndim=1] index,
+    nodes,
+    weights):
     """
     Integrate gyy using the Gauss-Legendre Quadrature
     """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
+    cdef unsigned int nlon = len(nodes[0]), nlat = len(nodes[1])
+    cdef unsigned int nr = len(nodes[2]), ndata = len(index)
+    cdef unsigned int i, j, k, l, p
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wlon = weights[0]
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wlat = weights[1]
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wr = weights[2]
     cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlonc, coslonc
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlons = points.sinlon
+    cdef numpy.ndarray[DTYPE_T, ndim=1] coslons = points.coslon
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlats = points.sinlat
+    cdef numpy.ndarray[DTYPE_T, ndim=1] coslats = points.coslat
+    cdef numpy.ndarray[DTYPE_T, ndim=1] radii = points.radii
+    cdef numpy.ndarray[DTYPE_T, ndim=1] radii_sqrs = points.radii_sqr
     cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
+    cdef DTYPE_T scale, kappa, sinlat, coslat, radius, radii_sqr, coslon, l_sqr
     cdef DTYPE_T sinlon, deltay
     # Put the nodes in the corrent range
     lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
     result = numpy.zeros(ndata, DTYPE)
     # Pre-compute sines, cossines and powers
+    sinlonc = numpy.sin(lonc)
+    coslonc = numpy.cos(lonc)
     sinlatc = numpy.sin(latc)
     coslatc = numpy.cos(latc)
     # Start the numerical integration
     for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            sinlon = sin(lonc[i] - lons[l])
-            for j in xrange(order):
-                for k in xrange(order):
+        p = index[l]
+        sinlat = sinlats[p]
+        coslat = coslats[p]
+        radius = radii[p]
+        radii_sqr = radii_sqrs[p]
+        for i in xrange(nlon):
+            coslon = coslons[p]*coslonc[i] + sinlons[p]*sinlonc[i]
+            sinlon = sinlonc[i]*coslons[p] - coslonc[i]*sinlons[p]
+            for j in xrange(nlat):
+                for k in xrange(nr):
                     l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
+                             2.*radius*rc[k]*(
                                 sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
                     kappa = (rc[k]**2)*coslatc[j]
                     deltay = rc[k]*coslatc[j]*sinlon
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
+                    result[l] = result[l] + (wlon[i]*wlat[j]*wr[k]*
                         kappa*(3.*(deltay**2) - l_sqr)/(l_sqr**2.5))
         result[l] = result[l]*scale
     return result
 
 def gyz(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
+    points,
+    numpy.ndarray[numpy.int_t, ndim=1] index,
+    nodes,
+    weights):
     """
     Integrate gyz using the Gauss-Legendre Quadrature
     """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
+    cdef unsigned int nlon = len(nodes[0]), nlat = len(nodes[1])
+    cdef unsigned int nr = len(nodes[2]), ndata = len(index)
+    cdef unsigned int i, j, k, l, p
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wlon = weights[0]
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wlat = weights[1]
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wr = weights[2]
     cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlonc, coslonc
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlons = points.sinlon
+    cdef numpy.ndarray[DTYPE_T, ndim=1] coslons = points.coslon
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlats = points.sinlat
+    cdef numpy.ndarray[DTYPE_T, ndim=1] coslats = points.coslat
+    cdef numpy.ndarray[DTYPE_T, ndim=1] radii = points.radii
+    cdef numpy.ndarray[DTYPE_T, ndim=1] radii_sqrs = points.radii_sqr
     cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
+    cdef DTYPE_T scale, kappa, sinlat, coslat, radius, radii_sqr, coslon, l_sqr
     cdef DTYPE_T sinlon, deltay, deltaz, cospsi
     # Put the nodes in the corrent range
     lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
     result = numpy.zeros(ndata, DTYPE)
     # Pre-compute sines, cossines and powers
+    sinlonc = numpy.sin(lonc)
+    coslonc = numpy.cos(lonc)
     sinlatc = numpy.sin(latc)
     coslatc = numpy.cos(latc)
     # Start the numerical integration
     for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            sinlon = sin(lonc[i] - lons[l])
-            for j in xrange(order):
+        p = index[l]
+        sinlat = sinlats[p]
+        coslat = coslats[p]
+        radius = radii[p]
+        radii_sqr = radii_sqrs[p]
+        for i in xrange(nlon):
+            coslon = coslons[p]*coslonc[i] + sinlons[p]*sinlonc[i]
+            sinlon = sinlonc[i]*coslons[p] - coslonc[i]*sinlons[p]
+            for j in xrange(nlat):
                 cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-                for k in xrange(order):
+                for k in xrange(nr):
                     l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
+                             2.*radius*rc[k]*(
                                 sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
                     kappa = (rc[k]**2)*coslatc[j]
                     deltay = rc[k]*coslatc[j]*sinlon
-                    deltaz = rc[k]*cospsi - radii[l]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
+                    deltaz = rc[k]*cospsi - radius
+                    result[l] = result[l] + (wlon[i]*wlat[j]*wr[k]*
                         kappa*3.*deltay*deltaz/(l_sqr**2.5))
         result[l] = result[l]*scale
     return result
 
 def gzz(tesseroid,
-    numpy.ndarray[DTYPE_T, ndim=1] lons,
-    numpy.ndarray[DTYPE_T, ndim=1] lats,
-    numpy.ndarray[DTYPE_T, ndim=1] radii,
-    numpy.ndarray[DTYPE_T, ndim=1] nodes,
-    numpy.ndarray[DTYPE_T, ndim=1] weights):
+    points,
+    numpy.ndarray[numpy.int_t, ndim=1] index,
+    nodes,
+    weights):
     """
     Integrate gzz using the Gauss-Legendre Quadrature
     """
-    cdef unsigned int order = len(nodes), ndata = len(lons), i, j, k, l
+    cdef unsigned int nlon = len(nodes[0]), nlat = len(nodes[1])
+    cdef unsigned int nr = len(nodes[2]), ndata = len(index)
+    cdef unsigned int i, j, k, l, p
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wlon = weights[0]
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wlat = weights[1]
+    cdef numpy.ndarray[DTYPE_T, ndim=1] wr = weights[2]
     cdef numpy.ndarray[DTYPE_T, ndim=1] lonc, latc, rc, sinlatc, coslatc
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlonc, coslonc
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlons = points.sinlon
+    cdef numpy.ndarray[DTYPE_T, ndim=1] coslons = points.coslon
+    cdef numpy.ndarray[DTYPE_T, ndim=1] sinlats = points.sinlat
+    cdef numpy.ndarray[DTYPE_T, ndim=1] coslats = points.coslat
+    cdef numpy.ndarray[DTYPE_T, ndim=1] radii = points.radii
+    cdef numpy.ndarray[DTYPE_T, ndim=1] radii_sqrs = points.radii_sqr
     cdef numpy.ndarray[DTYPE_T, ndim=1] result
-    cdef DTYPE_T scale, kappa, sinlat, coslat, radii_sqr, coslon, l_sqr
+    cdef DTYPE_T scale, kappa, sinlat, coslat, radius, radii_sqr, coslon, l_sqr
     cdef DTYPE_T cospsi, deltaz
     # Put the nodes in the corrent range
     lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
     result = numpy.zeros(ndata, DTYPE)
     # Pre-compute sines, cossines and powers
+    sinlonc = numpy.sin(lonc)
+    coslonc = numpy.cos(lonc)
     sinlatc = numpy.sin(latc)
     coslatc = numpy.cos(latc)
     # Start the numerical integration
     for l in xrange(ndata):
-        sinlat = sin(lats[l])
-        coslat = cos(lats[l])
-        radii_sqr = radii[l]**2
-        for i in xrange(order):
-            coslon = cos(lons[l] - lonc[i])
-            for j in xrange(order):
+        p = index[l]
+        sinlat = sinlats[p]
+        coslat = coslats[p]
+        radius = radii[p]
+        radii_sqr = radii_sqrs[p]
+        for i in xrange(nlon):
+            coslon = coslons[p]*coslonc[i] + sinlons[p]*sinlonc[i]
+            for j in xrange(nlat):
                 cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-                for k in xrange(order):
+                for k in xrange(nr):
                     l_sqr = (radii_sqr + rc[k]**2 -
-                             2.*radii[l]*rc[k]*(
+                             2.*radius*rc[k]*(
                                 sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
                     kappa = (rc[k]**2)*coslatc[j]
-                    deltaz = rc[k]*cospsi - radii[l]
-                    result[l] = result[l] + (weights[i]*weights[j]*weights[k]*
+                    deltaz = rc[k]*cospsi - radius
+                    result[l] = result[l] + (wlon[i]*wlat[j]*wr[k]*
                         kappa*(3.*deltaz**2 - l_sqr)/(l_sqr**2.5))
         result[l] = result[l]*scale
     return result
+
+def fields(tesseroid,
+    points,
+    numpy.ndarray[numpy.int_t, ndim=1] index,
+    nodes,
+    weights,
+    numpy.ndarray[numpy.int_t, ndim=1] codes):
+    """
+    Integrate several components at once using the Gauss-Legendre Quadrature
+
+    The distances and trigonometric terms are computed only once per node and
+    shared by all components. *codes* are the integer codes of the components
+    (0=potential, 1=gx, 2=gy, 3=gz, 4=gxx, 5=gxy, 6=gxz, 7=gyy, 8=gyz,
+    9=gzz). Returns an array with one row per code.
+    """
+    cdef numpy.ndarray[DTYPE_T, ndim=2] result
+    result = numpy.zeros((len(codes), len(index)), DTYPE)
+    _fields_cell(tesseroid.w, tesseroid.e, tesseroid.s, tesseroid.n,
+        tesseroid.top, tesseroid.bottom, 1., points.sinlon, points.coslon,
+        points.sinlat, points.coslat, points.radii, points.radii_sqr, index,
+        nodes[0], nodes[1], nodes[2], weights[0], weights[1], weights[2],
+        codes, _Scratch(nodes, codes), result)
+    return result
+
+def cells(numpy.ndarray[DTYPE_T, ndim=1] w,
+    numpy.ndarray[DTYPE_T, ndim=1] e,
+    numpy.ndarray[DTYPE_T, ndim=1] s,
+    numpy.ndarray[DTYPE_T, ndim=1] n,
+    numpy.ndarray[DTYPE_T, ndim=1] top,
+    numpy.ndarray[DTYPE_T, ndim=1] bottom,
+    numpy.ndarray[DTYPE_T, ndim=1] factors,
+    points,
+    numpy.ndarray[numpy.int_t, ndim=1] index,
+    nodes,
+    weights,
+    numpy.ndarray[numpy.int_t, ndim=1] codes):
+    """
+    Integrate several components for many tesseroids given by arrays of
+    bounds (as returned by TesseroidMesh.get_cell_bounds)
+
+    Returns the sum of the effects of the tesseroids, each multiplied by its
+    value in *factors*. Same as adding the results of fields for every
+    tesseroid but without the cost of calling it from Python.
+    """
+    cdef unsigned int t, ncells = len(w)
+    cdef numpy.ndarray[DTYPE_T, ndim=2] result
+    cdef _Scratch scratch = _Scratch(nodes, codes)
+    cdef DTYPE_T[:] sinlons = points.sinlon
+    cdef DTYPE_T[:] coslons = points.coslon
+    cdef DTYPE_T[:] sinlats = points.sinlat
+    cdef DTYPE_T[:] coslats = points.coslat
+    cdef DTYPE_T[:] radii = points.radii
+    cdef DTYPE_T[:] radii_sqrs = points.radii_sqr
+    cdef DTYPE_T[:] nodes_lon = nodes[0], nodes_lat = nodes[1]
+    cdef DTYPE_T[:] nodes_r = nodes[2]
+    cdef DTYPE_T[:] wlon = weights[0], wlat = weights[1], wr = weights[2]
+    result = numpy.zeros((len(codes), len(index)), DTYPE)
+    for t in xrange(ncells):
+        _fields_cell(w[t], e[t], s[t], n[t], top[t], bottom[t], factors[t],
+            sinlons, coslons, sinlats, coslats, radii, radii_sqrs, index,
+            nodes_lon, nodes_lat, nodes_r, wlon, wlat, wr, codes, scratch,
+            result)
+    return result
+
+cdef class _Scratch:
+    """
+    Work arrays for _fields_cell: the sines and cosines of the scaled nodes,
+    the scaled radial nodes, and the sums of each component.
+    """
+    cdef DTYPE_T[:] rc, sinlonc, coslonc, sinlatc, coslatc, sums
+
+    def __init__(self, nodes, codes):
+        self.rc = numpy.empty(len(nodes[2]), DTYPE)
+        self.sinlonc = numpy.empty(len(nodes[0]), DTYPE)
+        self.coslonc = numpy.empty(len(nodes[0]), DTYPE)
+        self.sinlatc = numpy.empty(len(nodes[1]), DTYPE)
+        self.coslatc = numpy.empty(len(nodes[1]), DTYPE)
+        self.sums = numpy.empty(len(codes), DTYPE)
+
+cdef void _fields_cell(DTYPE_T w, DTYPE_T e, DTYPE_T s, DTYPE_T n,
+    DTYPE_T top, DTYPE_T bottom, DTYPE_T factor,
+    DTYPE_T[:] sinlons, DTYPE_T[:] coslons, DTYPE_T[:] sinlats,
+    DTYPE_T[:] coslats, DTYPE_T[:] radii, DTYPE_T[:] radii_sqrs,
+    numpy.int_t[:] index,
+    DTYPE_T[:] nodes_lon, DTYPE_T[:] nodes_lat, DTYPE_T[:] nodes_r,
+    DTYPE_T[:] wlon, DTYPE_T[:] wlat, DTYPE_T[:] wr,
+    numpy.int_t[:] codes, _Scratch scratch, DTYPE_T[:, :] result) except *:
+    """
+    Add *factor* times the effect of a tesseroid to *result*. Used by fields
+    and cells.
+    """
+    cdef unsigned int nlon = len(nodes_lon), nlat = len(nodes_lat)
+    cdef unsigned int nr = len(nodes_r), ndata = len(index)
+    cdef unsigned int ncodes = len(codes)
+    cdef unsigned int i, j, k, l, p, c
+    cdef DTYPE_T[:] rc = scratch.rc, sums = scratch.sums
+    cdef DTYPE_T[:] sinlonc = scratch.sinlonc, coslonc = scratch.coslonc
+    cdef DTYPE_T[:] sinlatc = scratch.sinlatc, coslatc = scratch.coslatc
+    cdef DTYPE_T scale, kappa, sinlat, coslat, radius, radii_sqr, coslon, l_sqr
+    cdef DTYPE_T sinlon, cospsi, kphi, wkappa, dist, l_3, l_5
+    cdef DTYPE_T deltax, deltay, deltaz, d2r = pi/180.
+    cdef long code
+    # Put the nodes in the corrent range and pre-compute sines and cossines
+    for i in xrange(nlon):
+        sinlonc[i] = sin(d2r*(0.5*(e - w)*nodes_lon[i] + 0.5*(e + w)))
+        coslonc[i] = cos(d2r*(0.5*(e - w)*nodes_lon[i] + 0.5*(e + w)))
+    for j in xrange(nlat):
+        sinlatc[j] = sin(d2r*(0.5*(n - s)*nodes_lat[j] + 0.5*(n + s)))
+        coslatc[j] = cos(d2r*(0.5*(n - s)*nodes_lat[j] + 0.5*(n + s)))
+    for k in xrange(nr):
+        rc[k] = (0.5*(top - bottom)*nodes_r[k] +
+                 0.5*(top + bottom + 2.*MEAN_EARTH_RADIUS))
+    scale = d2r*(e - w)*d2r*(n - s)*(top - bottom)*0.125
+    # Start the numerical integration
+    for l in xrange(ndata):
+        p = index[l]
+        sinlat = sinlats[p]
+        coslat = coslats[p]
+        radius = radii[p]
+        radii_sqr = radii_sqrs[p]
+        for c in xrange(ncodes):
+            sums[c] = 0
+        for i in xrange(nlon):
+            coslon = coslons[p]*coslonc[i] + sinlons[p]*sinlonc[i]
+            sinlon = sinlonc[i]*coslons[p] - coslonc[i]*sinlons[p]
+            for j in xrange(nlat):
+                cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
+                kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
+                for k in xrange(nr):
+                    l_sqr = radii_sqr + rc[k]**2 - 2.*radius*rc[k]*cospsi
+                    kappa = (rc[k]**2)*coslatc[j]
+                    wkappa = wlon[i]*wlat[j]*wr[k]*kappa
+                    dist = sqrt(l_sqr)
+                    l_3 = l_sqr*dist
+                    l_5 = l_3*l_sqr
+                    deltax = rc[k]*kphi
+                    deltay = rc[k]*coslatc[j]*sinlon
+                    deltaz = rc[k]*cospsi - radius
+                    for c in xrange(ncodes):
+                        code = codes[c]
+                        if code == 0:
+                            sums[c] += wkappa/dist
+                        elif code == 1:
+                            sums[c] += wkappa*deltax/l_3
+                        elif code == 2:
+                            sums[c] += wkappa*deltay/l_3
+                        elif code == 3:
+                            sums[c] += wkappa*deltaz/l_3
+                        elif code == 4:
+                            sums[c] += wkappa*(3.*deltax**2 - l_sqr)/l_5
+                        elif code == 5:
+                            sums[c] += wkappa*3.*deltax*deltay/l_5
+                        elif code == 6:
+                            sums[c] += wkappa*3.*deltax*deltaz/l_5
+                        elif code == 7:
+                            sums[c] += wkappa*(3.*deltay**2 - l_sqr)/l_5
+                        elif code == 8:
+                            sums[c] += wkappa*3.*deltay*deltaz/l_5
+                        elif code == 9:
+                            sums[c] += wkappa*(3.*deltaz**2 - l_sqr)/l_5
+        for c in xrange(ncodes):
+            result[c, l] += factor*scale*sums[c]
@@ -5,6 +5,7 @@ Used instead of Cython versions if those are not available.
 import numpy
 
 from fatiando.constants import MEAN_EARTH_RADIUS
+from fatiando.mesher import Tesseroid
 
 
 def _scale_nodes(tesseroid, nodes):
@@ -13,295 +14,400 @@ def _scale_nodes(tesseroid, nodes):
     dlat = tesseroid.n - tesseroid.s
     dr = tesseroid.top - tesseroid.bottom
     # Scale the GLQ nodes to the integration limits
-    nodes_lon = d2r*(0.5*dlon*nodes + 0.5*(tesseroid.e + tesseroid.w))
-    nodes_lat = d2r*(0.5*dlat*nodes + 0.5*(tesseroid.n + tesseroid.s))
-    nodes_r = (0.5*dr*nodes +
+    nodes_lon = d2r*(0.5*dlon*nodes[0] + 0.5*(tesseroid.e + tesseroid.w))
+    nodes_lat = d2r*(0.5*dlat*nodes[1] + 0.5*(tesseroid.n + tesseroid.s))
+    nodes_r = (0.5*dr*nodes[2] +
         0.5*(tesseroid.top + tesseroid.bottom + 2.*MEAN_EARTH_RADIUS))
     scale = d2r*dlon*d2r*dlat*dr*0.125
     return nodes_lon, nodes_lat, nodes_r, scale
 
-def potential(tesseroid, lons, lats, radii, nodes, weights):
+def _get_points(points, index):
+    """
+    Get the precomputed sines, cosines, radii and squared radii of the
+    computation points in *index*.
+    """
+    return (points.sinlon[index], points.coslon[index], points.sinlat[index],
+            points.coslat[index], points.radii[index], points.radii_sqr[index])
+
+def potential(tesseroid, points, index, nodes, weights):
     """
     Integrate potential using the Gauss-Legendre Quadrature
     """
-    order = len(nodes)
+    nlon, nlat, nr = [len(n) for n in nodes]
+    wlon, wlat, wr = weights
     lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
     # Pre-compute sines, cossines and powers
+    sinlonc = numpy.sin(lonc)
+    coslonc = numpy.cos(lonc)
     sinlatc = numpy.sin(latc)
     coslatc = numpy.cos(latc)
-    sinlat = numpy.sin(lats)
-    coslat = numpy.cos(lats)
-    radii_sqr = radii**2
+    sinlon, coslon, sinlat, coslat, radii, radii_sqr = _get_points(points,
+        index)
     # Start the numerical integration
-    result = numpy.zeros(len(lons), numpy.float)
-    for i in xrange(order):
-        coslon = numpy.cos(lons - lonc[i])
-        for j in xrange(order):
-            for k in xrange(order):
+    result = numpy.zeros(len(index), numpy.float)
+    for i in xrange(nlon):
+        cosdlon = coslon*coslonc[i] + sinlon*sinlonc[i]
+        for j in xrange(nlat):
+            for k in xrange(nr):
                 l_sqr = (radii_sqr + rc[k]**2 -
                          2.*radii*rc[k]*(
-                            sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
+                            sinlat*sinlatc[j] + coslat*coslatc[j]*cosdlon))
                 kappa = (rc[k]**2)*coslatc[j]
-                result += (weights[i]*weights[j]*weights[k]*
+                result += (wlon[i]*wlat[j]*wr[k]*
                     kappa/numpy.sqrt(l_sqr))
     result *= scale
     return result
 
-def gx(tesseroid, lons, lats, radii, nodes, weights):
+def gx(tesseroid, points, index, nodes, weights):
     """
     Integrate gx using the Gauss-Legendre Quadrature
     """
-    order = len(nodes)
+    nlon, nlat, nr = [len(n) for n in nodes]
+    wlon, wlat, wr = weights
     lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
     # Pre-compute sines, cossines and powers
+    sinlonc = numpy.sin(lonc)
+    coslonc = numpy.cos(lonc)
     sinlatc = numpy.sin(latc)
     coslatc = numpy.cos(latc)
-    sinlat = numpy.sin(lats)
-    coslat = numpy.cos(lats)
-    radii_sqr = radii**2
+    sinlon, coslon, sinlat, coslat, radii, radii_sqr = _get_points(points,
+        index)
     # Start the numerical integration
-    result = numpy.zeros(len(lons), numpy.float)
-    for i in xrange(order):
-        coslon = numpy.cos(lons - lonc[i])
-        for j in xrange(order):
-            kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
-            for k in xrange(order):
+    result = numpy.zeros(len(index), numpy.float)
+    for i in xrange(nlon):
+        cosdlon = coslon*coslonc[i] + sinlon*sinlonc[i]
+        for j in xrange(nlat):
+            kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*cosdlon
+            for k in xrange(nr):
                 l_sqr = (radii_sqr + rc[k]**2 -
                          2.*radii*rc[k]*(
-                            sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
+                            sinlat*sinlatc[j] + coslat*coslatc[j]*cosdlon))
                 kappa = (rc[k]**2)*coslatc[j]
-                result += (weights[i]*weights[j]*weights[k]*
+                result += (wlon[i]*wlat[j]*wr[k]*
                     kappa*rc[k]*kphi/(l_sqr**1.5))
     result *= scale
     return result
 
-def gy(tesseroid, lons, lats, radii, nodes, weights):
+def gy(tesseroid, points, index, nodes, weights):
     """
     Integrate gy using the Gauss-Legendre Quadrature
     """
-    order = len(nodes)
+    nlon, nlat, nr = [len(n) for n in nodes]
+    wlon, wlat, wr = weights
     lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
     # Pre-compute sines, cossines and powers
+    sinlonc = numpy.sin(lonc)
+    coslonc = numpy.cos(lonc)
     sinlatc = numpy.sin(latc)
     coslatc = numpy.cos(latc)
-    sinlat = numpy.sin(lats)
-    coslat = numpy.cos(lats)
-    radii_sqr = radii**2
+    sinlon, coslon, sinlat, coslat, radii, radii_sqr = _get_points(points,
+        index)
     # Start the numerical integration
-    result = numpy.zeros(len(lons), numpy.float)
-    for i in xrange(order):
-        coslon = numpy.cos(lons - lonc[i])
-        sinlon = numpy.sin(lonc[i] - lons)
-        for j in xrange(order):
-            for k in xrange(order):
+    result = numpy.zeros(len(index), numpy.float)
+    for i in xrange(nlon):
+        cosdlon = coslon*coslonc[i] + sinlon*sinlonc[i]
+        sindlon = sinlonc[i]*coslon - coslonc[i]*sinlon
+        for j in xrange(nlat):
+            for k in xrange(nr):
                 l_sqr = (radii_sqr + rc[k]**2 -
                          2.*radii*rc[k]*(
-                            sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
+                            sinlat*sinlatc[j] + coslat*coslatc[j]*cosdlon))
                 kappa = (rc[k]**2)*coslatc[j]
-                result += (weights[i]*weights[j]*weights[k]*
-                    kappa*rc[k]*coslatc[j]*sinlon/(l_sqr**1.5))
+                result += (wlon[i]*wlat[j]*wr[k]*
+                    kappa*rc[k]*coslatc[j]*sindlon/(l_sqr**1.5))
     result *= scale
     return result
 
-def gz(tesseroid, lons, lats, radii, nodes, weights):
+def gz(tesseroid, points, index, nodes, weights):
     """
     Integrate gz using the Gauss-Legendre Quadrature
     """
-    order = len(nodes)
+    nlon, nlat, nr = [len(n) for n in nodes]
+    wlon, wlat, wr = weights
     lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
     # Pre-compute sines, cossines and powers
+    sinlonc = numpy.sin(lonc)
+    coslonc = numpy.cos(lonc)
     sinlatc = numpy.sin(latc)
     coslatc = numpy.cos(latc)
-    sinlat = numpy.sin(lats)
-    coslat = numpy.cos(lats)
-    radii_sqr = radii**2
+    sinlon, coslon, sinlat, coslat, radii, radii_sqr = _get_points(points,
+        index)
     # Start the numerical integration
-    result = numpy.zeros(len(lons), numpy.float)
-    for i in xrange(order):
-        coslon = numpy.cos(lons - lonc[i])
-        for j in xrange(order):
-            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-            for k in xrange(order):
+    result = numpy.zeros(len(index), numpy.float)
+    for i in xrange(nlon):
+        cosdlon = coslon*coslonc[i] + sinlon*sinlonc[i]
+        for j in xrange(nlat):
+            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*cosdlon
+            for k in xrange(nr):
                 l_sqr = (radii_sqr + rc[k]**2 -
                          2.*radii*rc[k]*(
-                            sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
+                            sinlat*sinlatc[j] + coslat*coslatc[j]*cosdlon))
                 kappa = (rc[k]**2)*coslatc[j]
-                result += (weights[i]*weights[j]*weights[k]*
+                result += (wlon[i]*wlat[j]*wr[k]*
                     kappa*(rc[k]*cospsi - radii)/(l_sqr**1.5))
     result *= scale
     return result
 
-def gxx(tesseroid, lons, lats, radii, nodes, weights):
+def gxx(tesseroid, points, index, nodes, weights):
     """
     Integrate gxx using the Gauss-Legendre Quadrature
     """
-    order = len(nodes)
+    nlon, nlat, nr = [len(n) for n in nodes]
+    wlon, wlat, wr = weights
     lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
     # Pre-compute sines, cossines and powers
+    sinlonc = numpy.sin(lonc)
+    coslonc = numpy.cos(lonc)
     sinlatc = numpy.sin(latc)
     coslatc = numpy.cos(latc)
-    sinlat = numpy.sin(lats)
-    coslat = numpy.cos(lats)
-    radii_sqr = radii**2
+    sinlon, coslon, sinlat, coslat, radii, radii_sqr = _get_points(points,
+        index)
     # Start the numerical integration
-    result = numpy.zeros(len(lons), numpy.float)
-    for i in xrange(order):
-        coslon = numpy.cos(lons - lonc[i])
-        for j in xrange(order):
-            kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
-            for k in xrange(order):
+    result = numpy.zeros(len(index), numpy.float)
+    for i in xrange(nlon):
+        cosdlon = coslon*coslonc[i] + sinlon*sinlonc[i]
+        for j in xrange(nlat):
+            kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*cosdlon
+            for k in xrange(nr):
                 l_sqr = (radii_sqr + rc[k]**2 -
                          2.*radii*rc[k]*(
-                            sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
+                            sinlat*sinlatc[j] + coslat*coslatc[j]*cosdlon))
                 kappa = (rc[k]**2)*coslatc[j]
-                result += (weights[i]*weights[j]*weights[k]*
+                result += (wlon[i]*wlat[j]*wr[k]*
                     kappa*(3.*((rc[k]*kphi)**2) - l_sqr)/(l_sqr**2.5))
     result *= scale
     return result
 
-def gxy(tesseroid, lons, lats, radii, nodes, weights):
+def gxy(tesseroid, points, index, nodes, weights):
     """
     Integrate gxy using the Gauss-Legendre Quadrature
     """
-    order = len(nodes)
+    nlon, nlat, nr = [len(n) for n in nodes]
+    wlon, wlat, wr = weights
     lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
     # Pre-compute sines, cossines and powers
+    sinlonc = numpy.sin(lonc)
+    coslonc = numpy.cos(lonc)
     sinlatc = numpy.sin(latc)
     coslatc = numpy.cos(latc)
-    sinlat = numpy.sin(lats)
-    coslat = numpy.cos(lats)
-    radii_sqr = radii**2
+    sinlon, coslon, sinlat, coslat, radii, radii_sqr = _get_points(points,
+        index)
     # Start the numerical integration
-    result = numpy.zeros(len(lons), numpy.float)
-    for i in xrange(order):
-        coslon = numpy.cos(lons - lonc[i])
-        sinlon = numpy.sin(lonc[i] - lons)
-        for j in xrange(order):
-            kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
-            for k in xrange(order):
+    result = numpy.zeros(len(index), numpy.float)
+    for i in xrange(nlon):
+        cosdlon = coslon*coslonc[i] + sinlon*sinlonc[i]
+        sindlon = sinlonc[i]*coslon - coslonc[i]*sinlon
+        for j in xrange(nlat):
+            kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*cosdlon
+            for k in xrange(nr):
                 l_sqr = (radii_sqr + rc[k]**2 -
                          2.*radii*rc[k]*(
-                            sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
+                            sinlat*sinlatc[j] + coslat*coslatc[j]*cosdlon))
                 kappa = (rc[k]**2)*coslatc[j]
-                result += (weights[i]*weights[j]*weights[k]*
-                    kappa*3.*(rc[k]**2)*kphi*coslatc[j]*sinlon/(l_sqr**2.5))
+                result += (wlon[i]*wlat[j]*wr[k]*
+                    kappa*3.*(rc[k]**2)*kphi*coslatc[j]*sindlon/(l_sqr**2.5))
     result *= scale
     return result
 
-def gxz(tesseroid, lons, lats, radii, nodes, weights):
+def gxz(tesseroid, points, index, nodes, weights):
     """
     Integrate gxz using the Gauss-Legendre Quadrature
     """
-    order = len(nodes)
+    nlon, nlat, nr = [len(n) for n in nodes]
+    wlon, wlat, wr = weights
     lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
     # Pre-compute sines, cossines and powers
+    sinlonc = numpy.sin(lonc)
+    coslonc = numpy.cos(lonc)
     sinlatc = numpy.sin(latc)
     coslatc = numpy.cos(latc)
-    sinlat = numpy.sin(lats)
-    coslat = numpy.cos(lats)
-    radii_sqr = radii**2
+    sinlon, coslon, sinlat, coslat, radii, radii_sqr = _get_points(points,
+        index)
     # Start the numerical integration
-    result = numpy.zeros(len(lons), numpy.float)
-    for i in xrange(order):
-        coslon = numpy.cos(lons - lonc[i])
-        for j in xrange(order):
-            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-            kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*coslon
-            for k in xrange(order):
+    result = numpy.zeros(len(index), numpy.float)
+    for i in xrange(nlon):
+        cosdlon = coslon*coslonc[i] + sinlon*sinlonc[i]
+        for j in xrange(nlat):
+            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*cosdlon
+            kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*cosdlon
+            for k in xrange(nr):
                 l_sqr = (radii_sqr + rc[k]**2 -
                          2.*radii*rc[k]*(
-                            sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
+                            sinlat*sinlatc[j] + coslat*coslatc[j]*cosdlon))
                 kappa = (rc[k]**2)*coslatc[j]
-                result += (weights[i]*weights[j]*weights[k]*
+                result += (wlon[i]*wlat[j]*wr[k]*
                     kappa*3.*rc[k]*kphi*(rc[k]*cospsi - radii)/(l_sqr**2.5))
     result *= scale
     return result
 
-def gyy(tesseroid, lons, lats, radii, nodes, weights):
+def gyy(tesseroid, points, index, nodes, weights):
     """
     Integrate gyy using the Gauss-Legendre Quadrature
     """
-    order = len(nodes)
+    nlon, nlat, nr = [len(n) for n in nodes]
+    wlon, wlat, wr = weights
     lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
     # Pre-compute sines, cossines and powers
+    sinlonc = numpy.sin(lonc)
+    coslonc = numpy.cos(lonc)
     sinlatc = numpy.sin(latc)
     coslatc = numpy.cos(latc)
-    sinlat = numpy.sin(lats)
-    coslat = numpy.cos(lats)
-    radii_sqr = radii**2
+    sinlon, coslon, sinlat, coslat, radii, radii_sqr = _get_points(points,
+        index)
     # Start the numerical integration
-    result = numpy.zeros(len(lons), numpy.float)
-    for i in xrange(order):
-        coslon = numpy.cos(lons - lonc[i])
-        sinlon = numpy.sin(lonc[i] - lons)
-        for j in xrange(order):
-            for k in xrange(order):
+    result = numpy.zeros(len(index), numpy.float)
+    for i in xrange(nlon):
+        cosdlon = coslon*coslonc[i] + sinlon*sinlonc[i]
+        sindlon = sinlonc[i]*coslon - coslonc[i]*sinlon
+        for j in xrange(nlat):
+            for k in xrange(nr):
                 l_sqr = (radii_sqr + rc[k]**2 -
                          2.*radii*rc[k]*(
-                            sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
+                            sinlat*sinlatc[j] + coslat*coslatc[j]*cosdlon))
                 kappa = (rc[k]**2)*coslatc[j]
-                deltay = rc[k]*coslatc[j]*sinlon
-                result += (weights[i]*weights[j]*weights[k]*
+                deltay = rc[k]*coslatc[j]*sindlon
+                result += (wlon[i]*wlat[j]*wr[k]*
                     kappa*(3.*(deltay**2) - l_sqr)/(l_sqr**2.5))
     result *= scale
     return result
 
-def gyz(tesseroid, lons, lats, radii, nodes, weights):
+def gyz(tesseroid, points, index, nodes, weights):
     """
     Integrate gyz using the Gauss-Legendre Quadrature
     """
-    order = len(nodes)
+    nlon, nlat, nr = [len(n) for n in nodes]
+    wlon, wlat, wr = weights
     lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
     # Pre-compute sines, cossines and powers
+    sinlonc = numpy.sin(lonc)
+    coslonc = numpy.cos(lonc)
     sinlatc = numpy.sin(latc)
     coslatc = numpy.cos(latc)
-    sinlat = numpy.sin(lats)
-    coslat = numpy.cos(lats)
-    radii_sqr = radii**2
+    sinlon, coslon, sinlat, coslat, radii, radii_sqr = _get_points(points,
+        index)
     # Start the numerical integration
-    result = numpy.zeros(len(lons), numpy.float)
-    for i in xrange(order):
-        coslon = numpy.cos(lons - lonc[i])
-        sinlon = numpy.sin(lonc[i]- lons)
-        for j in xrange(order):
-            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-            for k in xrange(order):
+    result = numpy.zeros(len(index), numpy.float)
+    for i in xrange(nlon):
+        cosdlon = coslon*coslonc[i] + sinlon*sinlonc[i]
+        sindlon = sinlonc[i]*coslon - coslonc[i]*sinlon
+        for j in xrange(nlat):
+            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*cosdlon
+            for k in xrange(nr):
                 l_sqr = (radii_sqr + rc[k]**2 -
                          2.*radii*rc[k]*(
-                            sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
+                            sinlat*sinlatc[j] + coslat*coslatc[j]*cosdlon))
                 kappa = (rc[k]**2)*coslatc[j]
-                deltay = rc[k]*coslatc[j]*sinlon
+                deltay = rc[k]*coslatc[j]*sindlon
                 deltaz = rc[k]*cospsi - radii
-                result += (weights[i]*weights[j]*weights[k]*
+                result += (wlon[i]*wlat[j]*wr[k]*
                     kappa*3.*deltay*deltaz/(l_sqr**2.5))
     result *= scale
     return result
 
-def gzz(tesseroid, lons, lats, radii, nodes, weights):
+def gzz(tesseroid, points, index, nodes, weights):
     """
     Integrate gzz using the Gauss-Legendre Quadrature
     """
-    order = len(nodes)
+    nlon, nlat, nr = [len(n) for n in nodes]
+    wlon, wlat, wr = weights
     lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
     # Pre-compute sines, cossines and powers
+    sinlonc = numpy.sin(lonc)
+    coslonc = numpy.cos(lonc)
     sinlatc = numpy.sin(latc)
     coslatc = numpy.cos(latc)
-    sinlat = numpy.sin(lats)
-    coslat = numpy.cos(lats)
-    radii_sqr = radii**2
+    sinlon, coslon, sinlat, coslat, radii, radii_sqr = _get_points(points,
+        index)
     # Start the numerical integration
-    result = numpy.zeros(len(lons), numpy.float)
-    for i in xrange(order):
-        coslon = numpy.cos(lons - lonc[i])
-        for j in xrange(order):
-            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*coslon
-            for k in xrange(order):
+    result = numpy.zeros(len(index), numpy.float)
+    for i in xrange(nlon):
+        cosdlon = coslon*coslonc[i] + sinlon*sinlonc[i]
+        for j in xrange(nlat):
+            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*cosdlon
+            for k in xrange(nr):
                 l_sqr = (radii_sqr + rc[k]**2 -
                          2.*radii*rc[k]*(
-                            sinlat*sinlatc[j] + coslat*coslatc[j]*coslon))
+                            sinlat*sinlatc[j] + coslat*coslatc[j]*cosdlon))
                 kappa = (rc[k]**2)*coslatc[j]
                 deltaz = rc[k]*cospsi - radii
-                result += weights[i]*weights[j]*weights[k]*kappa*(
+                result += wlon[i]*wlat[j]*wr[k]*kappa*(
                     3.*deltaz**2 - l_sqr)/(l_sqr**2.5)
     result *= scale
     return result
+
+def fields(tesseroid, points, index, nodes, weights, codes):
+    """
+    Integrate several components at once using the Gauss-Legendre Quadrature
+
+    The distances and trigonometric terms are computed only once per node and
+    shared by all components. *codes* are the integer codes of the components
+    (0=potential, 1=gx, 2=gy, 3=gz, 4=gxx, 5=gxy, 6=gxz, 7=gyy, 8=gyz,
+    9=gzz). Returns an array with one row per code.
+    """
+    nlon, nlat, nr = [len(n) for n in nodes]
+    wlon, wlat, wr = weights
+    lonc, latc, rc, scale = _scale_nodes(tesseroid, nodes)
+    # Pre-compute sines, cossines and powers
+    sinlonc = numpy.sin(lonc)
+    coslonc = numpy.cos(lonc)
+    sinlatc = numpy.sin(latc)
+    coslatc = numpy.cos(latc)
+    sinlon, coslon, sinlat, coslat, radii, radii_sqr = _get_points(points,
+        index)
+    # Start the numerical integration
+    result = numpy.zeros((len(codes), len(index)), numpy.float)
+    for i in xrange(nlon):
+        cosdlon = coslon*coslonc[i] + sinlon*sinlonc[i]
+        sindlon = sinlonc[i]*coslon - coslonc[i]*sinlon
+        for j in xrange(nlat):
+            cospsi = sinlat*sinlatc[j] + coslat*coslatc[j]*cosdlon
+            kphi = coslat*sinlatc[j] - sinlat*coslatc[j]*cosdlon
+            for k in xrange(nr):
+                l_sqr = radii_sqr + rc[k]**2 - 2.*radii*rc[k]*cospsi
+                kappa = (rc[k]**2)*coslatc[j]
+                wkappa = wlon[i]*wlat[j]*wr[k]*kappa
+                l = numpy.sqrt(l_sqr)
+                l_3 = l_sqr*l
+                l_5 = l_3*l_sqr
+                deltax = rc[k]*kphi
+                deltay = rc[k]*coslatc[j]*sindlon
+                deltaz = rc[k]*cospsi - radii
+                for c, code in enumerate(codes):
+                    if code == 0:
+                        result[c] += wkappa/l
+                    elif code == 1:
+                        result[c] += wkappa*deltax/l_3
+                    elif code == 2:
+                        result[c] += wkappa*deltay/l_3
+                    elif code == 3:
+                        result[c] += wkappa*deltaz/l_3
+                    elif code == 4:
+                        result[c] += wkappa*(3.*deltax**2 - l_sqr)/l_5
+                    elif code == 5:
+                        result[c] += wkappa*3.*deltax*deltay/l_5
+                    elif code == 6:
+                        result[c] += wkappa*3.*deltax*deltaz/l_5
+                    elif code == 7:
+                        result[c] += wkappa*(3.*deltay**2 - l_sqr)/l_5
+                    elif code == 8:
+                        result[c] += wkappa*3.*deltay*deltaz/l_5
+                    elif code == 9:
+                        result[c] += wkappa*(3.*deltaz**2 - l_sqr)/l_5
+    result *= scale
+    return result
+
+def cells(w, e, s, n, top, bottom, factors, points, index, nodes, weights,
+    codes):
+    """
+    Integrate several components for many tesseroids given by arrays of
+    bounds (as returned by TesseroidMesh.get_cell_bounds)
+
+    Returns the sum of the effects of the tesseroids, each multiplied by its
+    value in *factors*.
+    """
+    result = numpy.zeros((len(codes), len(index)), numpy.float)
+    for t in xrange(len(w)):
+        tesseroid = Tesseroid(w[t], e[t], s[t], n[t], top[t], bottom[t])
+        result += factors[t]*fields(tesseroid, points, index, nodes, weights,
+                                    codes)
+    return result
@@ -10,8 +10,25 @@ the layer. Use :mod:`fatiando.gravmag.sphere` for forward modeling.
 
 * :func:`~fatiando.gravmag.eqlayer.classic`: The classic equivalent layer with
   damping regularization formulated in the data space
+* :func:`~fatiando.gravmag.eqlayer.fftclassic`: Same as the classic equivalent
+  layer but without forming the sensitivity matrix (uses FFTs). Only for data
+  on the same regular grid as the layer.
 * :func:`~fatiando.gravmag.eqlayer.pel`: The polynomial equivalent layer of
   Oliveira Jr et al. (2012). A more efficient and robust algorithm.
+* :func:`~fatiando.gravmag.eqlayer.classicsweep` and
+  :func:`~fatiando.gravmag.eqlayer.pelsweep`: Run the classic or polynomial
+  equivalent layers for many values of the regularization parameters at
+  once, with the residual norm, estimate norm and GCV of each (to choose the
+  parameters)
+* :func:`~fatiando.gravmag.eqlayer.windowed`: The classic equivalent layer
+  solved on overlapping windows (in parallel) and blended together. For very
+  large surveys.
+
+**Transformations**
+
+* :class:`~fatiando.gravmag.eqlayer.Transformer`: Calculate other data
+  (continued, reduced to the pole, etc.) from an estimated layer, in blocks of
+  points and in parallel
 
 **Data containers**
 
@@ -30,12 +47,28 @@ equivalent layer, Geophysics, 78(1), G1-G13, doi:10.1190/geo2012-0196.1.
 ----
 
 """
+import itertools
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+from math import sqrt
+
 import numpy
-from scipy.sparse import linalg, lil_matrix, csc_matrix
+import scipy.linalg
+from scipy.sparse import linalg, lil_matrix, csc_matrix, block_diag
 
-from fatiando.gravmag import sphere as kernel
+from fatiando.constants import G, SI2MGAL, CM, T2NT
+from fatiando.mesher import PointGrid
 from fatiando import utils
 
+# Number of elements of the sensitivity matrix calculated at once
+BLOCKSIZE = 2**14
+# Number of elements of the GB matrix of the PEL calculated at once. Each
+# block also makes a full Hessian (number of coefficients squared) that is
+# added to the total. With blocks of BLOCKSIZE elements, there are only a few
+# data points per block and adding the Hessians takes as long as calculating
+# them. Larger blocks make that cost negligible.
+PEL_BLOCKSIZE = 64*BLOCKSIZE
 
 class Data(object):
     """
@@ -49,6 +82,51 @@ class Data(object):
         self.data = data
         self.size = len(data)
 
+    def sensitivity(self, grid, out=None, dtype=float, njobs=1):
+        """
+        Calculate the sensitivity matrix of the data to the sources in *grid*.
+
+        The effects of all sources are calculated at once on blocks of data
+        points (of about BLOCKSIZE matrix elements each).
+
+        Parameters:
+
+        * grid : :class:`fatiando.mesher.PointGrid`
+            The equivalent layer
+        * out : None or 2d array
+            Where to put the matrix (shape ``(data.size, grid.size)``). If
+            None, will make a new array.
+        * dtype : numpy dtype
+            The type of the new array if *out* is None. Use ``numpy.float32``
+            to use half the memory.
+        * njobs : int or None
+            Number of threads used to calculate the blocks. If None, will use
+            the number of CPUs.
+
+        Returns:
+
+        * sensitivity : 2d array
+            The sensitivity matrix (*out* if given)
+
+        """
+        if out is None:
+            out = numpy.empty((self.size, grid.size), dtype=dtype)
+        if out.shape != (self.size, grid.size):
+            raise ValueError("out must have shape %s" % (str((self.size,
+                                                              grid.size))))
+        def fill(rows):
+            out[rows] = self._kernel(self.x[rows], self.y[rows], self.z[rows],
+                                     grid)
+        _blocks(fill, self.size, grid.size, njobs)
+        return out
+
+    def _kernel(self, x, y, z, grid):
+        """
+        The effect of each source in *grid* (columns) with unit physical
+        property on the data points x, y, z (rows).
+        """
+        raise NotImplementedError("Data set doesn't have a kernel")
+
 class Gz(Data):
     """
     A container for data of the gravity anomaly.
@@ -68,12 +146,14 @@ class Gz(Data):
     def __init__(self, x, y, z, data):
         Data.__init__(self, x, y, z, data)
 
-    def sensitivity(self, grid):
-        x, y, z = self.x, self.y, self.z
-        sens = numpy.empty((self.size, len(grid)), dtype=float)
-        for i, s in enumerate(grid):
-            sens[:,i] = kernel.gz(x, y, z, [s], dens=1.)
-        return sens
+    def _kernel(self, x, y, z, grid):
+        # Same as fatiando.gravmag.sphere.gz with all sources at once
+        dx, dy, dz = _differences(x, y, z, grid)
+        r_cb = _distance_cubed(dx, dy, dz)
+        mass = 4.*numpy.pi*(grid.radius**3)/3.
+        dz *= G*SI2MGAL*mass
+        dz /= r_cb
+        return dz
 
 class TotalField(Data):
     """
@@ -113,16 +193,140 @@ class TotalField(Data):
         else:
             self.sdec = sdec
 
-    def sensitivity(self, grid):
-        x, y, z = self.x, self.y, self.z
-        inc, dec = self.inc, self.dec
-        mag = utils.dircos(self.sinc, self.sdec)
-        sens = numpy.empty((self.size, len(grid)), dtype=float)
-        for i, s in enumerate(grid):
-            sens[:,i] = kernel.tf(x, y, z, [s], inc, dec, pmag=mag)
-        return sens
+    def _kernel(self, x, y, z, grid):
+        # Same as fatiando.gravmag.sphere.tf with all sources at once
+        fx, fy, fz = utils.dircos(self.inc, self.dec)
+        mx, my, mz = utils.dircos(self.sinc, self.sdec)
+        dx, dy, dz = _differences(x, y, z, grid)
+        dotprod = mx*dx + my*dy + mz*dz
+        fdotr = fx*dx + fy*dy + fz*dz
+        r_sqr = dx**2 + dy**2 + dz**2
+        r5 = _distance_cubed(dx, dy, dz)
+        r5 *= r_sqr
+        moment = 4.*numpy.pi*(grid.radius**3)/3.
+        # 3(m.r)(f.r) - r^2(f.m) without more temporary arrays
+        dotprod *= fdotr
+        dotprod *= 3.
+        r_sqr *= fx*mx + fy*my + fz*mz
+        dotprod -= r_sqr
+        dotprod *= CM*T2NT*moment
+        dotprod /= r5
+        return dotprod
+
+class Transformer(object):
+    """
+    Calculate data from an estimated equivalent layer.
+
+    Use this to do the transformations (continuation, reduction to the pole,
+    etc.) after estimating the layer with
+    :func:`~fatiando.gravmag.eqlayer.classic`,
+    :func:`~fatiando.gravmag.eqlayer.pel`, etc. The targets are data
+    containers (like :class:`~fatiando.gravmag.eqlayer.TotalField`) with the
+    points and kind of data to calculate. For example, a ``Gz`` at a
+    different height for upward continuation or a ``TotalField`` with
+    ``inc=90`` for reduction to the pole. Their data values are not used.
+
+    The data are calculated on blocks of target points (of about BLOCKSIZE
+    matrix elements each), so the memory used doesn't depend on the number of
+    target points.
+
+    Parameters:
+
+    * layer : :class:`fatiando.mesher.PointGrid`
+        The equivalent layer
+
+    * estimate : 1D array
+        The estimated physical property of each point in *layer*
+
+    * njobs : int or None
+        Number of threads used to calculate the blocks. If None, will use the
+        number of CPUs.
+
+    Example::
+
+        estimate, predicted = classic(data, layer, damping=0.01)
+        transform = Transformer(layer, estimate)
+        upward = transform(Gz(x, y, z - 500, numpy.zeros(len(x))))
+
+    """
+
+    def __init__(self, layer, estimate, njobs=1):
+        estimate = numpy.asarray(estimate, dtype=float)
+        if estimate.shape != (layer.size,):
+            raise ValueError("Need one estimated value per point of the layer")
+        self.layer = layer
+        self.estimate = estimate
+        self.njobs = njobs
+
+    def __call__(self, target, out=None):
+        """
+        Calculate the data of a target from the layer.
+
+        Parameters:
+
+        * target : data container
+            The points and kind of data to calculate (like
+            :class:`~fatiando.gravmag.eqlayer.Gz`)
+        * out : None or 1D array
+            Where to put the data. If None, will make a new array.
+
+        Returns:
+
+        * data : 1D array
+            The calculated data (*out* if given)
+
+        """
+        if out is None:
+            out = numpy.empty(target.size, dtype=float)
+        if out.shape != (target.size,):
+            raise ValueError("out must have shape %s" % (str((target.size,))))
+        def fill(rows):
+            kernel = target._kernel(target.x[rows], target.y[rows],
+                                    target.z[rows], self.layer)
+            out[rows] = numpy.dot(kernel, self.estimate)
+        _blocks(fill, target.size, self.layer.size, self.njobs)
+        return out
+
+def _blocks(fill, size, columns, njobs):
+    """
+    Call *fill* with slices of the *size* rows of a matrix with *columns*
+    columns. Each slice has about BLOCKSIZE elements.
+    """
+    if njobs is None:
+        njobs = multiprocessing.cpu_count()
+    step = max(1, BLOCKSIZE//max(columns, 1))
+    blocks = [slice(i, i + step) for i in xrange(0, size, step)]
+    if njobs > 1 and len(blocks) > 1:
+        pool = ThreadPool(njobs)
+        try:
+            pool.map(fill, blocks)
+        finally:
+            pool.close()
+    else:
+        for rows in blocks:
+            fill(rows)
+
+def _differences(x, y, z, grid):
+    """
+    The x, y, z distances from the data points (rows) to the sources in
+    *grid* (columns).
+    """
+    dx = grid.x - x[:,numpy.newaxis]
+    dy = grid.y - y[:,numpy.newaxis]
+    dz = numpy.empty(dx.shape, dtype=dx.dtype)
+    dz[:] = grid.z - z[:,numpy.newaxis]
+    return dx, dy, dz
 
-def classic(data, layer, damping=0.):
+def _distance_cubed(dx, dy, dz):
+    """
+    Calculate (dx**2 + dy**2 + dz**2)**1.5 faster than with a power.
+    """
+    r_sqr = dx**2
+    r_sqr += dy**2
+    r_sqr += dz**2
+    return r_sqr*numpy.sqrt(r_sqr)
+
+def classic(data, layer, damping=0., dtype=float, njobs=1):
     """
     The classic equivalent layer in the data space with damping regularization.
 
@@ -142,6 +346,14 @@ def classic(data, layer, damping=0.):
         Need to apply enough for the data fit to not be perfect but reflect the
         error in the data.
 
+    * dtype : numpy dtype
+        The type used to store the sensitivity matrix. Use ``numpy.float32``
+        to use half the memory.
+
+    * njobs : int or None
+        Number of threads used to calculate the sensitivity matrix. If None,
+        will use the number of CPUs.
+
     Returns:
 
     * [estimate, predicted] : array, list of arrays
@@ -150,14 +362,7 @@ def classic(data, layer, damping=0.):
         *data*
 
     """
-    ndata = sum(d.size for d in data)
-    sensitivity = numpy.empty((ndata, layer.size), dtype=float)
-    datavec = numpy.empty(ndata, dtype=float)
-    bottom = 0
-    for d in data:
-        sensitivity[bottom:bottom + d.size, :] = d.sensitivity(layer)
-        datavec[bottom:bottom + d.size] = d.data
-        bottom += d.size
+    sensitivity, datavec = _stack(data, layer, dtype, njobs)
     system = numpy.dot(sensitivity, sensitivity.T)
     if damping != 0.:
         order = len(system)
@@ -166,14 +371,485 @@ def classic(data, layer, damping=0.):
         system[diag, diag] += damping*scale
     tmp = linalg.cg(system, datavec)[0]
     estimate = numpy.dot(sensitivity.T, tmp)
-    pred = numpy.dot(sensitivity, estimate)
-    predicted = []
+    predicted = _unstack(numpy.dot(sensitivity, estimate), data)
+    return estimate, predicted
+
+def classicsweep(data, layer, damping, decomposition=None, dtype=float,
+                 njobs=1):
+    """
+    The classic equivalent layer for many values of the damping parameter.
+
+    Calculates the eigendecomposition of the data space system (without
+    damping) once. The solution for each *damping* value then costs only a
+    few matrix-vector products. Also calculates the norm of the residuals, the
+    norm of the estimate and the Generalized Cross-Validation (GCV) function
+    for each value. Use them to choose the damping (e.g., the minimum of the
+    GCV or the corner of the L-curve, the norm of the estimate against the
+    norm of the residuals). The estimates are the same as the ones of
+    :func:`~fatiando.gravmag.eqlayer.classic` (up to the precision of its
+    conjugate gradient solver).
+
+    Parameters:
+
+    * data : list
+        List of observed data wrapped in data containers (like
+        :class:`~fatiando.gravmag.eqlayer.TotalField`).
+
+    * layer : :class:`fatiando.mesher.PointGrid`
+        The equivalent layer
+
+    * damping : list of floats
+        The values of the damping regularization parameter (see
+        :func:`~fatiando.gravmag.eqlayer.classic`)
+
+    * decomposition : None or list
+        The decomposition returned by a previous run with the same data and
+        layer. Use it to try more damping values without calculating it
+        again. WARNING: if the data or layer changed, the results will be
+        meaningless
+
+    * dtype, njobs
+        Same as in :func:`~fatiando.gravmag.eqlayer.classic`
+
+    Returns:
+
+    * [estimates, predicted, stats, decomposition]
+        *estimates* is a list with the estimated physical property
+        distribution for each damping value. *predicted* is a list with the
+        predicted data vectors (a list as in
+        :func:`~fatiando.gravmag.eqlayer.classic`) for each damping value.
+        *stats* is a dict with arrays of the residual norm (``'residuals'``),
+        estimate norm (``'norm'``) and GCV (``'gcv'``) for each damping value.
+        *decomposition* is a list with the cached eigendecomposition.
+
+    """
+    if decomposition is None:
+        sensitivity, datavec = _stack(data, layer, dtype, njobs)
+        system = numpy.dot(sensitivity, sensitivity.T)
+        scale = float(numpy.trace(system))/len(system)
+        values, vectors = numpy.linalg.eigh(system)
+        del system
+        # The estimate is G^T V (Lambda + mu I)^-1 V^T d
+        projected = numpy.dot(sensitivity.T, vectors)
+        decomposition = [values, vectors, projected, scale]
+    else:
+        datavec = numpy.concatenate([d.data for d in data])
+    values, vectors, projected, scale = decomposition
+    values = numpy.maximum(values, 0.)
+    rotated = numpy.dot(vectors.T, datavec)
+    # Eigenvalues that are zero to the machine precision are ignored
+    # (pseudo-inverse) when there is no damping
+    tiny = values.max()*len(values)*numpy.finfo(float).eps
+    estimates, predicted = [], []
+    stats = dict((k, numpy.empty(len(damping))) for k in
+                 ['residuals', 'norm', 'gcv'])
+    for i, value in enumerate(damping):
+        shift = value*scale
+        total = values + shift
+        inverse = numpy.zeros_like(total)
+        inverse[total > tiny] = 1./total[total > tiny]
+        estimate = numpy.dot(projected, inverse*rotated)
+        filters = values*inverse
+        estimates.append(estimate)
+        predicted.append(_unstack(numpy.dot(vectors, filters*rotated), data))
+        residuals = numpy.linalg.norm((1. - filters)*rotated)
+        stats['residuals'][i] = residuals
+        stats['norm'][i] = numpy.linalg.norm(estimate)
+        stats['gcv'][i] = _gcv(residuals, len(values),
+                               numpy.sum(1. - filters))
+    return estimates, predicted, stats, decomposition
+
+def _stack(data, layer, dtype, njobs):
+    """
+    Make the sensitivity matrix of all data sets and the data vector.
+    """
+    ndata = sum(d.size for d in data)
+    sensitivity = numpy.empty((ndata, layer.size), dtype=dtype)
+    datavec = numpy.empty(ndata, dtype=float)
+    bottom = 0
+    for d in data:
+        d.sensitivity(layer, out=sensitivity[bottom:bottom + d.size],
+                      njobs=njobs)
+        datavec[bottom:bottom + d.size] = d.data
+        bottom += d.size
+    return sensitivity, datavec
+
+def _unstack(vector, data):
+    """
+    Split a vector of all data sets into one vector per data set.
+    """
+    split = []
     start = 0
     for d in data:
-        predicted.append(pred[start:start + d.size])
+        split.append(vector[start:start + d.size])
         start += d.size
+    return split
+
+def _gcv(residuals, ndata, freedom):
+    """
+    The Generalized Cross-Validation function from the norm of the residuals
+    and the trace of I - H (the degrees of freedom of the residuals, H is the
+    hat matrix).
+    """
+    if freedom <= 0:
+        return numpy.inf
+    return ndata*residuals**2/freedom**2
+
+def fftclassic(data, layer, damping=0., tol=10**(-5), maxit=None):
+    """
+    The classic equivalent layer for data on the same regular grid as the
+    layer.
+
+    Gives the same estimate as :func:`~fatiando.gravmag.eqlayer.classic` but
+    the sensitivity matrix is never formed. If the data points are the
+    points of the layer (but on a different height), the sensitivity matrix is
+    block-Toeplitz. Its products with vectors are done by 2D FFT
+    convolutions with the effect of a single source. Uses O(N) memory and
+    O(N log N) time per conjugate gradient iteration (N is the number of
+    points), so the layer can have millions of points. The conjugate gradient
+    is preconditioned with the circulant matrix that contains the
+    block-Toeplitz one (inverted with FFTs as well), which cuts the number of
+    iterations by about 4 times.
+
+    Parameters:
+
+    * data : list
+        List with one data set wrapped in a data container (like
+        :class:`~fatiando.gravmag.eqlayer.TotalField`). The data must be on a
+        regular grid (see :func:`fatiando.gridder.regular`) with the same area
+        and shape as the *layer* and all at the same height.
+
+    * layer : :class:`fatiando.mesher.PointGrid`
+        The equivalent layer
+
+    * damping : float
+        The ammount of damping regularization to apply. Must be positive!
+        Need to apply enough for the data fit to not be perfect but reflect the
+        error in the data.
+
+    * tol : float
+        The relative tolerance of the conjugate gradient solver
+
+    * maxit : int or None
+        Maximum number of conjugate gradient iterations. If None, no limit
+        besides the solver default.
+
+    Returns:
+
+    * [estimate, predicted] : array, list of arrays
+        *estimate* is the estimated physical property distribution. *predicted*
+        is a list with the predicted data vector
+
+    """
+    if len(data) != 1:
+        raise ValueError("fftclassic takes a single data set")
+    d = data[0]
+    forward, adjoint, trace, approximate = _toeplitz(d, layer)
+    shift = 0.
+    if damping != 0.:
+        shift = damping*trace/d.size
+    def matvec(vector):
+        return forward(adjoint(vector)) + shift*vector
+    def precondition(vector):
+        return approximate(vector, shift)
+    system = linalg.LinearOperator((d.size, d.size), matvec=matvec,
+                                   dtype=float)
+    preconditioner = linalg.LinearOperator((d.size, d.size),
+                                           matvec=precondition, dtype=float)
+    tmp = linalg.cg(system, d.data, tol=tol, maxiter=maxit,
+                    M=preconditioner)[0]
+    estimate = adjoint(tmp)
+    predicted = [forward(estimate)]
     return estimate, predicted
 
+def _toeplitz(data, layer):
+    """
+    Make functions that multiply the block-Toeplitz sensitivity matrix G of
+    *data* on *layer* by a vector using FFTs.
+
+    Returns [forward, adjoint, trace, approximate]: the functions that
+    calculate G*p and G^T*d, the trace of G*G^T and a function that solves
+    (C*C^T + shift*I)*x = d approximately (C is the circulant matrix, see
+    below).
+
+    The sensitivity G[i, j] = K[j - i] depends only on the difference between
+    the grid positions of source j and data point i. K is the effect of a
+    single source on a point at the origin for all possible lags. It is
+    embedded in a circulant matrix of twice the size of the grid. G^T*d is
+    the convolution of d with K and G*p the convolution of p with K flipped
+    (the complex conjugate in the frequency domain). The approximate solution
+    pads d with zeros, divides by the eigenvalues of C*C^T + shift*I in the
+    frequency domain and keeps only the part on the grid.
+
+    >>> from fatiando.mesher import PointGrid
+    >>> from fatiando import gridder
+    >>> layer = PointGrid((0, 30, 0, 20), 10, (5, 7))
+    >>> x, y, z = gridder.regular((0, 30, 0, 20), (5, 7), z=-1)
+    >>> data = Gz(x, y, z, numpy.zeros(layer.size))
+    >>> forward, adjoint, trace, approximate = _toeplitz(data, layer)
+    >>> sens = data.sensitivity(layer)
+    >>> p = numpy.arange(layer.size, dtype=float)
+    >>> numpy.allclose(forward(p), numpy.dot(sens, p))
+    True
+    >>> numpy.allclose(adjoint(p), numpy.dot(sens.T, p))
+    True
+    >>> numpy.allclose(trace, numpy.trace(numpy.dot(sens, sens.T)))
+    True
+
+    """
+    ny, nx = layer.shape
+    if (data.size != layer.size
+        or not numpy.allclose(data.x, layer.x)
+        or not numpy.allclose(data.y, layer.y)):
+        raise ValueError("Data must be on the same grid as the layer")
+    if not numpy.all(data.z == data.z[0]):
+        raise ValueError("Data must be all at the same height")
+    x1, x2, y1, y2 = layer.area
+    lags = PointGrid((x1 - x2, x2 - x1, y1 - y2, y2 - y1), layer.z,
+                     (2*ny - 1, 2*nx - 1))
+    origin = numpy.zeros(1)
+    kernel = data._kernel(origin, origin, data.z[:1], lags)
+    kernel = kernel.reshape(lags.shape)
+    # Number of pairs of points with each lag
+    counts = numpy.outer(ny - numpy.abs(numpy.arange(1 - ny, ny)),
+                         nx - numpy.abs(numpy.arange(1 - nx, nx)))
+    trace = float(numpy.sum(counts*kernel**2))
+    shape = (2*ny, 2*nx)
+    circulant = numpy.zeros(shape)
+    circulant[:2*ny - 1, :2*nx - 1] = kernel
+    circulant = numpy.roll(numpy.roll(circulant, 1 - ny, axis=0), 1 - nx,
+                           axis=1)
+    transform = numpy.fft.rfft2(circulant)
+    power = numpy.abs(transform)**2
+    def convolve(vector, kernel):
+        padded = numpy.zeros(shape)
+        padded[:ny, :nx] = numpy.reshape(vector, (ny, nx))
+        result = numpy.fft.irfft2(kernel*numpy.fft.rfft2(padded), shape)
+        return result[:ny, :nx].ravel()
+    def forward(vector):
+        return convolve(vector, numpy.conj(transform))
+    def adjoint(vector):
+        return convolve(vector, transform)
+    # Keep the approximation invertible without damping
+    floor = 10.**(-10)*power.max()
+    def approximate(vector, shift):
+        return convolve(vector, 1./numpy.maximum(power + shift, floor))
+    return forward, adjoint, trace, approximate
+
+def windowed(data, layer, windows, overlap=0.5, damping=0., targets=None,
+             njobs=1):
+    """
+    The classic equivalent layer solved on overlapping windows.
+
+    The *layer* is divided into windows (see
+    :meth:`fatiando.mesher.PointGrid.split`). Each window is extended by
+    *overlap* times its size on each side and a small classic equivalent
+    layer (see :func:`~fatiando.gravmag.eqlayer.classic`) is estimated using
+    only the data inside the extended window. The estimates, predicted data
+    and *targets* of the windows are blended on the overlaps with weights that
+    are 1 inside the window and go smoothly (cosine taper) to 0 at the edge of
+    the extended window. Use this for surveys that are too large for a single
+    layer. The data don't have to be on a grid.
+
+    The layer of a window only sees the data around it, so the wavelengths
+    longer than the extended windows are not well recovered. Use windows a few
+    times larger than the wavelengths of interest (the bigger the *overlap*,
+    the better and slower).
+
+    The windows are solved in parallel by *njobs* processes and added to the
+    output as they finish. The data arrays can be ``numpy.memmap`` (e.g.,
+    from ``numpy.load(fname, mmap_mode='r')``). Only the coordinates are read
+    at once (to find the points of each window). The rest is read one window
+    at a time.
+
+    Parameters:
+
+    * data : list
+        List of observed data wrapped in data containers (like
+        :class:`~fatiando.gravmag.eqlayer.TotalField`).
+
+    * layer : :class:`fatiando.mesher.PointGrid`
+        The equivalent layer
+
+    * windows : tuple = (ny, nx)
+        The number of windows that the layer will be divided in the y and x
+        directions. The shape of the layer must be divisible by it.
+
+    * overlap : float
+        How much each window is extended on each side, as a fraction of its
+        size. Must be between 0 and 1.
+
+    * damping : float
+        The ammount of damping regularization applied to each window (see
+        :func:`~fatiando.gravmag.eqlayer.classic`)
+
+    * targets : None or list
+        Data containers (like :class:`~fatiando.gravmag.eqlayer.Gz`) with the
+        points and kind of data to calculate from the layer (e.g., at a
+        different height for upward continuation or a ``TotalField`` with
+        ``inc=90`` for reduction to the pole). Their data values are not used.
+
+    * njobs : int or None
+        Number of processes used to solve the windows. If None, will use the
+        number of CPUs.
+
+    Returns:
+
+    * [estimate, predicted] or [estimate, predicted, transformed]
+        *estimate* is the estimated physical property distribution.
+        *predicted* is a list of the predicted data vector in the same order
+        as supplied in *data*. *transformed* is a list of the data calculated
+        on the *targets* (only if *targets* is given).
+
+    """
+    if not 0 <= overlap <= 1:
+        raise ValueError("overlap must be between 0 and 1")
+    if targets is None:
+        datasets = list(data)
+    else:
+        datasets = list(data) + list(targets)
+    ny, nx = windows
+    totaly, totalx = layer.shape
+    if totalx%nx != 0 or totaly%ny != 0:
+        raise ValueError("Layer shape %s is not divisible by windows %s"
+                         % (str(layer.shape), str(windows)))
+    gny, gnx = layer.split(windows)[0].shape
+    x1, x2, y1, y2 = layer.area
+    xs = numpy.linspace(x1, x2, totalx)
+    ys = numpy.linspace(y1, y2, totaly)
+    dx = float(x2 - x1)/max(totalx - 1, 1)
+    dy = float(y2 - y1)/max(totaly - 1, 1)
+    padx, pady = int(round(overlap*gnx)), int(round(overlap*gny))
+    # Sort the points of each data set by window
+    bins = []
+    for d in datasets:
+        column = _window_index(d.x, x1 - 0.5*dx, gnx*dx, nx)
+        row = _window_index(d.y, y1 - 0.5*dy, gny*dy, ny)
+        window = row*nx + column
+        order = numpy.argsort(window, kind='mergesort')
+        starts = numpy.searchsorted(window[order], numpy.arange(nx*ny + 1))
+        bins.append((order, starts))
+    totals = [numpy.zeros(layer.size)]
+    totals.extend(numpy.zeros(d.size) for d in datasets)
+    weights = [numpy.zeros(t.size) for t in totals]
+    def jobs():
+        for i in xrange(ny):
+            for j in xrange(nx):
+                r0, r1 = max(i*gny - pady, 0), min((i + 1)*gny + pady, totaly)
+                c0, c1 = max(j*gnx - padx, 0), min((j + 1)*gnx + padx, totalx)
+                local = PointGrid([xs[c0], xs[c1 - 1], ys[r0], ys[r1 - 1]],
+                                  layer.z, (r1 - r0, c1 - c0))
+                # The window and the extended window (unbounded on the
+                # borders of the layer)
+                core = [
+                    xs[j*gnx] - 0.5*dx if j > 0 else -numpy.inf,
+                    xs[(j + 1)*gnx - 1] + 0.5*dx if j < nx - 1 else numpy.inf,
+                    ys[i*gny] - 0.5*dy if i > 0 else -numpy.inf,
+                    ys[(i + 1)*gny - 1] + 0.5*dy if i < ny - 1 else numpy.inf]
+                extended = [
+                    xs[c0] - 0.5*dx if c0 > 0 else -numpy.inf,
+                    xs[c1 - 1] + 0.5*dx if c1 < totalx else numpy.inf,
+                    ys[r0] - 0.5*dy if r0 > 0 else -numpy.inf,
+                    ys[r1 - 1] + 0.5*dy if r1 < totaly else numpy.inf]
+                nearby = [k*nx + l
+                          for k in xrange(max(i - 1, 0), min(i + 2, ny))
+                          for l in xrange(max(j - 1, 0), min(j + 2, nx))]
+                subsets, indexes, taper = [], [], []
+                for d, (order, starts) in zip(datasets, bins):
+                    inside = numpy.sort(numpy.concatenate(
+                        [order[starts[k]:starts[k + 1]] for k in nearby]))
+                    x, y = d.x[inside], d.y[inside]
+                    keep = ((x >= extended[0]) & (x <= extended[1])
+                            & (y >= extended[2]) & (y <= extended[3]))
+                    inside = inside[keep]
+                    subsets.append(utils.subset(d, inside,
+                                                ['x', 'y', 'z', 'data']))
+                    indexes.append(inside)
+                    taper.append(_taper(x[keep], y[keep], core, padx*dx,
+                                        pady*dy))
+                if sum(s.size for s in subsets[:len(data)]) == 0:
+                    continue
+                nodes = (numpy.arange(r0, r1)[:, numpy.newaxis]*totalx
+                         + numpy.arange(c0, c1)).ravel()
+                indexes.insert(0, nodes)
+                taper.insert(0, _taper(local.x, local.y, core, padx*dx,
+                                       pady*dy))
+                yield [subsets, local, damping, len(data)], indexes, taper
+    if njobs is None:
+        njobs = multiprocessing.cpu_count()
+    pool = None
+    if njobs > 1:
+        pool = multiprocessing.Pool(njobs)
+    try:
+        pending = jobs()
+        while True:
+            # Only prepare a few windows at a time to limit the memory used
+            batch = list(itertools.islice(pending, 2*njobs))
+            if not batch:
+                break
+            args = [b[0] for b in batch]
+            if pool is None:
+                results = itertools.imap(_solve_window, args)
+            else:
+                results = pool.imap(_solve_window, args)
+            for (_, indexes, taper), result in zip(batch, results):
+                for total, weight, index, w, r in zip(totals, weights,
+                                                      indexes, taper, result):
+                    total[index] += w*r
+                    weight[index] += w
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
+    for total, weight in zip(totals, weights):
+        covered = weight > 0
+        total[covered] /= weight[covered]
+    estimate = totals[0]
+    predicted = totals[1:len(data) + 1]
+    if targets is None:
+        return estimate, predicted
+    return estimate, predicted, totals[len(data) + 1:]
+
+def _solve_window(args):
+    """
+    Solve the equivalent layer of one window of
+    :func:`~fatiando.gravmag.eqlayer.windowed`.
+
+    Returns a list with the estimate and the data calculated on each data set
+    and target.
+    """
+    subsets, local, damping, ndata = args
+    estimate, predicted = classic(subsets[:ndata], local, damping)
+    transformed = [numpy.dot(t.sensitivity(local), estimate)
+                   for t in subsets[ndata:]]
+    return [estimate] + predicted + transformed
+
+def _window_index(coordinate, start, width, nwindows):
+    """
+    The index of the window (along one direction) of each point. Points
+    outside of the layer go in the windows on the border.
+    """
+    if width <= 0:
+        return numpy.zeros(len(coordinate), dtype=numpy.int)
+    index = numpy.floor((coordinate - start)/width).astype(numpy.int)
+    return numpy.clip(index, 0, nwindows - 1)
+
+def _taper(x, y, core, xwidth, ywidth):
+    """
+    Weights that are 1 inside the *core* area and go to 0 (cosine taper)
+    *xwidth* and *ywidth* away from it.
+    """
+    weights = numpy.ones(len(x))
+    for coordinate, start, end, width in [(x, core[0], core[1], xwidth),
+                                          (y, core[2], core[3], ywidth)]:
+        if width <= 0:
+            continue
+        distance = numpy.maximum(numpy.maximum(start - coordinate,
+                                               coordinate - end), 0.)
+        weights *= 0.5*(1. + numpy.cos(numpy.pi*numpy.minimum(
+            distance/width, 1.)))
+    return weights
+
 # Polynomial Equivalent Layer (PEL)
 
 def _ncoefficients(degree):
@@ -222,38 +898,6 @@ def _bkmatrix(grid, degree):
                 for i, j in zip(xrange(l), xrange(l - 1, -1, -1))])
     return bmatrix
 
-def _gkmatrix(data, ndata, grid):
-    """
-    Make the sensitivity matrix of a subgrid.
-
-    >>> from fatiando.mesher import PointGrid
-    >>> x, y, z, g = numpy.zeros((4, 500))
-    >>> data = [Gz(x, y, z, g)]
-    >>> grid = PointGrid((0, 10, 0, 10), 10, (10, 10))
-    >>> grid.size
-    100
-    >>> gk = _gkmatrix(data, 500, grid)
-    >>> gk.shape
-    (500, 100)
-
-    """
-    sensitivity = numpy.empty((ndata, grid.size), dtype=float)
-    start = 0
-    for d in data:
-        end = start + d.size
-        sensitivity[start:end,:] = d.sensitivity(grid)
-        start = end
-    return sensitivity
-
-def _rightside(gb, data, ncoefs):
-    vector = numpy.zeros(ncoefs, dtype=float)
-    start = 0
-    for d in data:
-        end = start + d.size
-        vector += numpy.dot(gb[start:end,:].T, d.data)
-        start = end
-    return vector
-
 def _pel_rmatrix(windows, grid, grids):
     ny, nx = windows
     gsize = grids[0].size
@@ -281,7 +925,7 @@ def _pel_rmatrix(windows, grid, grids):
             deriv += 1
     return csc_matrix(rmatrix), nderivs
 
-def _pel_matrices(data, windows, grid, grids, degree):
+def _pel_matrices(data, windows, grid, grids, degree, njobs=1):
     """
     Compute the matrices needed by the PEL.
 
@@ -311,26 +955,45 @@ def _pel_matrices(data, windows, grid, grids, degree):
     ngrids = len(grids)
     pergrid = _ncoefficients(degree)
     ncoefs = ngrids*pergrid
-    ndata = sum(d.size for d in data)
+    bks = [_bkmatrix(g, degree) for g in grids]
+    # The full GB matrix is never formed. The Hessian and right-side vector
+    # are accumulated from the GB of blocks of data points (of about
+    # PEL_BLOCKSIZE elements) instead.
+    step = max(1, PEL_BLOCKSIZE//max(ncoefs, max(g.size for g in grids)))
+    blocks = [(d, slice(i, i + step)) for d in data
+              for i in xrange(0, d.size, step)]
+    def assemble(block):
+        d, rows = block
+        x, y, z = d.x[rows], d.y[rows], d.z[rows]
+        gb = numpy.empty((len(x), ncoefs), dtype=float)
+        for k, g in enumerate(grids):
+            gb[:,k*pergrid:(k + 1)*pergrid] = numpy.dot(d._kernel(x, y, z, g),
+                                                        bks[k])
+        return numpy.dot(gb.T, gb), numpy.dot(gb.T, d.data[rows])
+    modelmatrix = numpy.zeros((ncoefs, ncoefs), dtype=float)
+    rightside = numpy.zeros(ncoefs, dtype=float)
+    if njobs is None:
+        njobs = multiprocessing.cpu_count()
+    pool = None
+    if njobs > 1 and len(blocks) > 1:
+        pool = ThreadPool(njobs)
+    try:
+        if pool is None:
+            results = itertools.imap(assemble, blocks)
+        else:
+            results = pool.imap(assemble, blocks)
+        # Sum in block order so that the result doesn't depend on njobs
+        for hessian, vector in results:
+            modelmatrix += hessian
+            rightside += vector
+    finally:
+        if pool is not None:
+            pool.close()
     # make the finite differences matrix for the window borders
-    rmatrix, nderivs = _pel_rmatrix(windows, grid, grids)
-    rightside = numpy.empty(ncoefs, dtype=float)
-    gb = numpy.empty((ndata, ncoefs), dtype=float)
-    rb = numpy.empty((nderivs, ncoefs), dtype=float)
-    st = 0
-    for i, grid in enumerate(grids):
-        bk = _bkmatrix(grid, degree)
-        gk = _gkmatrix(data, ndata, grid)
-        gkbk = numpy.dot(gk, bk)
-        gb[:,i*pergrid:(i + 1)*pergrid] = gkbk
-        # Make a part of the right-side vector
-        rightside[i*pergrid:(i + 1)*pergrid] = _rightside(gkbk, data, pergrid)
-        # Make the RB matrix
-        en = st + grid.size
-        rb[:,i*pergrid:(i + 1)*pergrid] = rmatrix[:,st:en]*bk
-        st = en
-    modelmatrix = numpy.dot(gb.T, gb)
-    smoothmatrix = numpy.dot(rb.T, rb)
+    # RB only has nonzeros on the windows each derivative touches
+    rmatrix, _ = _pel_rmatrix(windows, grid, grids)
+    rb = rmatrix*block_diag(bks, format='csc')
+    smoothmatrix = (rb.T*rb).toarray()
     return modelmatrix, smoothmatrix, rightside
 
 def _coefs2prop(coefs, grid, grids, windows, degree):
@@ -357,7 +1020,7 @@ def _coefs2prop(coefs, grid, grids, windows, degree):
     return estimate.ravel()
 
 def pel(data, layer, windows, degree=1, damping=0., smoothness=0.,
-        matrices=None):
+        matrices=None, njobs=1):
     """
     The polynomial equivalent layer.
 
@@ -395,6 +1058,10 @@ def pel(data, layer, windows, degree=1, damping=0., smoothness=0.,
         regularization parameters doesn't take so long. WARNING: if any other
         parameter changed, the results will be meaningless
 
+    * njobs : int or None
+        Number of threads used to calculate the sensitivity matrices. If None,
+        will use the number of CPUs.
+
     Returns:
 
     * [estimate, matrices] : array, list of arrays
@@ -412,7 +1079,7 @@ def pel(data, layer, windows, degree=1, damping=0., smoothness=0.,
     ncoefs = ngrids*pergrid
     if matrices is None:
         modelmatrix, smoothmatrix, rightside = _pel_matrices(data, windows,
-            layer, grids, degree)
+            layer, grids, degree, njobs)
     else:
         modelmatrix, smoothmatrix, rightside = matrices
     fg = numpy.trace(modelmatrix)
@@ -422,3 +1089,92 @@ def pel(data, layer, windows, degree=1, damping=0., smoothness=0.,
     coefs = numpy.linalg.solve(leftside, rightside)
     estimate = _coefs2prop(coefs, layer, grids, windows, degree)
     return estimate, [modelmatrix, smoothmatrix, rightside]
+
+def pelsweep(data, layer, windows, degree=1, damping=(0.,), smoothness=(0.,),
+             matrices=None, njobs=1):
+    """
+    The polynomial equivalent layer for many values of the damping and
+    smoothness parameters.
+
+    Calculates one symmetric eigendecomposition of the PEL system per
+    smoothness value. The solutions for all damping values then cost only a
+    few matrix-vector products. If there are many smoothness values and a
+    single (non-zero) damping value, a single generalized eigendecomposition
+    is used for all smoothness values instead. Also calculates the norm of
+    the residuals, the norm of the estimate and the Generalized
+    Cross-Validation (GCV) function for each pair of values. The estimates are
+    the same as the ones of :func:`~fatiando.gravmag.eqlayer.pel`.
+
+    Parameters:
+
+    * data, layer, windows, degree, matrices, njobs
+        Same as in :func:`~fatiando.gravmag.eqlayer.pel`
+
+    * damping : list of floats
+        The values of the damping regularization parameter
+
+    * smoothness : list of floats
+        The values of the smoothness regularization parameter
+
+    Returns:
+
+    * [estimates, stats, matrices]
+        *estimates* is a list with a list of estimates (one per damping
+        value) for each smoothness value. *stats* is a dict with 2d arrays
+        (smoothness x damping) of the residual norm (``'residuals'``),
+        estimate norm (``'norm'``) and GCV (``'gcv'``). *matrices* is the
+        same as in :func:`~fatiando.gravmag.eqlayer.pel`.
+
+    """
+    ny, nx = windows
+    grids = layer.split(windows)
+    if layer.shape[1]%nx != 0 or layer.shape[0]%ny != 0:
+        raise ValueError(
+            'PEL requires windows to be divisable by the grid shape')
+    ncoefs = len(grids)*_ncoefficients(degree)
+    if matrices is None:
+        matrices = _pel_matrices(data, windows, layer, grids, degree, njobs)
+    modelmatrix, smoothmatrix, rightside = matrices
+    fg = numpy.trace(modelmatrix)
+    fr = numpy.trace(smoothmatrix)
+    ndata = sum(d.size for d in data)
+    datanorm = sum(numpy.dot(d.data, d.data) for d in data)
+    identity = numpy.identity(ncoefs)
+    # Each decomposition gives V and the denominators (diagonal of
+    # V^T (left side) V) for each pair of values, with V^T (left side)^-1 V
+    # diagonal
+    if len(smoothness) > 1 and len(damping) == 1 and damping[0] > 0:
+        base = modelmatrix + (float(damping[0]*fg)/ncoefs)*identity
+        values, vectors = scipy.linalg.eigh((float(fg)/fr)*smoothmatrix,
+                                            base)
+        decompositions = [(vectors, [[1. + s*values] for s in smoothness])]
+    else:
+        decompositions = []
+        for s in smoothness:
+            values, vectors = numpy.linalg.eigh(
+                modelmatrix + (float(s*fg)/fr)*smoothmatrix)
+            decompositions.append((vectors, [[values + float(d*fg)/ncoefs
+                                              for d in damping]]))
+    estimates = []
+    stats = dict((k, numpy.empty((len(smoothness), len(damping)))) for k in
+                 ['residuals', 'norm', 'gcv'])
+    i = 0
+    for vectors, denominators in decompositions:
+        rotated = numpy.dot(vectors.T, rightside)
+        # The diagonal of V^T M V for the trace of the hat matrix
+        hat = numpy.sum(vectors*numpy.dot(modelmatrix, vectors), axis=0)
+        for row in denominators:
+            estimates.append([])
+            for j, denominator in enumerate(row):
+                coefs = numpy.dot(vectors, rotated/denominator)
+                estimate = _coefs2prop(coefs, layer, grids, windows, degree)
+                estimates[-1].append(estimate)
+                # ||d - GBc||^2 = d^Td - 2c^TB^TG^Td + c^T(B^TG^TGB)c
+                residuals = sqrt(max(datanorm - 2*numpy.dot(coefs, rightside)
+                    + numpy.dot(coefs, numpy.dot(modelmatrix, coefs)), 0.))
+                stats['residuals'][i, j] = residuals
+                stats['norm'][i, j] = numpy.linalg.norm(estimate)
+                stats['gcv'][i, j] = _gcv(residuals, ndata,
+                    ndata - numpy.sum(hat/denominator))
+            i += 1
+    return estimates, stats, matrices
@@ -0,0 +1,635 @@
+r"""
+Forward modeling of tesseroid models using spherical harmonics.
+
+Converts a tesseroid model (a list of
+:class:`~fatiando.mesher.Tesseroid` or a
+:class:`~fatiando.mesher.TesseroidMesh`, e.g. the output of
+:func:`fatiando.io.crust2_to_tesseroids`) into the spherical harmonic
+coefficients of its gravitational potential up to a chosen degree. The
+potential, gravitational attraction and gravity gradient tensor are then
+synthesised from the coefficients. The time spent computing the coefficients
+is proportional to the number of tesseroids but the synthesis is independent
+of the size of the model. This is much faster than
+:mod:`~fatiando.gravmag.tesseroid` for large models and many computation
+points, as is the case with satellite data.
+
+**Functions:**
+
+* :func:`~fatiando.gravmag.harmonic.coefficients`: the spherical harmonic
+  coefficients of a tesseroid model
+* :func:`~fatiando.gravmag.harmonic.potential`: the gravitational potential
+* :func:`~fatiando.gravmag.harmonic.gx`: the North component of the
+  gravitational attraction
+* :func:`~fatiando.gravmag.harmonic.gy`: the East component of the
+  gravitational attraction
+* :func:`~fatiando.gravmag.harmonic.gz`: the vertical component of the
+  gravitational attraction
+* :func:`~fatiando.gravmag.harmonic.gxx`,
+  :func:`~fatiando.gravmag.harmonic.gxy`,
+  :func:`~fatiando.gravmag.harmonic.gxz`,
+  :func:`~fatiando.gravmag.harmonic.gyy`,
+  :func:`~fatiando.gravmag.harmonic.gyz`,
+  :func:`~fatiando.gravmag.harmonic.gzz`: the components of the gravity
+  gradient tensor
+* :func:`~fatiando.gravmag.harmonic.fields`: several components at once,
+  sharing the Legendre functions between them
+
+The components, units and coordinate system are the same as in
+:mod:`fatiando.gravmag.tesseroid`: x is North, y is East and z is radial.
+The gravitational attraction is in mGal (gz is positive downward) and the
+tensor in Eotvos. The potential outside a sphere of radius :math:`R`
+(``fatiando.constants.MEAN_EARTH_RADIUS``) that contains the model is
+
+.. math::
+
+    V(r, \phi, \lambda) = \sum\limits_{n=0}^{N}
+    \left(\frac{R}{r}\right)^{n+1}
+    \sum\limits_{m=0}^{n} \bar{P}_{nm}(\sin\phi)
+    \left[C_{nm}\cos m\lambda + S_{nm}\sin m\lambda\right]
+
+where :math:`\bar{P}_{nm}` are the fully normalized associated Legendre
+functions. The coefficients of each tesseroid are calculated with the radial
+and longitudinal integrals in closed form and a Gauss-Legendre Quadrature in
+latitude. The series only converges above the model, so the computation
+points should be well above the topography (e.g., at satellite altitude).
+The truncation error decreases with the height and the degree. Points at the
+poles are not supported.
+
+Example::
+
+    >>> from fatiando.mesher import Tesseroid
+    >>> from fatiando.constants import G, MEAN_EARTH_RADIUS
+    >>> model = [Tesseroid(-10, 10, -10, 10, 0, -10000, {'density':1000})]
+    >>> cnm, snm = coefficients(model, 2)
+    >>> # The degree zero coefficient is given by the mass of the model
+    >>> r1, r2 = MEAN_EARTH_RADIUS - 10000, MEAN_EARTH_RADIUS
+    >>> mass = 1000*(r2**3 - r1**3)/3*(20*numpy.pi/180)*2*numpy.sin(numpy.pi/18)
+    >>> print round(cnm[0, 0]/(G*mass/MEAN_EARTH_RADIUS), 10)
+    1.0
+    >>> # Symmetric about the Equator and the Greenwich meridian
+    >>> print abs(snm).max() == 0, abs(cnm[2, 1]) < 10**(-10)*abs(cnm[2, 0])
+    True True
+
+----
+
+"""
+import numpy
+
+from fatiando.mesher import TesseroidMesh
+from fatiando.constants import MEAN_EARTH_RADIUS, G, SI2MGAL, SI2EOTVOS
+
+
+# Maximum number of values in the arrays of Legendre functions computed at
+# once. Limits the memory used by large degrees and many latitudes.
+_chunk_size = 2**22
+
+# Partial derivatives of the potential needed by each component. The keys are
+# the order of the derivative in (radius, latitude, longitude).
+_derivatives = {'potential':[(0, 0, 0)], 'gx':[(0, 1, 0)], 'gy':[(0, 0, 1)],
+                'gz':[(1, 0, 0)], 'gxx':[(1, 0, 0), (0, 2, 0)],
+                'gxy':[(0, 1, 1), (0, 0, 1)], 'gxz':[(1, 1, 0), (0, 1, 0)],
+                'gyy':[(1, 0, 0), (0, 1, 0), (0, 0, 2)],
+                'gyz':[(1, 0, 1), (0, 0, 1)], 'gzz':[(2, 0, 0)]}
+# gz is multiplied by -1 so that z is pointing down (like in tesseroid)
+_scales = {'potential':1., 'gx':SI2MGAL, 'gy':SI2MGAL, 'gz':-SI2MGAL,
+           'gxx':SI2EOTVOS, 'gxy':SI2EOTVOS, 'gxz':SI2EOTVOS,
+           'gyy':SI2EOTVOS, 'gyz':SI2EOTVOS, 'gzz':SI2EOTVOS}
+
+
+def coefficients(tesseroids, degree, dens=None):
+    """
+    Calculate the spherical harmonic coefficients of a tesseroid model.
+
+    The tesseroids are grouped by latitude band so that the Legendre functions
+    are only calculated once per band. Cells of a
+    :class:`~fatiando.mesher.TesseroidMesh` are read directly from its arrays.
+
+    Parameters:
+
+    * tesseroids : list of :class:`~fatiando.mesher.Tesseroid` or a
+      :class:`~fatiando.mesher.TesseroidMesh`
+        The model. Tesseroids without a density (or that are None) and
+        masked cells are ignored.
+    * degree : int
+        The maximum degree of the expansion
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the tesseroids.
+
+    Returns:
+
+    * coefs : list = [cnm, snm]
+        2d arrays with the cosine and sine coefficients (in SI units of
+        potential). ``cnm[n, m]`` is the coefficient of degree n and order m.
+        Pass this list to the synthesis functions of this module.
+
+    """
+    if degree < 0:
+        raise ValueError("Invalid degree %s. Should be >= 0" % (str(degree)))
+    cnm = numpy.zeros((degree + 1, degree + 1))
+    snm = numpy.zeros((degree + 1, degree + 1))
+    w, e, s, n, top, bottom, density = _model_arrays(tesseroids, dens)
+    if len(density) == 0:
+        return [cnm, snm]
+    d2r = numpy.pi/180.
+    degrees = numpy.arange(degree + 1)
+    # The radial integral of (r/R)^n r^2 from bottom to top
+    powers = degrees + 3.
+    radial = (MEAN_EARTH_RADIUS**3*
+              (((MEAN_EARTH_RADIUS + top)/MEAN_EARTH_RADIUS)[:, None]**powers -
+               ((MEAN_EARTH_RADIUS + bottom)/MEAN_EARTH_RADIUS)[:, None]**powers)
+              /powers)
+    radial *= density[:, None]
+    # The longitudinal integrals of cos(m lon) and sin(m lon)
+    center = 0.5*d2r*(w + e)[:, None]*degrees
+    half = 0.5*d2r*(e - w)[:, None]*degrees
+    sinc = numpy.ones_like(half)
+    sinc[:, 1:] = numpy.sin(half[:, 1:])/half[:, 1:]
+    width = d2r*(e - w)[:, None]
+    loncos = width*sinc*numpy.cos(center)
+    lonsin = width*sinc*numpy.sin(center)
+    # The latitudinal integral of the Legendre functions times cos(lat) is
+    # done for each band of latitudes
+    bands, inverse = numpy.unique(s + 1j*n, return_inverse=True)
+    latitude = _latitude_integrals(degree, bands.real, bands.imag)
+    for band in xrange(len(bands)):
+        index = numpy.nonzero(inverse == band)[0]
+        cnm += latitude[band]*numpy.dot(radial[index].T, loncos[index])
+        snm += latitude[band]*numpy.dot(radial[index].T, lonsin[index])
+    scale = (G/MEAN_EARTH_RADIUS)/(2.*degrees + 1.)
+    cnm *= scale[:, None]
+    snm *= scale[:, None]
+    return [cnm, snm]
+
+def potential(lons, lats, heights, coefs):
+    """
+    Calculate the gravitational potential of a spherical harmonic model.
+
+    .. note:: The potential at a point is in SI units
+
+    Parameters:
+
+    * lons, lats, heights : arrays
+        Longitude and latitude (in degrees) and height (in meters) of the
+        computation points
+    * coefs : list = [cnm, snm]
+        The coefficients (see :func:`~fatiando.gravmag.harmonic.coefficients`)
+
+    Returns:
+
+    * res : array
+        The calculated field at the given points
+
+    """
+    return fields(lons, lats, heights, coefs, ['potential'])[0]
+
+def gx(lons, lats, heights, coefs):
+    """
+    Calculate the x (North) component of the gravitational attraction.
+
+    .. note:: The result is in mGal
+
+    Parameters:
+
+    * lons, lats, heights : arrays
+        Longitude and latitude (in degrees) and height (in meters) of the
+        computation points
+    * coefs : list = [cnm, snm]
+        The coefficients (see :func:`~fatiando.gravmag.harmonic.coefficients`)
+
+    Returns:
+
+    * res : array
+        The calculated field at the given points
+
+    """
+    return fields(lons, lats, heights, coefs, ['gx'])[0]
+
+def gy(lons, lats, heights, coefs):
+    """
+    Calculate the y (East) component of the gravitational attraction.
+
+    .. note:: The result is in mGal
+
+    Parameters:
+
+    * lons, lats, heights : arrays
+        Longitude and latitude (in degrees) and height (in meters) of the
+        computation points
+    * coefs : list = [cnm, snm]
+        The coefficients (see :func:`~fatiando.gravmag.harmonic.coefficients`)
+
+    Returns:
+
+    * res : array
+        The calculated field at the given points
+
+    """
+    return fields(lons, lats, heights, coefs, ['gy'])[0]
+
+def gz(lons, lats, heights, coefs):
+    """
+    Calculate the z (radial) component of the gravitational attraction.
+
+    .. note:: The result is in mGal
+
+    .. warning:: In order to conform with the regular convention of z being
+        down, the result is multiplied by -1 (like in
+        :func:`fatiando.gravmag.tesseroid.gz`).
+
+    Parameters:
+
+    * lons, lats, heights : arrays
+        Longitude and latitude (in degrees) and height (in meters) of the
+        computation points
+    * coefs : list = [cnm, snm]
+        The coefficients (see :func:`~fatiando.gravmag.harmonic.coefficients`)
+
+    Returns:
+
+    * res : array
+        The calculated field at the given points
+
+    """
+    return fields(lons, lats, heights, coefs, ['gz'])[0]
+
+def gxx(lons, lats, heights, coefs):
+    """
+    Calculate the xx (North-North) component of the gravity gradient tensor.
+
+    .. note:: The result is in Eotvos
+
+    Parameters:
+
+    * lons, lats, heights : arrays
+        Longitude and latitude (in degrees) and height (in meters) of the
+        computation points
+    * coefs : list = [cnm, snm]
+        The coefficients (see :func:`~fatiando.gravmag.harmonic.coefficients`)
+
+    Returns:
+
+    * res : array
+        The calculated field at the given points
+
+    """
+    return fields(lons, lats, heights, coefs, ['gxx'])[0]
+
+def gxy(lons, lats, heights, coefs):
+    """
+    Calculate the xy (North-East) component of the gravity gradient tensor.
+
+    .. note:: The result is in Eotvos
+
+    Parameters:
+
+    * lons, lats, heights : arrays
+        Longitude and latitude (in degrees) and height (in meters) of the
+        computation points
+    * coefs : list = [cnm, snm]
+        The coefficients (see :func:`~fatiando.gravmag.harmonic.coefficients`)
+
+    Returns:
+
+    * res : array
+        The calculated field at the given points
+
+    """
+    return fields(lons, lats, heights, coefs, ['gxy'])[0]
+
+def gxz(lons, lats, heights, coefs):
+    """
+    Calculate the xz (North-radial) component of the gravity gradient tensor.
+
+    .. note:: The result is in Eotvos
+
+    Parameters:
+
+    * lons, lats, heights : arrays
+        Longitude and latitude (in degrees) and height (in meters) of the
+        computation points
+    * coefs : list = [cnm, snm]
+        The coefficients (see :func:`~fatiando.gravmag.harmonic.coefficients`)
+
+    Returns:
+
+    * res : array
+        The calculated field at the given points
+
+    """
+    return fields(lons, lats, heights, coefs, ['gxz'])[0]
+
+def gyy(lons, lats, heights, coefs):
+    """
+    Calculate the yy (East-East) component of the gravity gradient tensor.
+
+    .. note:: The result is in Eotvos
+
+    Parameters:
+
+    * lons, lats, heights : arrays
+        Longitude and latitude (in degrees) and height (in meters) of the
+        computation points
+    * coefs : list = [cnm, snm]
+        The coefficients (see :func:`~fatiando.gravmag.harmonic.coefficients`)
+
+    Returns:
+
+    * res : array
+        The calculated field at the given points
+
+    """
+    return fields(lons, lats, heights, coefs, ['gyy'])[0]
+
+def gyz(lons, lats, heights, coefs):
+    """
+    Calculate the yz (East-radial) component of the gravity gradient tensor.
+
+    .. note:: The result is in Eotvos
+
+    Parameters:
+
+    * lons, lats, heights : arrays
+        Longitude and latitude (in degrees) and height (in meters) of the
+        computation points
+    * coefs : list = [cnm, snm]
+        The coefficients (see :func:`~fatiando.gravmag.harmonic.coefficients`)
+
+    Returns:
+
+    * res : array
+        The calculated field at the given points
+
+    """
+    return fields(lons, lats, heights, coefs, ['gyz'])[0]
+
+def gzz(lons, lats, heights, coefs):
+    """
+    Calculate the zz (radial-radial) component of the gravity gradient tensor.
+
+    .. note:: The result is in Eotvos
+
+    Parameters:
+
+    * lons, lats, heights : arrays
+        Longitude and latitude (in degrees) and height (in meters) of the
+        computation points
+    * coefs : list = [cnm, snm]
+        The coefficients (see :func:`~fatiando.gravmag.harmonic.coefficients`)
+
+    Returns:
+
+    * res : array
+        The calculated field at the given points
+
+    """
+    return fields(lons, lats, heights, coefs, ['gzz'])[0]
+
+def fields(lons, lats, heights, coefs, components):
+    """
+    Calculate several components of the field of a spherical harmonic model.
+
+    The Legendre functions are calculated once for each unique pair of
+    latitude and height and shared between all components. The cost is
+    proportional to the number of these pairs times the degree squared plus
+    the number of points times the degree. Regular grids are the most
+    efficient.
+
+    Parameters:
+
+    * lons, lats, heights : arrays
+        Longitude and latitude (in degrees) and height (in meters) of the
+        computation points
+    * coefs : list = [cnm, snm]
+        The coefficients (see :func:`~fatiando.gravmag.harmonic.coefficients`)
+    * components : list of strings
+        The names of the components to calculate. Same as the names of the
+        functions in this module (e.g., ``['gz', 'gzz']``).
+
+    Returns:
+
+    * results : list of arrays
+        The calculated components in the order given in *components*. Units
+        are the same as the respective functions.
+
+    """
+    for component in components:
+        if component not in _derivatives:
+            raise ValueError("Invalid component '%s'" % (str(component)))
+    cnm, snm = [numpy.asarray(c, dtype=numpy.float) for c in coefs]
+    degree = cnm.shape[0] - 1
+    lons, lats, heights = [numpy.ravel(numpy.asarray(i, dtype=numpy.float))
+                           for i in [lons, lats, heights]]
+    ndata = len(lons)
+    derivs = set()
+    for component in components:
+        derivs.update(_derivatives[component])
+    values = dict((d, numpy.zeros(ndata)) for d in derivs)
+    sums = set(d[:2] for d in derivs)
+    d2r = numpy.pi/180.
+    degrees = numpy.arange(degree + 1)
+    orders = numpy.arange(degree + 1, dtype=numpy.float)
+    pairs, inverse = numpy.unique(lats + 1j*heights, return_inverse=True)
+    size = max(1, _chunk_size//(degree + 1)**2)
+    for start in xrange(0, len(pairs), size):
+        chunk = pairs[start:start + size]
+        latitude = d2r*chunk.real
+        radii = MEAN_EARTH_RADIUS + chunk.imag
+        legendre = _legendre(degree, numpy.sin(latitude))
+        funcs = [legendre]
+        if any(d[1] > 0 for d in derivs):
+            funcs.append(_legendre_derivative(legendre, latitude))
+        if any(d[1] > 1 for d in derivs):
+            # From the associated Legendre differential equation
+            tan, cos = numpy.tan(latitude), numpy.cos(latitude)
+            funcs.append(tan*funcs[1] -
+                         (degrees*(degrees + 1.))[:, None, None]*legendre +
+                         (orders**2)[None, :, None]*legendre/cos**2)
+        # Sum over the degrees for each order, latitude and height. Gives the
+        # coefficients of the Fourier series in longitude.
+        ratio = (MEAN_EARTH_RADIUS/radii)**(degrees[:, None] + 1.)
+        fourier = {}
+        for d in sums:
+            factor = ratio*_radial_factor(degrees, radii, d[0])
+            fourier[d] = [numpy.einsum('nmp,np,nm->mp', funcs[d[1]], factor, c)
+                          for c in [cnm, snm]]
+        index = numpy.nonzero((inverse >= start) &
+                              (inverse < start + len(chunk)))[0]
+        pair = inverse[index] - start
+        step = max(1, _chunk_size//(degree + 1))
+        for i in xrange(0, len(index), step):
+            points = index[i:i + step]
+            angles = d2r*lons[points]*orders[:, None]
+            cos, sin = numpy.cos(angles), numpy.sin(angles)
+            for d in derivs:
+                a, b = [f[:, pair[i:i + step]] for f in fourier[d[:2]]]
+                if d[2] == 0:
+                    series = a*cos + b*sin
+                elif d[2] == 1:
+                    series = orders[:, None]*(b*cos - a*sin)
+                else:
+                    series = -(orders**2)[:, None]*(a*cos + b*sin)
+                values[d][points] = series.sum(axis=0)
+    r = MEAN_EARTH_RADIUS + heights
+    sinlat, coslat = numpy.sin(d2r*lats), numpy.cos(d2r*lats)
+    results = []
+    for component in components:
+        v = values
+        if component == 'potential':
+            res = v[(0, 0, 0)]
+        elif component == 'gx':
+            res = v[(0, 1, 0)]/r
+        elif component == 'gy':
+            res = v[(0, 0, 1)]/(r*coslat)
+        elif component == 'gz':
+            res = v[(1, 0, 0)]
+        elif component == 'gxx':
+            res = v[(1, 0, 0)]/r + v[(0, 2, 0)]/r**2
+        elif component == 'gxy':
+            res = (v[(0, 1, 1)]/(r**2*coslat) +
+                   sinlat*v[(0, 0, 1)]/(r*coslat)**2)
+        elif component == 'gxz':
+            res = v[(1, 1, 0)]/r - v[(0, 1, 0)]/r**2
+        elif component == 'gyy':
+            res = (v[(1, 0, 0)]/r - sinlat*v[(0, 1, 0)]/(coslat*r**2) +
+                   v[(0, 0, 2)]/(r*coslat)**2)
+        elif component == 'gyz':
+            res = (v[(1, 0, 1)]/(r*coslat) -
+                   v[(0, 0, 1)]/(r**2*coslat))
+        elif component == 'gzz':
+            res = v[(2, 0, 0)]
+        results.append(_scales[component]*res)
+    return results
+
+def _model_arrays(tesseroids, dens):
+    """
+    Get the bounds and densities of the tesseroids as arrays.
+
+    Skips the tesseroids without density, the ones with zero density and the
+    masked cells of meshes.
+
+    Returns [w, e, s, n, top, bottom, density]
+    """
+    if isinstance(tesseroids, TesseroidMesh):
+        if dens is None and 'density' not in tesseroids.props:
+            return [numpy.array([]) for i in xrange(7)]
+        if dens is not None:
+            density = dens*numpy.ones(tesseroids.size, dtype=numpy.float)
+        else:
+            density = numpy.asarray(tesseroids.props['density'],
+                                    dtype=numpy.float)
+        bounds = tesseroids.get_cell_bounds()
+        use = ~tesseroids.get_mask()
+    else:
+        cells = [t for t in tesseroids
+                 if t is not None and (dens is not None or
+                                       'density' in t.props)]
+        bounds = [numpy.array([t.w for t in cells], dtype=numpy.float),
+                  numpy.array([t.e for t in cells], dtype=numpy.float),
+                  numpy.array([t.s for t in cells], dtype=numpy.float),
+                  numpy.array([t.n for t in cells], dtype=numpy.float),
+                  numpy.array([t.top for t in cells], dtype=numpy.float),
+                  numpy.array([t.bottom for t in cells], dtype=numpy.float)]
+        if dens is not None:
+            density = dens*numpy.ones(len(cells), dtype=numpy.float)
+        else:
+            density = numpy.array([t.props['density'] for t in cells],
+                                  dtype=numpy.float)
+        use = numpy.ones(len(cells), dtype=numpy.bool)
+    use &= density != 0
+    return [b[use] for b in bounds] + [density[use]]
+
+def _latitude_integrals(degree, south, north):
+    """
+    Integrate the fully normalized Legendre functions times cos(lat) over
+    latitude bands.
+
+    Uses a Gauss-Legendre Quadrature in sin(lat). The number of nodes grows
+    with the degree and the width of the band.
+
+    Returns a 3d array with the integrals of each band (first dimension).
+    """
+    d2r = numpy.pi/180.
+    tsouth, tnorth = numpy.sin(d2r*south), numpy.sin(d2r*north)
+    nodes = (4 + numpy.ceil(degree*(north - south)/180.)).astype(numpy.int)
+    ts, weights, bands = [], [], []
+    for i in xrange(len(south)):
+        x, w = numpy.polynomial.legendre.leggauss(nodes[i])
+        ts.append(0.5*(tnorth[i] - tsouth[i])*x + 0.5*(tnorth[i] + tsouth[i]))
+        weights.append(0.5*(tnorth[i] - tsouth[i])*w)
+        bands.append(i*numpy.ones(nodes[i], dtype=numpy.int))
+    ts, weights, bands = [numpy.concatenate(i) for i in [ts, weights, bands]]
+    integrals = numpy.zeros((len(south), degree + 1, degree + 1))
+    size = max(1, _chunk_size//(degree + 1)**2)
+    for start in xrange(0, len(ts), size):
+        chunk = slice(start, start + size)
+        legendre = _legendre(degree, ts[chunk])*weights[chunk]
+        for i in numpy.unique(bands[chunk]):
+            integrals[i] += legendre[:, :, bands[chunk] == i].sum(axis=2)
+    return integrals
+
+def _radial_factor(degrees, radii, order):
+    """
+    The factor that multiplies each degree in a radial derivative of the
+    given order of (R/r)^(n+1).
+    """
+    if order == 0:
+        return numpy.ones((len(degrees), len(radii)))
+    if order == 1:
+        return -(degrees[:, None] + 1.)/radii
+    return (degrees[:, None] + 1.)*(degrees[:, None] + 2.)/radii**2
+
+def _legendre(degree, t):
+    """
+    Calculate the fully normalized associated Legendre functions.
+
+    Uses the standard recursions (stable up to degrees of a few thousand).
+
+    Parameters:
+
+    * degree : int
+        The maximum degree
+    * t : 1d array
+        The sine of the latitudes
+
+    Returns:
+
+    * p : 3d array
+        ``p[n, m, i]`` is the function of degree n and order m at ``t[i]``.
+        Zero for m > n.
+
+    """
+    t = numpy.asarray(t, dtype=numpy.float)
+    u = numpy.sqrt(1. - t**2)
+    p = numpy.zeros((degree + 1, degree + 1, len(t)))
+    p[0, 0] = 1.
+    if degree == 0:
+        return p
+    p[1, 1] = numpy.sqrt(3.)*u
+    for m in xrange(2, degree + 1):
+        p[m, m] = numpy.sqrt((2.*m + 1.)/(2.*m))*u*p[m - 1, m - 1]
+    for m in xrange(degree):
+        p[m + 1, m] = numpy.sqrt(2.*m + 3.)*t*p[m, m]
+    for n in xrange(2, degree + 1):
+        m = numpy.arange(n - 1, dtype=numpy.float)
+        a = numpy.sqrt((2.*n - 1.)*(2.*n + 1.)/((n - m)*(n + m)))
+        b = numpy.sqrt((2.*n + 1.)*(n + m - 1.)*(n - m - 1.)/
+                       ((n - m)*(n + m)*(2.*n - 3.)))
+        p[n, :n - 1] = (a[:, None]*t*p[n - 1, :n - 1] -
+                        b[:, None]*p[n - 2, :n - 1])
+    return p
+
+def _legendre_derivative(p, latitude):
+    """
+    Calculate the derivatives of the fully normalized associated Legendre
+    functions *p* (see _legendre) with respect to latitude (in radians).
+    """
+    degree = p.shape[0] - 1
+    dp = numpy.zeros_like(p)
+    sin, cos = numpy.sin(latitude), numpy.cos(latitude)
+    m = numpy.arange(degree + 1, dtype=numpy.float)
+    for n in xrange(1, degree + 1):
+        factor = numpy.sqrt((2.*n + 1.)*(n**2 - m[:n]**2)/(2.*n - 1.))
+        dp[n, :n] = factor[:, None]*p[n - 1, :n]
+        dp[n, :n + 1] -= n*sin*p[n, :n + 1]
+    return dp/cos
@@ -24,6 +24,14 @@ data.
 * :func:`~fatiando.gravmag.harvester.harvest`: Performs the inversion
 * :func:`~fatiando.gravmag.harvester.iharvest`: Iterator to step through the
   inversion one accretion at a time
+* :func:`~fatiando.gravmag.harvester.multiscale`: Performs the inversion on a
+  coarser mesh first and then refines the estimate on the given mesh
+* :func:`~fatiando.gravmag.harvester.checkpoint`: Periodically saves the state
+  of :func:`~fatiando.gravmag.harvester.iharvest` to a file so that the
+  inversion can be resumed
+* :func:`~fatiando.gravmag.harvester.monitor`: Writes the progress of
+  :func:`~fatiando.gravmag.harvester.iharvest` (accretions per second, cache
+  hit rate, goal, misfit, ETA) to a log file or socket
 * :func:`~fatiando.gravmag.harvester.sow`: Creates the seeds from a set of
   (x, y, z) points and physical properties
 * :func:`~fatiando.gravmag.harvester.loadseeds`: Loads from a JSON file a set
@@ -32,6 +40,13 @@ data.
 * :func:`~fatiando.gravmag.harvester.weights`: Computes data weights based on
   the distance to the seeds
 
+**Effect cache**
+
+* :class:`~fatiando.gravmag.harvester.EffectCache`: Size-bounded cache of the
+  effects of the cells on the data shared by all seeds. Pass it to
+  :func:`~fatiando.gravmag.harvester.harvest` to keep long runs within a fixed
+  memory budget.
+
 **Data types**
 
 * :class:`~fatiando.gravmag.harvester.Potential`: gravitational potential
@@ -66,9 +81,18 @@ doi:10.1190/segam2012-0383.1 [`pdf
 ----
 
 """
+import os
+import copy
 import json
+import time
+import array
 import bisect
+import heapq
+import tempfile
+import multiprocessing
+from multiprocessing.pool import ThreadPool
 from math import sqrt
+from collections import OrderedDict
 
 import numpy
 
@@ -215,7 +239,8 @@ def _find_index(point, mesh):
             return seed
     return None
 
-def harvest(data, seeds, mesh, compactness, threshold, report=False):
+def harvest(data, seeds, mesh, compactness, threshold, report=False,
+    cache=None, strategy='scan', njobs=1, cutoff=None):
     """
     Run the inversion algorithm and produce an estimate physical property
     distribution (density and/or magnetization).
@@ -260,20 +285,61 @@ def harvest(data, seeds, mesh, compactness, threshold, report=False):
                       'regularizer': regularizing_function_value,
                       'accretions': number_of_accretions}
 
+    * cache : :class:`~fatiando.gravmag.harvester.EffectCache` or None
+        Where the effects of the neighbors are kept. Use it to limit the
+        memory used (see :class:`~fatiando.gravmag.harvester.EffectCache`).
+        If None, will use a cache without a size limit.
+
+    * strategy : str
+        How to find the best neighbor of each seed at each accretion. If
+        ``'scan'``, all neighbors are evaluated every time. If ``'heap'``, the
+        neighbors are kept in a priority queue ordered by a lower bound of
+        their goal function and only re-evaluated when they reach the top of
+        the queue. Gives the same result as ``'scan'``. Only pays off when
+        the goal function of most neighbors changes little between
+        accretions.
+
+    * njobs : int or None
+        Number of threads used to evaluate the neighbors (only with
+        ``strategy='scan'``). If > 1, the neighbors of all seeds are evaluated
+        in parallel at the start of each iteration and then corrected for the
+        growth of the seeds that came before them. The seeds still grow one
+        after the other, so the result doesn't depend on *njobs*. If None,
+        will use the number of CPUs. The seeds are evaluated in batches
+        whose neighbor effects fit in the maximum size of *cache*, so the
+        stacked effects can take as much memory as the cache itself. If the
+        cache has no size limit, the neighbor effects of all seeds are
+        stacked at once.
+
+    * cutoff : float or None
+        If not None, the data points with weights smaller than *cutoff* are
+        dropped before the inversion starts (see
+        :func:`~fatiando.gravmag.harvester.weights`). The effects of the
+        cells, the misfit and the shape-of-anomaly are only calculated on the
+        remaining points. The predicted data on the dropped points are
+        calculated once at the end. Data with a single weight for all points
+        are not changed. If a *cache* is given, it must be made with the same
+        *cutoff*.
 
     Returns:
 
     * estimate, predicted_data : a dict and a list
         *estimate* is a dict like::
 
-            {'physical_property':array, ...}
+            {'physical_property':SparseList, ...}
 
-        *estimate* contains the estimates physical properties. The properties
-        present in *estimate* are the ones given to the seeds. Include the
-        properties in the *mesh* using::
+        *estimate* contains the estimates physical properties, each one a
+        :class:`~fatiando.utils.SparseList` (use ``numpy.asarray`` to get an
+        array). The properties present in *estimate* are the ones given to the
+        seeds. Include the properties in the *mesh* using::
 
             mesh.addprop('density', estimate['density'])
 
+        The ``elements`` attribute of a ``SparseList`` is a copy of its
+        elements. Changes made to that dict are lost unless it is assigned
+        back (``l.elements = elements``). Change single values by indexing the
+        ``SparseList`` instead.
+
         This way you can plot the estimate using :mod:`fatiando.vis.myv`.
 
         *predicted_data* is a list of numpy arrays with the predicted (model)
@@ -305,9 +371,10 @@ def harvest(data, seeds, mesh, compactness, threshold, report=False):
 
     """
     for accretions, update in enumerate(iharvest(data, seeds, mesh,
-        compactness, threshold)):
+        compactness, threshold, cache, strategy, njobs, cutoff=cutoff)):
         continue
     estimate, predicted = update[:2]
+    predicted = _fill_predicted(data, predicted, estimate, mesh, cutoff)
     output = [fmt_estimate(estimate, mesh.size), predicted]
     if report:
         goal, misfit, regul = update[4:]
@@ -316,11 +383,246 @@ def harvest(data, seeds, mesh, compactness, threshold, report=False):
             'accretions':accretions, 'shape-of-anomaly':soa})
     return output
 
-def iharvest(data, seeds, mesh, compactness, threshold):
+def multiscale(data, seeds, mesh, compactness, threshold, factor=2,
+    decimate=1, band=1, report=False, cache=None, strategy='scan', njobs=1,
+    cutoff=None):
+    """
+    Run the inversion on a coarser mesh first and then refine the estimate on
+    *mesh*.
+
+    The coarse mesh has the same bounds as *mesh* and *factor* times less
+    cells in each dimension. The seeds grow on the coarse mesh using the data
+    decimated by *decimate* and threshold ``threshold*factor**3`` (the coarse
+    cells are ``factor**3`` times larger). The coarse estimate is then
+    transferred to *mesh*, leaving out the cells of *mesh* on its border. The
+    inversion continues on *mesh* with the full data. The seeds can only grow
+    in a band of *band* coarse cells around the border of the transferred
+    estimate. Most of the accretions are done on the coarse mesh, where there
+    are a lot less cells to evaluate.
+
+    The estimate can't shrink on *mesh*, so the coarse estimate should not be
+    much larger than the body. Coarse cells that are too big for the body make
+    the estimate grow too much. A *factor* of 2 is usually best.
+
+    Parameters:
+
+    * data, seeds, mesh, compactness, threshold
+        Same as in :func:`~fatiando.gravmag.harvester.harvest`. *seeds* are
+        made for *mesh* (see :func:`~fatiando.gravmag.harvester.sow`).
+
+    * factor : int
+        How many cells of *mesh* make one cell of the coarse mesh in each
+        dimension. The shape of *mesh* must be divisible by *factor*.
+
+    * decimate : int
+        Use only every *decimate* data point in the coarse inversion.
+
+    * band : int
+        Width (in coarse cells) of the band around the border of the coarse
+        estimate where the seeds can grow on *mesh*.
+
+    * report, cache, strategy, njobs
+        Same as in :func:`~fatiando.gravmag.harvester.harvest`. *cache* is
+        only used on *mesh*. The number of accretions in the report includes
+        the cells transferred from the coarse estimate.
+
+    Returns:
+
+    * estimate, predicted_data
+        Same as :func:`~fatiando.gravmag.harvester.harvest`
+
+    """
+    coarse = _coarsen(mesh, factor)
+    cseeds = sow([[s.x, s.y, s.z, s.props] for s in seeds], coarse)
+    cdata = [_decimate(d, decimate) for d in data]
+    # The coarse cells added to each coarse seed (by the index of the seed)
+    grown = dict((s.i, [s.i]) for s in cseeds)
+    for update in _accrete(cdata, cseeds, coarse, compactness,
+                           threshold*factor**3, None, strategy, njobs,
+                           cutoff=cutoff):
+        if update[2] is not None:
+            grown[update[2].seed].append(update[2].i)
+    inside = numpy.zeros(coarse.size, dtype=numpy.bool)
+    for cells in grown.itervalues():
+        inside[cells] = True
+    border = _border(_refine(inside, coarse, factor), mesh)
+    allowed = _dilate(border, band*factor, mesh)
+    seedcells = set(s.i for s in seeds)
+    masked = mesh.get_mask()
+    bodies = []
+    for s in seeds:
+        c = _find_index((s.x, s.y, s.z), coarse)
+        # Only the first seed on each coarse cell gets its coarse estimate
+        if c in grown:
+            body = numpy.zeros(coarse.size, dtype=numpy.bool)
+            body[grown.pop(c)] = True
+            body = _refine(body, coarse, factor) & ~border & ~masked
+            bodies.append([i for i in numpy.nonzero(body)[0]
+                           if i not in seedcells])
+        else:
+            bodies.append([])
+    for accretions, update in enumerate(_accrete(data, seeds, mesh,
+        compactness, threshold, cache, strategy, njobs, bodies, ~allowed,
+        cutoff=cutoff)):
+        continue
+    estimate, predicted = update[:2]
+    predicted = _fill_predicted(data, predicted, estimate, mesh, cutoff)
+    output = [fmt_estimate(estimate, mesh.size), predicted]
+    if report:
+        goal, misfit, regul = update[4:]
+        soa = goal - compactness*1./(sum(mesh.shape)/3.)*regul
+        accretions += sum(len(b) for b in bodies)
+        output.append({'goal':goal, 'misfit':misfit, 'regularizer':regul,
+            'accretions':accretions, 'shape-of-anomaly':soa})
+    return output
+
+def _coarsen(mesh, factor):
+    """
+    Make a mesh with the bounds of *mesh* and *factor* times less cells in
+    each dimension. Coarse cells are masked if all cells in them are masked.
+    """
+    if any(n%factor != 0 for n in mesh.shape):
+        raise ValueError(
+            "Mesh shape %s is not divisible by %d" % (str(mesh.shape), factor))
+    nz, ny, nx = [n/factor for n in mesh.shape]
+    coarse = mesh.__class__(mesh.bounds, (nz, ny, nx))
+    masked = mesh.get_mask().reshape((nz, factor, ny, factor, nx, factor))
+    coarse.mask = numpy.nonzero(masked.all(axis=(1, 3, 5)).ravel())[0].tolist()
+    return coarse
+
+def _refine(cells, coarse, factor):
+    """
+    Transfer a boolean array over the cells of a coarse mesh to the mesh with
+    *factor* times more cells in each dimension.
+    """
+    cells = cells.reshape(coarse.shape)
+    for axis in xrange(3):
+        cells = numpy.repeat(cells, factor, axis=axis)
+    return cells.ravel()
+
+def _border(cells, mesh):
+    """
+    Find the cells (boolean array) that have a neighbor not in *cells*. The
+    outside of the mesh doesn't count.
+    """
+    cells = cells.reshape(mesh.shape)
+    padded = numpy.pad(cells, 1, mode='edge')
+    interior = cells.copy()
+    for axis in xrange(3):
+        for shift in [-1, 1]:
+            interior &= numpy.roll(padded, shift, axis=axis)[1:-1, 1:-1, 1:-1]
+    return (cells & ~interior).ravel()
+
+def _dilate(cells, size, mesh):
+    """
+    Grow the cells (boolean array) by *size* cells in every direction
+    (including the diagonals).
+    """
+    grown = cells.reshape(mesh.shape)
+    # Growing along each axis in turn grows by a cube
+    for axis in xrange(3):
+        n = grown.shape[axis]
+        padding = [(0, 0)]*3
+        padding[axis] = (size, size)
+        padded = numpy.pad(grown, padding, mode='constant')
+        grown = numpy.zeros_like(grown)
+        for shift in xrange(2*size + 1):
+            grown |= numpy.take(padded, range(shift, shift + n), axis=axis)
+    return grown.ravel()
+
+def _decimate(data, step):
+    """
+    Make a copy of a data set with only every *step* data point.
+    """
+    if step == 1:
+        return data
+    return _subset(data, slice(None, None, step))
+
+def _select(data, cutoff):
+    """
+    Make a copy of a data set without the data points with weights smaller
+    than *cutoff*.
+
+    Returns the data set itself if it has a single weight for all points.
+    """
+    if numpy.ndim(data.weights) == 0:
+        return data
+    indexes = numpy.nonzero(data.weights >= cutoff)[0]
+    if len(indexes) == 0:
+        raise ValueError("No data points with weights >= %g" % (cutoff))
+    return _subset(data, indexes)
+
+def _subset(data, indexes):
+    """
+    Make a copy of a data set with only the data points in *indexes* (see
+    fatiando.utils.subset) and update its norm.
+    """
+    subset = utils.subset(data, indexes,
+                          ['x', 'y', 'z', 'observed', 'weights'])
+    subset.norm = numpy.linalg.norm(subset.observed)
+    return subset
+
+def _fill_predicted(data, predicted, estimate, mesh, cutoff):
+    """
+    Make the predicted data vectors on all data points from the ones on the
+    points kept by _select.
+
+    The predicted data on the dropped points are the effects of all cells in
+    the (unformated) *estimate*, calculated in a single call for each data set
+    on a copy of the mesh with the estimated physical properties.
+    """
+    if cutoff is None:
+        return predicted
+    model = copy.copy(mesh)
+    model.props = dict(mesh.props)
+    for prop, values in fmt_estimate(estimate, mesh.size).iteritems():
+        model.addprop(prop, values)
+    cells = []
+    if estimate:
+        indexes = numpy.unique(numpy.concatenate(
+            [numpy.frombuffer(i, dtype=i.typecode)
+             for i, v in estimate.itervalues()]))
+        cells = [model[i] for i in indexes]
+    filled = []
+    for d, p in zip(data, predicted):
+        if numpy.ndim(d.weights) == 0:
+            filled.append(p)
+            continue
+        kept = d.weights >= cutoff
+        dropped = _subset(d, numpy.nonzero(~kept)[0])
+        rest = numpy.zeros(dropped.size, dtype=p.dtype)
+        if dropped.size > 0 and d.prop in estimate:
+            rest += dropped.predict(cells)
+        full = numpy.zeros(d.size, dtype=p.dtype)
+        full[kept] = p
+        full[~kept] = rest
+        filled.append(full)
+    return filled
+
+def iharvest(data, seeds, mesh, compactness, threshold, cache=None,
+    strategy='scan', njobs=1, resume=None, cutoff=None):
     """
     Same as the :func:`fatiando.gravmag.harvester.harvest` function but this
     one returns an iterator that yields the information of each accretion.
 
+    The effects of the neighbors are taken from *cache* (an
+    :class:`~fatiando.gravmag.harvester.EffectCache`) when needed. Keep a
+    reference to the effects yielded if you need them later.
+
+    If *resume* is the name of a file saved by
+    :func:`~fatiando.gravmag.harvester.checkpoint`, the inversion continues
+    from the state in the file. The other arguments must be the same as in
+    the run that saved it. The accretions are the same as in a run that was
+    never stopped.
+
+    If *cutoff* is given, the data points with weights smaller than it are
+    dropped (see :func:`~fatiando.gravmag.harvester.harvest`). The predicted
+    data vectors yielded only have the remaining points.
+
+    With *njobs* > 1, the neighbors of the seeds are evaluated in batches
+    that fit in the maximum size of *cache* (see
+    :func:`~fatiando.gravmag.harvester.harvest`).
+
     Yields:
 
     * [estimate, predicted, new, neighbors, goal, misfit, regularizer]
@@ -330,96 +632,626 @@ def iharvest(data, seeds, mesh, compactness, threshold):
 
     The first yield contains the seeds. Thus ``new`` will be ``None``.
 
-    To format the estimate in a way that can be added to a mesh, use
-    function fmt_estimate of this module.
+    The unformated estimate is a dict with a pair of arrays for each physical
+    property: the indexes of the cells and their values, in the order they
+    were added. To format the estimate in a way that can be added to a mesh,
+    use function fmt_estimate of this module.
 
     """
+    for update in _accrete(data, seeds, mesh, compactness, threshold, cache,
+                           strategy, njobs, resume=resume, cutoff=cutoff):
+        yield update
+
+def _accrete(data, seeds, mesh, compactness, threshold, cache, strategy,
+    njobs, bodies=None, excluded=None, resume=None, cutoff=None):
+    """
+    The accretion loop of iharvest.
+
+    *bodies* is a list with the indexes of the cells (besides the seed) that
+    start in the estimate for each seed. *excluded* is a boolean array with
+    cells that can't be added to the estimate (besides the masked ones).
+    *resume* is a file with a saved state to start from (see _save_state).
+    *cutoff* drops the data points with smaller weights (see _select).
+    """
+    if strategy not in ['scan', 'heap']:
+        raise ValueError("Invalid growth strategy '%s'" % (str(strategy)))
+    if njobs is None:
+        njobs = multiprocessing.cpu_count()
+    if njobs > 1 and strategy != 'scan':
+        raise ValueError("njobs > 1 requires strategy='scan'")
+    if cutoff is not None:
+        data = [_select(d, cutoff) for d in data]
+    if cache is None:
+        cache = EffectCache(mesh, data)
+    if [d.size for d in cache.data] != [d.size for d in data]:
+        raise ValueError("The cache was made for different data. "
+                         + "Use the same cutoff in the cache.")
     nseeds = len(seeds)
-    estimate = dict((s.i, s.props) for s in seeds)
-    neighbors = []
-    for seed in seeds:
-        neighbors.append(_get_neighbors(seed, neighbors, estimate, mesh, data))
-    predicted = _init_predicted(data, seeds, mesh)
-    totalgoal = _shapefunc(data, predicted)
-    totalmisfit = _misfitfunc(data, predicted)
-    regularizer = 0.
+    masked = mesh.get_mask()
+    if excluded is not None:
+        masked = masked | excluded
+    # The seed that grows first and if any seed grew in this iteration
+    start, grew = 0, False
+    if resume is not None:
+        (estimate, predicted, neighbors, marks, totalgoal, totalmisfit,
+         regularizer, start) = _load_state(resume, data, seeds, mesh, cache)
+        grew = start > 0
+    else:
+        if bodies is None:
+            bodies = [[] for seed in seeds]
+        estimate = {}
+        for seed in seeds:
+            _add(estimate, seed.i, seed.props)
+        # Cells that are in the estimate or in the neighborhood of a seed
+        marks = {}
+        cells = []
+        regularizer = 0.
+        for seed, body in zip(seeds, bodies):
+            _mark([seed.i] + list(body), seed.props, marks, mesh.size)
+            cells.append([seed])
+            for i in body:
+                _add(estimate, i, seed.props)
+                distance = _distance(i, seed.i, mesh)
+                cells[-1].append(
+                    Neighbor(i, seed.props, seed.i, distance, None))
+                regularizer += distance
+        neighbors = []
+        for seed, seedcells in zip(seeds, cells):
+            neighbors.append({})
+            for cell in seedcells:
+                neighbors[-1].update(_get_neighbors(cell, marks, masked,
+                                                    mesh, data, cache))
+        predicted = _init_predicted(data, seeds, mesh, bodies)
+        totalgoal = _shapefunc(data, predicted)
+        totalmisfit = _misfitfunc(data, predicted)
     # Weight the regularizing function by the mean extent of the mesh
     mu = compactness*1./(sum(mesh.shape)/3.)
+    if strategy == 'heap':
+        queue = _GoalQueue(data, nseeds, mu, threshold)
+        for s in xrange(nseeds):
+            queue.add(s, neighbors[s].values(), predicted, totalmisfit)
+    pool = None
+    if njobs > 1:
+        pool = ThreadPool(njobs)
     yield [estimate, predicted, None, neighbors, totalgoal, totalmisfit,
            regularizer]
-    accretions = 0
-    for iteration in xrange(mesh.size - nseeds):
-        grew = False # To check if at least one seed grew (stopping criterion)
-        for s in xrange(nseeds):
-            best, bestgoal, bestmisfit, bestregularizer = _grow(neighbors[s],
-                data, predicted, totalmisfit, mu, regularizer, threshold)
-            if best is not None:
-                if best.i not in estimate:
-                    estimate[best.i] = {}
-                estimate[best.i].update(best.props)
-                totalgoal = bestgoal
-                totalmisfit = bestmisfit
-                regularizer = bestregularizer
-                for p, e in zip(predicted, best.effect):
-                    p += e
-                neighbors[s].pop(best.i)
-                neighbors[s].update(
-                    _get_neighbors(best, neighbors, estimate, mesh, data))
-                grew = True
-                accretions += 1
-                yield [estimate, predicted, best, neighbors, totalgoal,
-                       totalmisfit, regularizer]
-                del best
-        if not grew:
-            break
+    try:
+        for iteration in xrange(mesh.size - nseeds):
+            stacked, stackedto = [None]*nseeds, start
+            for s in xrange(start, nseeds):
+                if pool is not None and s == stackedto:
+                    stackedto = _batch(neighbors, s, data, cache.maxsize)
+                    stacked[s:stackedto] = _stack_all(neighbors[s:stackedto],
+                                                      data, predicted, pool)
+                if strategy == 'heap':
+                    best, bestgoal, bestmisfit, bestregularizer = queue.grow(s,
+                        predicted, totalmisfit, regularizer)
+                else:
+                    best, bestgoal, bestmisfit, bestregularizer = _grow(
+                        neighbors[s], data, predicted, totalmisfit, mu,
+                        regularizer, threshold, stacked[s])
+                if best is not None:
+                    _add(estimate, best.i, best.props)
+                    totalgoal = bestgoal
+                    totalmisfit = bestmisfit
+                    regularizer = bestregularizer
+                    if strategy == 'heap':
+                        before = [numpy.array(p, dtype=numpy.float)
+                                  for p in predicted]
+                    for p, e in zip(predicted, best.effect):
+                        p += e
+                    neighbors[s].pop(best.i)
+                    # The effect of a cell in the estimate is not needed
+                    # anymore
+                    cache.discard(best.i, best.props)
+                    new = _get_neighbors(best, marks, masked, mesh, data,
+                                         cache)
+                    neighbors[s].update(new)
+                    if strategy == 'heap':
+                        queue.move(before,
+                                   [p - b for p, b in zip(predicted, before)])
+                        queue.add(s, new.values(), predicted, totalmisfit)
+                    grew = True
+                    yield [estimate, predicted, best, neighbors, totalgoal,
+                           totalmisfit, regularizer]
+                    del best
+            # Stop if no seed grew
+            if not grew:
+                break
+            start, grew = 0, False
+    finally:
+        if pool is not None:
+            pool.close()
+
+def _add(estimate, index, props):
+    """
+    Add the cell *index* with physical properties *props* to the estimate.
 
-def _init_predicted(data, seeds, mesh):
+    *estimate* is a dict with a pair of arrays for each physical property: the
+    indexes of the cells and their values (in the order they were added).
     """
-    Make a list with the initial predicted data vectors (effect of seeds)
+    for p in props:
+        if p not in estimate:
+            estimate[p] = (array.array('l'), array.array('d'))
+        indexes, values = estimate[p]
+        indexes.append(index)
+        values.append(props[p])
+
+def _init_predicted(data, seeds, mesh, bodies=None):
     """
+    Make a list with the initial predicted data vectors (effect of seeds and
+    the cells in their *bodies*, if given)
+    """
+    if bodies is None:
+        bodies = [[] for seed in seeds]
     predicted = []
     for d in data:
         p = numpy.zeros(len(d.observed), dtype='f')
-        for seed in seeds:
-            p += d.effect(mesh[seed.i], seed.props)
+        for seed, body in zip(seeds, bodies):
+            for i in [seed.i] + list(body):
+                p += d.effect(mesh[i], seed.props)
         predicted.append(p)
     return predicted
 
+def checkpoint(updates, fname, seeds, every=1000):
+    """
+    Save the state of the inversion to a file every *every* accretions.
+
+    Passes along the updates of :func:`~fatiando.gravmag.harvester.iharvest`
+    so that it can be used in a chain of iterators. The state is also saved
+    when the inversion ends. The file is replaced at once (a crash while
+    saving leaves the previous state). Use it with the *resume* argument of
+    :func:`~fatiando.gravmag.harvester.iharvest` to continue the inversion.
+
+    The file is in numpy's compressed ``.npz`` format with the estimate,
+    predicted data, neighbors of each seed, goal, misfit and regularizer.
+
+    Parameters:
+
+    * updates : iterator
+        The output of :func:`~fatiando.gravmag.harvester.iharvest`
+    * fname : str
+        The name of the file
+    * seeds : list of :class:`~fatiando.gravmag.harvester.Seed`
+        The seeds used in the inversion
+    * every : int
+        The number of accretions between saves
+
+    Yields:
+
+    * The same as :func:`~fatiando.gravmag.harvester.iharvest`
+
+    Example::
+
+        updates = checkpoint(iharvest(data, seeds, mesh, 0.1, 0.0001,
+                                      resume=fname), fname, seeds)
+        for update in updates:
+            continue
+
+    """
+    update = None
+    for accretions, update in enumerate(updates):
+        if accretions > 0 and accretions%every == 0:
+            _save_state(fname, update, seeds)
+        yield update
+    if update is not None:
+        _save_state(fname, update, seeds)
+
+def monitor(updates, stream, cache=None, every=100, total=None):
+    """
+    Write the progress of the inversion to *stream* every *every*
+    accretions.
+
+    Passes along the updates of :func:`~fatiando.gravmag.harvester.iharvest`
+    so that it can be used in a chain of iterators. Each line has the number
+    of accretions, accretions per second (since the last line), cache hit
+    rate, goal function, misfit and estimated time to finish. The time to
+    finish is only known if the expected number of accretions is given
+    (*total*, e.g., from a previous run).
+
+    Parameters:
+
+    * updates : iterator
+        The output of :func:`~fatiando.gravmag.harvester.iharvest`
+    * stream : file-like object
+        Where to write. Anything with ``write`` and ``flush`` methods, like
+        ``sys.stderr``, an open log file or ``socket.makefile('w')``.
+    * cache : :class:`~fatiando.gravmag.harvester.EffectCache` or None
+        The cache used by the inversion. If None, the hit rate is not shown.
+    * every : int
+        The number of accretions between lines
+    * total : int or None
+        The expected number of accretions
+
+    Yields:
+
+    * The same as :func:`~fatiando.gravmag.harvester.iharvest`
+
+    """
+    last, before = 0, time.time()
+    for accretions, update in enumerate(updates):
+        yield update
+        if accretions == 0 or accretions%every != 0:
+            continue
+        now = time.time()
+        rate = (accretions - last)/max(now - before, 10.**(-9))
+        last, before = accretions, now
+        line = ["accretions: %d" % (accretions), "rate: %.1f/s" % (rate)]
+        if cache is not None:
+            hits = cache.stats['hits'] + cache.stats['disk-hits']
+            requests = hits + cache.stats['misses']
+            if requests > 0:
+                line.append("cache hits: %.1f%%" % (100.*hits/requests))
+        line.extend(["goal: %g" % (update[4]), "misfit: %g" % (update[5])])
+        if total is not None:
+            eta = int(max(total - accretions, 0)/rate)
+            line.append("ETA: %d:%02d:%02d" % (eta/3600, (eta/60)%60, eta%60))
+        stream.write(' | '.join(line) + '\n')
+        stream.flush()
+
+def _save_state(fname, update, seeds):
+    """
+    Save the state of the inversion given by an update of iharvest.
+
+    The file is written to a temporary name and then renamed to *fname*.
+    """
+    estimate, predicted, new, neighbors, goal, misfit, regularizer = update
+    names = sorted(estimate)
+    # The seed that grows next. The update comes right after new was added.
+    following = 0
+    if new is not None:
+        following = [s.i for s in seeds].index(new.seed) + 1
+    tmp = fname + '.tmp'
+    with open(tmp, 'wb') as f:
+        numpy.savez_compressed(f,
+            seeds=numpy.array([s.i for s in seeds], dtype=numpy.int),
+            names=numpy.array(names, dtype=numpy.str),
+            cells=numpy.concatenate([estimate[n][0] for n in names]),
+            props=numpy.concatenate([estimate[n][1] for n in names]),
+            ncells=numpy.array([len(estimate[n][0]) for n in names],
+                               dtype=numpy.int),
+            predicted=numpy.concatenate(predicted),
+            sizes=numpy.array([len(p) for p in predicted], dtype=numpy.int),
+            neighbors=numpy.array(
+                [i for n in neighbors for i in n], dtype=numpy.int),
+            counts=numpy.array([len(n) for n in neighbors], dtype=numpy.int),
+            scalars=numpy.array([goal, misfit, regularizer]),
+            following=following)
+    os.rename(tmp, fname)
+
+def _load_state(fname, data, seeds, mesh, cache):
+    """
+    Load the state of the inversion saved by _save_state.
+
+    Returns [estimate, predicted, neighbors, marks, goal, misfit, regularizer,
+    start] where *start* is the seed that grows first.
+    """
+    with numpy.load(fname) as f:
+        if f['seeds'].tolist() != [s.i for s in seeds]:
+            raise ValueError("Seeds don't match the ones in '%s'" % (fname))
+        sizes = f['sizes'].tolist()
+        if sizes != [d.size for d in data]:
+            raise ValueError("Data don't match the ones in '%s'" % (fname))
+        names = [str(n) for n in f['names']]
+        splits = numpy.cumsum(f['ncells'])[:-1]
+        estimate = {}
+        for n, cells, props in zip(names, numpy.split(f['cells'], splits),
+                                   numpy.split(f['props'], splits)):
+            estimate[n] = (array.array('l', cells.tolist()),
+                           array.array('d', props.tolist()))
+        predicted = [numpy.array(p) for p in
+                     numpy.split(f['predicted'], numpy.cumsum(sizes)[:-1])]
+        indexes = numpy.split(f['neighbors'],
+                              numpy.cumsum(f['counts'])[:-1])
+        goal, misfit, regularizer = f['scalars'].tolist()
+        start = int(f['following'])%len(seeds)
+    marks = {}
+    for n in estimate:
+        _mark(estimate[n][0], [n], marks, mesh.size)
+    neighbors = []
+    for seed, seedindexes in zip(seeds, indexes):
+        seedindexes = seedindexes.tolist()
+        _mark(seedindexes, seed.props, marks, mesh.size)
+        neighbors.append(dict(
+            (i, Neighbor(i, seed.props, seed.i, _distance(i, seed.i, mesh),
+                         cache))
+            for i in seedindexes))
+    return [estimate, predicted, neighbors, marks, goal, misfit, regularizer,
+            start]
+
 def fmt_estimate(estimate, size):
     """
     Make a nice dict with the estimated physical properties in separate arrays
+
+    Each physical property is a :class:`~fatiando.utils.SparseList` that can
+    be given to ``mesh.addprop`` or converted to an array with
+    ``numpy.asarray``.
     """
     output = {}
-    for i in estimate:
-        props = estimate[i]
-        for p in props:
-            if p not in output:
-                output[p] = utils.SparseList(size)
-            output[p][i] = props[p]
+    for p, (indexes, values) in estimate.iteritems():
+        output[p] = utils.SparseList(size,
+            indexes=numpy.frombuffer(indexes, dtype=indexes.typecode),
+            values=numpy.frombuffer(values, dtype=values.typecode))
     return output
 
-def _grow(neighbors, data, predicted, totalmisfit, mu, regularizer, threshold):
+def _grow(neighbors, data, predicted, totalmisfit, mu, regularizer, threshold,
+    stacked=None):
     """
     Find the neighbor with smallest goal function that also decreases the
     misfit
+
+    All neighbors are evaluated at once. Their effects on each data set are
+    stacked in a matrix and the misfit and shape-of-anomaly functions of all
+    of them are calculated with a matrix product using the expansion
+    ||r - e||^2 = ||r||^2 - 2 r.e + ||e||^2. The squared norms of the effects
+    are calculated only once for each neighbor (see _effect_norms).
+
+    *stacked* is the output of _stack for ``neighbors.values()`` (if None,
+    will be calculated here).
+    """
+    if not neighbors:
+        return None, None, None, None
+    candidates = neighbors.values()
+    misfits, shapes = _evaluate(candidates, data, predicted, stacked)
+    regularizers = regularizer + numpy.array([c.distance for c in candidates])
+    goals = shapes + mu*regularizers
+    decrease = _decrease(misfits, totalmisfit, threshold)
+    if not numpy.any(decrease):
+        return None, None, None, None
+    # argmin gives the first of the smallest, like looping over the neighbors
+    best = numpy.nonzero(decrease)[0][numpy.argmin(goals[decrease])]
+    return (candidates[best], float(goals[best]), float(misfits[best]),
+            float(regularizers[best]))
+
+def _decrease(misfits, totalmisfit, threshold):
+    """
+    Check which misfits are smaller than totalmisfit by at least threshold
+    (relative).
+    """
+    return ((misfits < totalmisfit) &
+            (numpy.abs(misfits - totalmisfit)/totalmisfit >= threshold))
+
+def _evaluate(candidates, data, predicted, stacked=None):
+    """
+    Calculate the misfit and shape-of-anomaly functions for the predicted
+    data plus the effect of each candidate.
+
+    The effects on each data set are stacked in a matrix and the functions of
+    all candidates are calculated with a matrix product (see _grow).
+
+    *stacked* is the output of _stack for the candidates (if None, will be
+    calculated here). If it was made with older predicted data, the products
+    are corrected for the change with one more matrix product.
+
+    Returns two arrays: the misfits and the shape-of-anomaly values.
+    """
+    if stacked is None:
+        stacked = _stack(candidates, [c.effect for c in candidates], data,
+                         predicted)
+    matrices, products, norms, base = stacked
+    misfits = numpy.zeros(len(candidates))
+    shapes = numpy.zeros(len(candidates))
+    for j, (d, p) in enumerate(zip(data, predicted)):
+        matrix, prods = matrices[j], products[j]
+        p = numpy.asarray(p, dtype=numpy.float)
+        change = p - base[j]
+        if numpy.any(change):
+            correction = numpy.dot(matrix,
+                                   numpy.transpose([d.weights*change, change]))
+            prods = numpy.transpose([prods[:, 0] - correction[:, 0],
+                                     prods[:, 1],
+                                     prods[:, 2] + correction[:, 1]])
+        residuals = d.observed - p
+        weighted = d.weights*residuals
+        misfit = (numpy.dot(weighted, residuals) - 2.*prods[:, 0] +
+                  norms[:, j, 0])
+        misfits += numpy.sqrt(numpy.maximum(misfit, 0.))/d.norm
+        # The shape-of-anomaly is ||q||^2 - (o.q)^2/||o||^2 for q = p + e
+        normsqr = numpy.dot(p, p) + 2.*prods[:, 2] + norms[:, j, 1]
+        cross = numpy.dot(d.observed, p) + prods[:, 1]
+        shapes += numpy.sqrt(numpy.maximum(normsqr - cross**2/d.norm**2, 0.))
+    return misfits, shapes
+
+def _stack(candidates, effects, data, predicted):
+    """
+    Stack the effects of the candidates in a matrix for each data set and
+    multiply them by the weighted residuals, observed and predicted data.
+
+    Returns [matrices, products, norms, base]: lists with the matrices and
+    products for each data set, the squared norms of the effects (see
+    _effect_norms) and a copy of the predicted data used.
+    """
+    norms = _effect_norms(candidates, effects, data)
+    matrices, products, base = [], [], []
+    for j, (d, p) in enumerate(zip(data, predicted)):
+        matrix = numpy.array([e[j] for e in effects], dtype=numpy.float)
+        p = numpy.array(p, dtype=numpy.float)
+        weighted = d.weights*(d.observed - p)
+        matrices.append(matrix)
+        products.append(numpy.dot(matrix,
+                                  numpy.transpose([weighted, d.observed, p])))
+        base.append(p)
+    return [matrices, products, norms, base]
+
+def _stack_all(neighbors, data, predicted, pool):
+    """
+    Run _stack for the neighbors of each seed in parallel using a pool of
+    threads.
+
+    The effects are taken from the cache here because the cache is not thread
+    safe. Returns a list with the output of _stack (or None) for each seed.
     """
-    best = None
-    bestgoal = None
-    bestmisfit = None
-    bestregularizer = None
-    for n in neighbors:
-        pred = [p + e for p, e in zip(predicted, neighbors[n].effect)]
-        misfit = _misfitfunc(data, pred)
-        if (misfit < totalmisfit and
-            float(abs(misfit - totalmisfit))/totalmisfit >= threshold):
-            reg = regularizer + neighbors[n].distance
-            goal = _shapefunc(data, pred) + mu*reg
-            if bestgoal is None or goal < bestgoal:
-                bestgoal = goal
-                best = neighbors[n]
-                bestmisfit = misfit
-                bestregularizer = reg
-    return best, bestgoal, bestmisfit, bestregularizer
+    jobs = []
+    for neighborhood in neighbors:
+        candidates = neighborhood.values()
+        jobs.append([candidates, [c.effect for c in candidates], data,
+                     predicted])
+    return pool.map(_stack_job, jobs)
+
+def _batch(neighbors, start, data, maxsize):
+    """
+    Find where the batch of seeds stacked at once by _stack_all ends.
+
+    The batch starts at seed *start* and takes the seeds that follow while the
+    effects of all their neighbors fit in *maxsize* bytes (at least one seed).
+    If *maxsize* is None, the batch has all the remaining seeds.
+    """
+    if maxsize is None:
+        return len(neighbors)
+    nbytes = numpy.dtype(numpy.float).itemsize*sum(d.size for d in data)
+    end, size = start + 1, len(neighbors[start])*nbytes
+    while end < len(neighbors):
+        size += len(neighbors[end])*nbytes
+        if size > maxsize:
+            break
+        end += 1
+    return end
+
+def _stack_job(args):
+    if not args[0]:
+        return None
+    return _stack(*args)
+
+class _GoalQueue(object):
+    """
+    Priority queues with the neighbors of each seed for the 'heap' growth
+    strategy of iharvest.
+
+    Neighbors that decrease the misfit enough are kept in a heap ordered by
+    a key that gives a lower bound of their current goal function (the key
+    plus the current drift, see move). The regularizer is left out because it
+    is the same for all neighbors. While the top of the heap is stale (was
+    evaluated before the last change in the predicted data), the stale
+    neighbors at the top are evaluated again and pushed back. The best
+    neighbor is found when the top is up to date. The other neighbors are
+    parked in a second heap ordered by a lower bound of their misfit and are
+    only evaluated again when they could decrease the current misfit.
+    """
+
+    def __init__(self, data, nseeds, mu, threshold):
+        self.data = data
+        self.mu = mu
+        self.threshold = threshold
+        self.goals = [[] for s in xrange(nseeds)]
+        self.parked = [[] for s in xrange(nseeds)]
+        self.step = 0
+        self.shapedrift = 0.
+        self.misfitdrift = 0.
+        # The largest norms of the effects of the neighbors on each data set
+        # (weighted and unweighted)
+        self.largest = numpy.zeros((len(data), 2))
+
+    def add(self, s, candidates, predicted, totalmisfit):
+        """
+        Evaluate the candidates of seed s and put them in the queues.
+        """
+        if not candidates:
+            return
+        misfits, shapes = _evaluate(candidates, self.data, predicted)
+        norms = numpy.sqrt(numpy.array([c.norms for c in candidates]))
+        self.largest = numpy.maximum(self.largest, norms.max(axis=0))
+        decrease = _decrease(misfits, totalmisfit, self.threshold)
+        for c, misfit, shape, valid in zip(candidates, misfits, shapes,
+                                           decrease):
+            if valid:
+                key = shape + self.mu*c.distance - self.shapedrift
+                heapq.heappush(self.goals[s],
+                               (key, c.i, self.step, c, shape, misfit))
+            else:
+                heapq.heappush(self.parked[s],
+                               (misfit - self.misfitdrift, c.i, c))
+
+    def move(self, before, change):
+        """
+        Update the drift with a change in the predicted data (one array per
+        data set). *before* are the predicted data before the change.
+
+        The shape-of-anomaly function of a data set is the norm of the
+        predicted data plus the effect of a neighbor (p + e) projected onto
+        the space orthogonal to the observed data (call it a = u + f, where u
+        is the projection of p and f of e). Adding the change (projected b)
+        gives ||a + b|| >= ||a|| + a.b/||a|| (Cauchy-Schwarz). Because
+        a.b >= u.b - ||f|| ||b|| and ||u|| - ||f|| <= ||a|| <= ||u|| + ||f||,
+        this gives a lower bound of the change that is the same for all
+        neighbors (using the largest ||f||). It is never less than -||b||
+        (triangle inequality). The same is done for the misfit with the
+        weighted residuals. The bounds are accumulated in the drift.
+        """
+        for j, (d, p, c) in enumerate(zip(self.data, before, change)):
+            onorm2 = d.norm**2
+            op, oc = numpy.dot(d.observed, p), numpy.dot(d.observed, c)
+            self.shapedrift += self._bound(
+                numpy.dot(p, p) - op**2/onorm2,
+                numpy.dot(p, c) - op*oc/onorm2,
+                numpy.dot(c, c) - oc**2/onorm2,
+                self.largest[j, 1])
+            residuals = d.observed - p
+            weighted = d.weights*residuals
+            self.misfitdrift += self._bound(
+                numpy.dot(weighted, residuals),
+                -numpy.dot(weighted, c),
+                numpy.dot(d.weights*c, c),
+                self.largest[j, 0])/d.norm
+        self.step += 1
+
+    def _bound(self, usqr, ub, bsqr, largest):
+        """
+        Lower bound of ||u + f + b|| - ||u + f|| for any ||f|| <= largest.
+        """
+        unorm, bnorm = sqrt(max(usqr, 0.)), sqrt(max(bsqr, 0.))
+        numerator = ub - largest*bnorm
+        if numerator >= 0:
+            return numerator/(unorm + largest)
+        if unorm > largest:
+            return max(numerator/(unorm - largest), -bnorm)
+        return -bnorm
+
+    def grow(self, s, predicted, totalmisfit, regularizer):
+        """
+        Find and remove the best neighbor of seed s. Same output as _grow.
+        """
+        goals, parked = self.goals[s], self.parked[s]
+        # Bring back the neighbors that could now decrease the misfit enough
+        limit = totalmisfit*(1. - self.threshold)
+        unparked = []
+        while parked and parked[0][0] + self.misfitdrift <= limit:
+            unparked.append(heapq.heappop(parked)[-1])
+        self.add(s, unparked, predicted, totalmisfit)
+        # Evaluate the stale neighbors at the top in chunks that double in
+        # size so that the work is done in a few large matrix products
+        chunk = 8
+        while goals:
+            key, i, step, best, shape, misfit = goals[0]
+            if step == self.step:
+                heapq.heappop(goals)
+                reg = regularizer + best.distance
+                return best, shape + self.mu*reg, misfit, reg
+            stale = []
+            while goals and goals[0][2] != self.step and len(stale) < chunk:
+                stale.append(heapq.heappop(goals)[3])
+            self.add(s, stale, predicted, totalmisfit)
+            chunk *= 2
+        return None, None, None, None
+
+def _effect_norms(candidates, effects, data):
+    """
+    Get the weighted and unweighted squared norms of the effects of the
+    candidates on each data set.
+
+    The norms are kept in the ``norms`` attribute of the candidates so that
+    they are calculated only once.
+
+    Returns an array with shape (len(candidates), len(data), 2).
+    """
+    missing = [k for k, c in enumerate(candidates) if c.norms is None]
+    for k in missing:
+        norms = numpy.empty((len(data), 2))
+        for j, d in enumerate(data):
+            effect = numpy.asarray(effects[k][j], dtype=numpy.float)
+            norms[j, 1] = numpy.dot(effect, effect)
+            norms[j, 0] = numpy.dot(d.weights*effect, effect)
+        candidates[k].norms = norms
+    return numpy.array([c.norms for c in candidates])
 
 def _shapefunc(data, predicted):
     """
@@ -443,20 +1275,32 @@ def _misfitfunc(data, predicted):
         result += sqrt(numpy.dot(d.weights*residuals, residuals))/d.norm
     return result
 
-def _get_neighbors(cell, neighborhood, estimate, mesh, data):
+def _get_neighbors(cell, marks, masked, mesh, data, cache=None):
     """
     Return a dict with the new neighbors of cell.
     keys are the index of the neighbors in the mesh. values are the Neighbor
     objects.
+
+    Cells already in the estimate or in the neighborhood of a seed with any of
+    the physical properties of cell are left out (see _mark). The new
+    neighbors are then marked. *masked* is a boolean array with the masked
+    cells of the mesh.
+
+    If *cache* is an EffectCache, the effects of the neighbors are only
+    calculated when needed and kept in the cache. Otherwise, they are
+    calculated right away.
     """
-    indexes = [n for n in _neighbor_indexes(cell.i, mesh)
-               if not _is_neighbor(n, cell.props, neighborhood)
-                  and not _in_estimate(n, cell.props, estimate)]
+    indexes = [n for n in _neighbor_indexes(cell.i, mesh, masked)
+               if not _is_marked(n, cell.props, marks)]
+    _mark(indexes, cell.props, marks, mesh.size)
+    if cache is None:
+        effects = [_calc_effect(i, cell.props, mesh, data) for i in indexes]
+    else:
+        effects = [cache for i in indexes]
     neighbors = dict(
         (i, Neighbor(
-            i, cell.props, cell.seed, _distance(i, cell.seed, mesh),
-            _calc_effect(i, cell.props, mesh, data)))
-        for i in indexes)
+            i, cell.props, cell.seed, _distance(i, cell.seed, mesh), effect))
+        for i, effect in zip(indexes, effects))
     return neighbors
 
 def _calc_effect(index, props, mesh, data):
@@ -485,30 +1329,37 @@ def _index2ijk(index, mesh):
     i = (index - k*(nx*ny) - j*nx)
     return i, j, k
 
-def _in_estimate(index, props, estimate):
+def _mark(indexes, props, marks, size):
     """
-    Check is index is in estimate with props
+    Mark the cells in *indexes* as taken for the physical properties in props.
+
+    *marks* is a dict with a boolean array over the cells of the mesh for each
+    physical property. A cell is marked once it enters the neighborhood of a
+    seed and stays marked when it is added to the estimate. Arrays are created
+    as needed.
     """
-    if index in estimate:
-        for p in props:
-            if p in estimate[index]:
-                return True
-    return False
+    for p in props:
+        if p not in marks:
+            marks[p] = numpy.zeros(size, dtype=numpy.bool)
+        marks[p][indexes] = True
 
-def _is_neighbor(index, props, neighborhood):
+def _is_marked(index, props, marks):
     """
-    Check if index is already in the neighborhood with props
+    Check if index is already in the estimate or in the neighborhood of a seed
+    with any of the physical properties in props.
     """
-    for neighbors in neighborhood:
-        for n in neighbors:
-            if index == neighbors[n].i:
-                for p in props:
-                    if p in neighbors[n].props:
-                        return True
+    for p in props:
+        if p in marks and marks[p][index]:
+            return True
     return False
 
-def _neighbor_indexes(n, mesh):
-    """Find the indexes of the neighbors of n"""
+def _neighbor_indexes(n, mesh, masked=None):
+    """
+    Find the indexes of the neighbors of n
+
+    If given, *masked* is a boolean array with the masked cells of the mesh.
+    Avoids checking the mask of the mesh for each neighbor.
+    """
     nz, ny, nx = mesh.shape
     indexes = []
     # The guy above
@@ -536,6 +1387,8 @@ def _neighbor_indexes(n, mesh):
     if n%(nx*ny) >= nx:
         indexes.append(tmp)
     # Filter out the ones that do not exist or are masked (topography)
+    if masked is not None:
+        return [i for i in indexes if not masked[i]]
     return [i for i in indexes if i is not None and mesh[i] is not None]
 
 class Seed(Prism):
@@ -553,6 +1406,10 @@ class Seed(Prism):
 class Neighbor(object):
     """
     A neighbor.
+
+    *effect* is either the list of effects of the neighbor on each data set or
+    an :class:`~fatiando.gravmag.harvester.EffectCache` from which they are
+    fetched when needed.
     """
 
     def __init__(self, i, props, seed, distance, effect):
@@ -560,7 +1417,187 @@ class Neighbor(object):
         self.props = props
         self.seed = seed
         self.distance = distance
-        self.effect = effect
+        self._effect = effect
+        # The squared norms of the effect (see _effect_norms)
+        self.norms = None
+
+    @property
+    def effect(self):
+        if isinstance(self._effect, EffectCache):
+            return self._effect.get(self.i, self.props)
+        return self._effect
+
+class EffectCache(object):
+    """
+    A size-bounded cache of the effects of the cells of a mesh on the data.
+
+    Used by :func:`~fatiando.gravmag.harvester.harvest` to store the effects
+    of the neighbors of all seeds. Each entry is the effect of a cell on one
+    data set for a value of the physical property used by that data set. The
+    least recently used entries are dropped when the cache is larger than
+    *maxsize* and are calculated again if needed. Optionally, the dropped
+    entries are kept in temporary files on disk (using ``numpy.memmap``)
+    before being discarded.
+
+    Parameters:
+
+    * mesh : :class:`fatiando.mesher.PrismMesh`
+        The mesh used in the inversion
+    * data : list of data (e.g., :class:`~fatiando.gravmag.harvester.Gz`)
+        The data used in the inversion (same order as in
+        :func:`~fatiando.gravmag.harvester.harvest`)
+    * maxsize : int or None
+        Maximum number of bytes kept in memory. If None, there is no limit.
+    * dtype : numpy dtype or None
+        The type used to store the effects. Use ``numpy.float32`` to store
+        twice as many effects in the same space. If None, will store them as
+        they are calculated.
+    * disk : str or None
+        If not None, the directory where the temporary files of the disk tier
+        are created.
+    * disksize : int or None
+        Maximum number of bytes kept on disk. Required if *disk* is given.
+    * cutoff : float or None
+        The same *cutoff* given to :func:`~fatiando.gravmag.harvester.harvest`
+        (the effects are only calculated on the data points kept).
+
+    The number of hits, misses (effects calculated), disk hits and evictions
+    from memory are counted in the ``stats`` dict attribute.
+
+    Examples:
+
+        >>> from fatiando.mesher import PrismMesh
+        >>> mesh = PrismMesh((0, 10, 0, 10, 0, 10), (2, 2, 2))
+        >>> x, y, z = numpy.array([[5., 5.], [0., 10.], [-1., -1.]])
+        >>> data = [Gz(x, y, z, numpy.ones(2))]
+        >>> # Room for only 2 effects (2 float32 values each)
+        >>> cache = EffectCache(mesh, data, maxsize=16, dtype=numpy.float32)
+        >>> for i in [0, 1, 0, 2, 0, 1]:
+        ...     effect = cache.get(i, {'density':1000})
+        >>> print effect[0].dtype
+        float32
+        >>> for k in sorted(cache.stats):
+        ...     print k, cache.stats[k]
+        disk-hits 0
+        evictions 2
+        hits 2
+        misses 4
+
+    """
+
+    def __init__(self, mesh, data, maxsize=None, dtype=None, disk=None,
+                 disksize=None, cutoff=None):
+        if cutoff is not None:
+            data = [_select(d, cutoff) for d in data]
+        self.mesh = mesh
+        self.data = data
+        self.maxsize = maxsize
+        self.dtype = dtype
+        self.size = 0
+        self._props = [d.prop for d in data]
+        self.stats = {'hits':0, 'misses':0, 'disk-hits':0, 'evictions':0}
+        # Only need to keep track of the order of use if there is a limit
+        if maxsize is None:
+            self._memory = {}
+        else:
+            self._memory = OrderedDict()
+        self._disk = None
+        if disk is not None:
+            if disksize is None:
+                raise ValueError("Need disksize to use the disk tier")
+            storage = numpy.dtype(numpy.float if dtype is None else dtype)
+            self._files, self._disk, self._slots, self._free = [], [], [], []
+            for d in data:
+                # Split the space on disk evenly between the data sets
+                nslots = max(1,
+                    int(disksize/(len(data)*d.size*storage.itemsize)))
+                tmp = tempfile.TemporaryFile(dir=disk)
+                self._files.append(tmp)
+                self._disk.append(numpy.memmap(tmp, dtype=storage, mode='w+',
+                                               shape=(nslots, d.size)))
+                self._slots.append(OrderedDict())
+                self._free.append(range(nslots))
+
+    def __len__(self):
+        return len(self._memory)
+
+    def get(self, index, props):
+        """
+        Get the effect of cell *index* with physical properties *props* on
+        each data set.
+
+        Returns a list with one array per data set. Don't modify the arrays.
+        """
+        if self.maxsize is None:
+            # Fast path for when all effects are in memory
+            effects = [self._memory.get((index, j, p, props.get(p)))
+                       for j, p in enumerate(self._props)]
+            if all(e is not None for e in effects):
+                self.stats['hits'] += len(effects)
+                return effects
+        return [self._get(index, j, props) for j in xrange(len(self.data))]
+
+    def discard(self, index, props):
+        """
+        Remove the effects of cell *index* with *props* from the cache.
+        """
+        for j in xrange(len(self.data)):
+            key = self._key(index, j, props)
+            effect = self._memory.pop(key, None)
+            if effect is not None:
+                self.size -= effect.nbytes
+            if self._disk is not None and key in self._slots[j]:
+                self._free[j].append(self._slots[j].pop(key))
+
+    def _key(self, index, j, props):
+        prop = self._props[j]
+        return (index, j, prop, props.get(prop))
+
+    def _get(self, index, j, props):
+        key = self._key(index, j, props)
+        if self.maxsize is None:
+            effect = self._memory.get(key)
+        else:
+            effect = self._memory.pop(key, None)
+            if effect is not None:
+                # Put it back as the most recently used
+                self._memory[key] = effect
+        if effect is not None:
+            self.stats['hits'] += 1
+            return effect
+        if self._disk is not None and key in self._slots[j]:
+            slot = self._slots[j].pop(key)
+            self._free[j].append(slot)
+            effect = numpy.array(self._disk[j][slot])
+            self.stats['disk-hits'] += 1
+        else:
+            effect = self.data[j].effect(self.mesh[index], props)
+            if self.dtype is not None:
+                effect = numpy.asarray(effect, dtype=self.dtype)
+            self.stats['misses'] += 1
+        self._store(key, effect)
+        return effect
+
+    def _store(self, key, effect):
+        if self.maxsize is not None and effect.nbytes > self.maxsize:
+            return
+        self._memory[key] = effect
+        self.size += effect.nbytes
+        while self.maxsize is not None and self.size > self.maxsize:
+            old, evicted = self._memory.popitem(last=False)
+            self.size -= evicted.nbytes
+            self.stats['evictions'] += 1
+            if self._disk is not None:
+                self._to_disk(old, evicted)
+
+    def _to_disk(self, key, effect):
+        j = key[1]
+        if not self._free[j]:
+            # Drop the least recently used effect on disk
+            self._free[j].append(self._slots[j].popitem(last=False)[1])
+        slot = self._free[j].pop()
+        self._disk[j][slot] = effect
+        self._slots[j][key] = slot
 
 def weights(x, y, seeds, influences, decay=2):
     """
@@ -650,6 +1687,13 @@ class Potential(Data):
         return self.effectfunc(self.x, self.y, self.z, [prism],
             props[self.prop])
 
+    def predict(self, cells):
+        """
+        Calculate the data produced by a list of cells (using their physical
+        properties).
+        """
+        return self.effectfunc(self.x, self.y, self.z, cells)
+
 class Gz(Potential):
     """
     A container for data of the gravity anomaly.
@@ -871,3 +1915,7 @@ class TotalField(Potential):
             return numpy.zeros(self.size, dtype='f')
         return self.effectfunc(self.x, self.y, self.z, [prism], self.inc,
             self.dec, pmag=props[self.prop])
+
+    def predict(self, cells):
+        return self.effectfunc(self.x, self.y, self.z, cells, self.inc,
+            self.dec)
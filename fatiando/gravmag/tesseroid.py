@@ -2,8 +2,10 @@
 Calculates the potential fields of a tesseroid.
 """
 import numpy
+import scipy.spatial
 
-from fatiando.mesher import Tesseroid
+from fatiando.mesher import Tesseroid, TesseroidMesh
+from fatiando import utils
 from fatiando.constants import SI2MGAL, SI2EOTVOS, MEAN_EARTH_RADIUS, G
 
 
@@ -13,108 +15,864 @@ except ImportError:
     from fatiando.gravmag import _tesseroid as _kernels
 
 
-_glq_nodes = numpy.array([-0.577350269, 0.577350269])
-_glq_weights = numpy.array([1., 1.])
+# Maximum relative error of the default discretization (2 GLQ nodes per
+# dimension) for each distance-size ratio in _error_ratios. Measured against
+# the analytic solutions in fatiando.gravmag.half_sph_shell for a half shell
+# 50 km thick (made of 3.6 x 3.6 degree tesseroids) at heights from 1 to 1000
+# km. gx and gy use the curve of gz and the other tensor components use the
+# one of gzz. Used to choose the ratio when a tolerance is given.
+_error_ratios = [0.5, 0.75, 1., 1.5, 2., 3., 4., 5., 6., 8.]
+_error_curves = {
+    'potential':[8.8e-4, 4.3e-4, 3.1e-5, 3.2e-5, 1.1e-6, 1.5e-6, 5.2e-7,
+                 3.1e-7, 1.8e-7, 7.8e-8],
+    'gz':[3.3e-1, 3.3e-2, 2.4e-3, 1.3e-3, 6.1e-5, 2.1e-5, 7.2e-6, 3.2e-6,
+          1.7e-6, 6.0e-7],
+    'gzz':[2.7e1, 7.1, 1.4, 9.4e-3, 1.9e-3, 1.2e-3, 2.4e-4, 1.2e-4, 2.5e-5,
+           3.7e-6]}
+_error_curves['gx'] = _error_curves['gy'] = _error_curves['gz']
+for _c in ['gxx', 'gxy', 'gxz', 'gyy', 'gyz']:
+    _error_curves[_c] = _error_curves['gzz']
 
+# The GLQ nodes and weights of each order already used. Computed only once.
+_glq_cache = {}
+# The highest GLQ order used for the points that are still too close to a
+# tesseroid when the maximum number of splits is reached (unless maxorder is
+# given)
+_depth_limit_order = 8
 
-def potential(lons, lats, heights, tesseroids, dens=None, ratio=1.):
+# The integer codes of each field component used by the fused kernel
+# (_kernels.fields), the conversion from SI units and the default distance-size
+# ratio of each one
+_codes = {'potential':0, 'gx':1, 'gy':2, 'gz':3, 'gxx':4, 'gxy':5, 'gxz':6,
+          'gyy':7, 'gyz':8, 'gzz':9}
+# gz is multiplied by -1 so that z is pointing down (see gz)
+_scales = {'potential':1., 'gx':SI2MGAL, 'gy':SI2MGAL, 'gz':-SI2MGAL,
+           'gxx':SI2EOTVOS, 'gxy':SI2EOTVOS, 'gxz':SI2EOTVOS,
+           'gyy':SI2EOTVOS, 'gyz':SI2EOTVOS, 'gzz':SI2EOTVOS}
+_ratios = {'potential':1., 'gx':1., 'gy':1., 'gz':1.,
+           'gxx':3., 'gxy':3., 'gxz':3., 'gyy':3., 'gyz':3., 'gzz':3.}
+
+
+class SphericalPoints(object):
+    """
+    Store the geometry of a set of computation points in spherical coordinates.
+
+    Pre-computes the radii, the sines and cosines of the latitudes and
+    longitudes, and a KD-tree of the points. These are needed by every forward
+    modeling function of this module. Pass an instance of this class instead
+    of *lons* (and ``None`` for *lats* and *heights*) to avoid repeating this
+    work on every call (e.g., in inversions).
+
+    Parameters:
+
+    * lons, lats, heights : 1d arrays
+        The longitudes, latitudes (in degrees) and heights (in meters) of the
+        computation points
+
+    Examples:
+
+        >>> points = SphericalPoints([0, 90], [0, 0], [1000, 2000])
+        >>> print points.size
+        2
+        >>> print points.radii - MEAN_EARTH_RADIUS
+        [ 1000.  2000.]
+        >>> print points.coslon.round(10), points.sinlon.round(10)
+        [ 1.  0.] [ 0.  1.]
+
+    """
+
+    def __init__(self, lons, lats, heights):
+        self.lons = numpy.array(lons, dtype=numpy.float)
+        self.lats = numpy.array(lats, dtype=numpy.float)
+        self.heights = numpy.array(heights, dtype=numpy.float)
+        self.size = len(self.lons)
+        d2r = numpy.pi/180.
+        self.sinlon = numpy.sin(d2r*self.lons)
+        self.coslon = numpy.cos(d2r*self.lons)
+        self.sinlat = numpy.sin(d2r*self.lats)
+        self.coslat = numpy.cos(d2r*self.lats)
+        self.radii = MEAN_EARTH_RADIUS + self.heights
+        self.radii_sqr = self.radii**2
+        # Index the points in Cartesian coordinates so that the points close
+        # to a tesseroid can be found with a range query
+        self.tree = scipy.spatial.cKDTree(numpy.transpose(
+            utils.sph2cart(self.lons, self.lats, self.heights)))
+
+    def __len__(self):
+        return self.size
+
+def potential(lons, lats, heights, tesseroids, dens=None, ratio=1., tol=None,
+    order=2, maxorder=None, maxdepth=15, shells=False, report=False):
     """
     Calculate the gravitational potential due to a tesseroid model.
     """
-    return _optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.potential, ratio, dens)
+    if tol is not None:
+        ratio = _tol2ratio('potential', tol)
+    counters = _new_counters()
+    result = _optimal_discretize(tesseroids, lons, lats, heights,
+        _kernels.potential, ratio, dens, order, maxorder, _codes['potential'],
+        maxdepth, counters, shells)
+    return _output(result, counters, report)
 
-def gx(lons, lats, heights, tesseroids, dens=None, ratio=1.):
+def gx(lons, lats, heights, tesseroids, dens=None, ratio=1., tol=None,
+    order=2, maxorder=None, maxdepth=15, shells=False, report=False):
     """
     Calculate the x (North) component of the gravitational attraction due to a
     tesseroid model.
     """
-    return SI2MGAL*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gx, ratio, dens)
+    if tol is not None:
+        ratio = _tol2ratio('gx', tol)
+    counters = _new_counters()
+    result = SI2MGAL*_optimal_discretize(tesseroids, lons, lats, heights,
+        _kernels.gx, ratio, dens, order, maxorder, _codes['gx'], maxdepth,
+        counters, shells)
+    return _output(result, counters, report)
 
-def gy(lons, lats, heights, tesseroids, dens=None, ratio=1.):
+def gy(lons, lats, heights, tesseroids, dens=None, ratio=1., tol=None,
+    order=2, maxorder=None, maxdepth=15, shells=False, report=False):
     """
     Calculate the y (East) component of the gravitational attraction due to a
     tesseroid model.
     """
-    return SI2MGAL*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gy, ratio, dens)
+    if tol is not None:
+        ratio = _tol2ratio('gy', tol)
+    counters = _new_counters()
+    result = SI2MGAL*_optimal_discretize(tesseroids, lons, lats, heights,
+        _kernels.gy, ratio, dens, order, maxorder, _codes['gy'], maxdepth,
+        counters, shells)
+    return _output(result, counters, report)
 
-def gz(lons, lats, heights, tesseroids, dens=None, ratio=1.):
+def gz(lons, lats, heights, tesseroids, dens=None, ratio=1., tol=None,
+    order=2, maxorder=None, maxdepth=15, shells=False, report=False):
     """
     Calculate the z (radial) component of the gravitational attraction due to a
     tesseroid model.
     """
+    if tol is not None:
+        ratio = _tol2ratio('gz', tol)
     # Multiply by -1 so that z is pointing down for gz and the gravity anomaly
     # doesn't look inverted (ie, negative for positive density)
-    return -1*SI2MGAL*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gz, ratio, dens)
+    counters = _new_counters()
+    result = -1*SI2MGAL*_optimal_discretize(tesseroids, lons, lats, heights,
+        _kernels.gz, ratio, dens, order, maxorder, _codes['gz'], maxdepth,
+        counters, shells)
+    return _output(result, counters, report)
 
-def gxx(lons, lats, heights, tesseroids, dens=None, ratio=3):
+def gxx(lons, lats, heights, tesseroids, dens=None, ratio=3, tol=None,
+    order=2, maxorder=None, maxdepth=15, shells=False, report=False):
     """
     Calculate the xx (North-North) component of the gravity gradient tensor
     due to a tesseroid model.
     """
-    return SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gxx, ratio, dens)
+    if tol is not None:
+        ratio = _tol2ratio('gxx', tol)
+    counters = _new_counters()
+    result = SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
+        _kernels.gxx, ratio, dens, order, maxorder, _codes['gxx'], maxdepth,
+        counters, shells)
+    return _output(result, counters, report)
 
-def gxy(lons, lats, heights, tesseroids, dens=None, ratio=3):
+def gxy(lons, lats, heights, tesseroids, dens=None, ratio=3, tol=None,
+    order=2, maxorder=None, maxdepth=15, shells=False, report=False):
     """
     Calculate the xy (North-East) component of the gravity gradient tensor
     due to a tesseroid model.
     """
-    return SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gxy, ratio, dens)
+    if tol is not None:
+        ratio = _tol2ratio('gxy', tol)
+    counters = _new_counters()
+    result = SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
+        _kernels.gxy, ratio, dens, order, maxorder, _codes['gxy'], maxdepth,
+        counters, shells)
+    return _output(result, counters, report)
 
-def gxz(lons, lats, heights, tesseroids, dens=None, ratio=3):
+def gxz(lons, lats, heights, tesseroids, dens=None, ratio=3, tol=None,
+    order=2, maxorder=None, maxdepth=15, shells=False, report=False):
     """
     Calculate the xz (North-radial) component of the gravity gradient tensor
     due to a tesseroid model.
     """
-    return SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gxz, ratio, dens)
+    if tol is not None:
+        ratio = _tol2ratio('gxz', tol)
+    counters = _new_counters()
+    result = SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
+        _kernels.gxz, ratio, dens, order, maxorder, _codes['gxz'], maxdepth,
+        counters, shells)
+    return _output(result, counters, report)
 
-def gyy(lons, lats, heights, tesseroids, dens=None, ratio=3):
+def gyy(lons, lats, heights, tesseroids, dens=None, ratio=3, tol=None,
+    order=2, maxorder=None, maxdepth=15, shells=False, report=False):
     """
     Calculate the yy (East-East) component of the gravity gradient tensor
     due to a tesseroid model.
     """
-    return SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gyy, ratio, dens)
+    if tol is not None:
+        ratio = _tol2ratio('gyy', tol)
+    counters = _new_counters()
+    result = SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
+        _kernels.gyy, ratio, dens, order, maxorder, _codes['gyy'], maxdepth,
+        counters, shells)
+    return _output(result, counters, report)
 
-def gyz(lons, lats, heights, tesseroids, dens=None, ratio=3):
+def gyz(lons, lats, heights, tesseroids, dens=None, ratio=3, tol=None,
+    order=2, maxorder=None, maxdepth=15, shells=False, report=False):
     """
     Calculate the yz (East-radial) component of the gravity gradient tensor
     due to a tesseroid model.
     """
-    return SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gyz, ratio, dens)
+    if tol is not None:
+        ratio = _tol2ratio('gyz', tol)
+    counters = _new_counters()
+    result = SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
+        _kernels.gyz, ratio, dens, order, maxorder, _codes['gyz'], maxdepth,
+        counters, shells)
+    return _output(result, counters, report)
 
 
-def gzz(lons, lats, heights, tesseroids, dens=None, ratio=3):
+def gzz(lons, lats, heights, tesseroids, dens=None, ratio=3, tol=None,
+    order=2, maxorder=None, maxdepth=15, shells=False, report=False):
     """
     Calculate the zz (radial-radial) component of the gravity gradient tensor
     due to a tesseroid model.
     """
+    if tol is not None:
+        ratio = _tol2ratio('gzz', tol)
+    counters = _new_counters()
     result = SI2EOTVOS*_optimal_discretize(tesseroids, lons, lats, heights,
-        _kernels.gzz, ratio, dens)
-    return result
+        _kernels.gzz, ratio, dens, order, maxorder, _codes['gzz'], maxdepth,
+        counters, shells)
+    return _output(result, counters, report)
+
+def fields(lons, lats, heights, tesseroids, components, dens=None, ratio=None,
+    tol=None, order=2, maxorder=None, maxdepth=15, shells=False,
+    report=False):
+    """
+    Calculate several components of the gravitational field at once.
+
+    Much faster than calling each function separately because the tesseroids
+    are discretized only once and all components are integrated in the same
+    pass over the GLQ nodes.
+
+    Parameters:
+
+    * lons, lats, heights : 1d arrays
+        The longitudes, latitudes (in degrees) and heights (in meters) of the
+        computation points. Alternatively, pass a
+        :class:`~fatiando.gravmag.tesseroid.SphericalPoints` as *lons* and
+        ``None`` as *lats* and *heights*.
+    * tesseroids : list of :class:`~fatiando.mesher.Tesseroid`
+        The model. Tesseroids without ``'density'`` will be ignored (unless
+        *dens* is given). A :class:`~fatiando.mesher.TesseroidMesh` is read
+        directly from its arrays of bounds, densities and mask (much faster
+        for large meshes).
+    * components : list of str
+        The components to calculate. Valid values are: ``'potential'``,
+        ``'gx'``, ``'gy'``, ``'gz'``, ``'gxx'``, ``'gxy'``, ``'gxz'``,
+        ``'gyy'``, ``'gyz'`` and ``'gzz'``.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the tesseroids.
+    * ratio : float or None
+        The distance-size ratio used to discretize the tesseroids. If None,
+        will use the strictest (largest) default ratio of the *components*
+        (1 for the potential and gravitational attraction, 3 for the gradient
+        tensor).
+    * tol : float or None
+        If not None, the maximum relative error wanted. *ratio* is ignored and
+        the smallest ratio that gives this error is used instead (the largest
+        one among the *components*). The ratio of each component is taken from
+        error curves measured against the analytic solutions for a spherical
+        shell (see :mod:`~fatiando.gravmag.half_sph_shell`) with the default
+        *order*. The same can be done with the single component functions.
+    * order : int or tuple = (lon, lat, radial)
+        The number of Gauss-Legendre Quadrature nodes used to integrate each
+        dimension of the tesseroids. Can be different for each dimension. The
+        same values are used by all other functions of this module.
+    * maxorder : int or None
+        If not None, integrate the computation points that are too close to a
+        tesseroid with a higher GLQ order (up to *maxorder*) instead of
+        splitting the tesseroid, whenever that is cheaper. The order of each
+        dimension is raised until the estimated integration error matches the
+        one of *order* at the distance given by *ratio*. Reduces the number of
+        splits a lot for points close to the model (e.g., near the surface).
+    * maxdepth : int or None
+        The maximum number of times a tesseroid can be split. The points that
+        are still too close to it after that are integrated with a higher GLQ
+        order (up to *maxorder* or 8 if *maxorder* is None). This bounds the
+        memory and time spent on points very close to the model (like points
+        on its surface, which would otherwise make it split indefinitely). If
+        None, there is no limit.
+    * shells : True or False
+        If ``True``, *tesseroids* must be a
+        :class:`~fatiando.mesher.TesseroidMesh` that covers the whole globe.
+        Each layer of the mesh is split into a spherical shell with the most
+        common density of the layer (calculated analytically) plus the
+        density anomalies of its cells. Cells with zero anomaly are skipped.
+        Much faster for layered models where most cells of a layer have the
+        same density (e.g., crustal models). Layers with masked cells are not
+        split.
+    * report : True or False
+        If ``True``, also return a dict with counters of the work done::
+
+            report = {'splits': number_of_tesseroids_split,
+                      'leaves': number_of_kernel_integrations,
+                      'evaluations': number_of_point_tesseroid_integrals,
+                      'max-stack': peak_number_of_tesseroids_to_process,
+                      'max-depth': deepest_split,
+                      'depth-limited': integrals_done_at_maxdepth}
+
+        The same is done by the single component functions (they return the
+        result and the report).
+
+    Returns:
+
+    * results : list of arrays
+        The calculated components in the same order as *components*. Units
+        are the same as in the single component functions (SI for the
+        potential, mGal for gx, gy, gz and Eotvos for the tensor). The report
+        is appended to this list if *report* is ``True``.
 
-def _optimal_discretize(tesseroids, lons, lats, heights, kernel, ratio, dens):
+    """
+    for c in components:
+        if c not in _codes:
+            raise ValueError("Invalid component '%s'" % (str(c)))
+    if tol is not None:
+        ratio = max(_tol2ratio(c, tol) for c in components)
+    elif ratio is None:
+        ratio = max(_ratios[c] for c in components)
+    codes = numpy.array([_codes[c] for c in components], dtype=numpy.int)
+    def kernel(tess, points, index, nodes, weights):
+        return _kernels.fields(tess, points, index, nodes, weights, codes)
+    counters = _new_counters()
+    result = _optimal_discretize(tesseroids, lons, lats, heights, kernel,
+        ratio, dens, order, maxorder, codes, maxdepth, counters, shells)
+    output = [_scales[c]*r for c, r in zip(components, result)]
+    if report:
+        output.append(counters)
+    return output
+
+def global_fields(lons, lats, heights, shape, mesh, components, dens=None,
+    ratio=None, tol=None, order=2, maxorder=None, maxdepth=15, shells=False,
+    report=False):
+    """
+    Calculate several components on a regular grid due to a global mesh.
+
+    Fast alternative to :func:`~fatiando.gravmag.tesseroid.fields` for the
+    common case of a :class:`~fatiando.mesher.TesseroidMesh` that spans all
+    longitudes and computation points on a regular grid at a constant height
+    with the same longitudinal spacing as the mesh. In this case, the effect
+    of a tesseroid depends only on the longitude difference to the
+    computation point. So only the effect of the first tesseroid of each
+    latitude band is calculated (one kernel row per point latitude). The
+    effect of the others follows from a circular convolution in longitude,
+    done with the FFT.
+
+    Parameters:
+
+    * lons, lats, heights : 1d arrays
+        The longitudes, latitudes (in degrees) and heights (in meters) of the
+        computation points. Must be a regular grid with longitude varying
+        first (like the output of :func:`fatiando.gridder.regular`) that
+        covers all longitudes. Can also be a
+        :class:`~fatiando.gravmag.tesseroid.SphericalPoints` (see
+        :func:`~fatiando.gravmag.tesseroid.fields`).
+    * shape : tuple = (nlat, nlon)
+        The shape of the grid. *nlon* must be the same as in the mesh.
+    * mesh : :class:`~fatiando.mesher.TesseroidMesh`
+        The model. Must span 360 degrees in longitude. Masked tesseroids are
+        ignored.
+    * components : list of str
+        The components to calculate. See
+        :func:`~fatiando.gravmag.tesseroid.fields`.
+    * dens : float or None
+        If not None, will use this value instead of the ``'density'`` property
+        of the mesh.
+    * ratio, tol, order, maxorder, maxdepth
+        Control the discretization and integration of the tesseroids. See
+        :func:`~fatiando.gravmag.tesseroid.fields`.
+    * shells : True or False
+        If ``True``, calculate the effect of a reference spherical shell for
+        each layer analytically and only model the density anomalies. The mesh
+        must also span all latitudes. See
+        :func:`~fatiando.gravmag.tesseroid.fields`.
+    * report : True or False
+        If ``True``, also return the counters of the work done on all latitude
+        bands. See :func:`~fatiando.gravmag.tesseroid.fields`.
+
+    Returns:
+
+    * results : list of arrays
+        The calculated components in the same order as *components*. The
+        report is appended to this list if *report* is ``True``.
+
+    """
+    nr, nlat, nlon = mesh.shape
+    w, e, s, n, top, bottom = mesh.bounds
+    dlon, dlat, dr = mesh.dims
+    if abs(e - w - 360.) > 10.**(-8):
+        raise ValueError("Mesh must span 360 degrees in longitude")
+    if shape[1] != nlon:
+        raise ValueError(
+            "Grid must have the same number of longitudes as the mesh")
+    # The effect of every band is calculated on the same points
+    points = _get_points(lons, lats, heights)
+    gridlons = numpy.reshape(points.lons, shape)
+    if (numpy.any(numpy.abs(gridlons - gridlons[0]) > 10.**(-8)) or
+        numpy.any(numpy.abs(numpy.diff(gridlons[0]) - dlon) > 10.**(-8))):
+        raise ValueError(
+            "Grid longitudes must be regular with the same spacing as the mesh")
+    gridlats = numpy.reshape(points.lats, shape)
+    if numpy.abs(gridlats - gridlats[:, :1]).max() > 10.**(-8):
+        raise ValueError("Grid latitudes must be constant along each row")
+    if numpy.any(points.heights != points.heights[0]):
+        raise ValueError("Grid heights must be constant")
+    if shells:
+        codes = numpy.array([_codes[c] for c in components], dtype=numpy.int)
+        shellfields, densities = _reference_shells(mesh, dens, points, codes)
+    elif dens is not None:
+        densities = dens*numpy.ones(mesh.size, dtype=numpy.float)
+    elif 'density' in mesh.props:
+        densities = numpy.array(mesh.props['density'], dtype=numpy.float)
+    else:
+        densities = None
+    if densities is None:
+        # A mesh without density has no effect (like in fields)
+        densities = numpy.zeros(mesh.size, dtype=numpy.float)
+    densities[mesh.get_mask()] = 0
+    densities = densities.reshape(mesh.shape)
+    spectra = numpy.zeros((len(components), shape[0], nlon/2 + 1),
+                          dtype=numpy.complex)
+    counters = _new_counters()
+    for k in xrange(nr):
+        for j in xrange(nlat):
+            band = densities[k, j]
+            if not numpy.any(band):
+                continue
+            # The first tesseroid of the band. Its effect on the grid is
+            # shifted in longitude to get the effect of the others.
+            tess = Tesseroid(w, w + dlon, s + j*dlat, s + (j + 1)*dlat,
+                             top + k*dr, top + (k + 1)*dr)
+            kernels = fields(points, None, None, [tess], components, dens=1.,
+                             ratio=ratio, tol=tol, order=order,
+                             maxorder=maxorder, maxdepth=maxdepth, report=True)
+            _merge_counters(counters, kernels.pop())
+            bandspec = numpy.fft.rfft(band)
+            for c, kernel in enumerate(kernels):
+                spectra[c] += numpy.fft.rfft(
+                    numpy.reshape(kernel, shape), axis=1)*bandspec
+    output = [numpy.fft.irfft(spec, nlon, axis=1).ravel() for spec in spectra]
+    if shells:
+        output = [o + _scales[c]*f
+                  for o, c, f in zip(output, components, shellfields)]
+    if report:
+        output.append(counters)
+    return output
+
+def _optimal_discretize(tesseroids, lons, lats, heights, kernel, ratio, dens,
+    order=2, maxorder=None, codes=None, maxdepth=None, counters=None,
+    shells=False):
     """
     Calculate the effect of a given kernal in the most precise way by adaptively
     discretizing the tesseroids into smaller ones.
+
+    If *maxorder* is not None, the points that are too close to a tesseroid are
+    integrated with a higher GLQ order instead (if that is cheaper than
+    splitting). See _raise_order.
+
+    Tesseroids are split at most *maxdepth* times. The points that are still
+    too close after that are integrated with a higher GLQ order (see
+    _depth_limit). Because the LIFO is processed depth first, it never has more
+    than 7*maxdepth + 1 tesseroids.
+
+    *codes* are the codes of the components calculated by *kernel* (see
+    _codes). If it's a list, *kernel* returns one component per row and so
+    will the result. The cells of a TesseroidMesh that are far from all points
+    are integrated at once with _kernels.cells for these components.
+
+    If *counters* is a dict, the number of splits, leaves, etc are added to it
+    (see _new_counters).
+
+    If *shells* is True, the layers of the mesh are split into reference
+    spherical shells and density anomalies (see _reference_shells).
     """
-    ndata = len(lons)
-    # Convert things to radians
+    order = _get_order(order)
+    if maxorder is not None and maxorder < max(order):
+        raise ValueError("maxorder can't be smaller than the GLQ order")
+    if maxdepth is not None and maxdepth < 0:
+        raise ValueError("maxdepth can't be negative")
+    if counters is None:
+        counters = _new_counters()
+    nodes, weights = _glq(order)
+    points = _get_points(lons, lats, heights)
+    ndata = points.size
     d2r = numpy.pi/180.
-    rlons = d2r*lons
-    rlats = d2r*lats
-    # Transform the heights into radii
-    radii = MEAN_EARTH_RADIUS + heights
+    # Scratch mask used to intersect the query results with the points of
+    # each tesseroid. Always reset to False after use.
+    marked = numpy.zeros(ndata, dtype=numpy.bool)
     # Start the computations
-    result = numpy.zeros(ndata, numpy.float)
-    maxsize = 10000
+    result = numpy.zeros(numpy.shape(codes) + (ndata,), numpy.float)
+    if shells and not isinstance(tesseroids, TesseroidMesh):
+        raise ValueError("Reference shells can only be used with a "
+                         + "TesseroidMesh")
+    if isinstance(tesseroids, TesseroidMesh):
+        if shells:
+            shellfields, dens = _reference_shells(tesseroids, dens, points,
+                numpy.atleast_1d(codes))
+            result += numpy.reshape(shellfields, result.shape)
+        bounds, densities, tesseroids = _split_mesh(tesseroids, dens, points,
+            ratio)
+        if len(densities):
+            w, e, s, n, top, bottom = bounds
+            result += G*numpy.reshape(_kernels.cells(w, e, s, n, top, bottom,
+                densities, points, numpy.arange(ndata), nodes, weights,
+                numpy.atleast_1d(codes)), result.shape)
+            counters['leaves'] += len(densities)
+            counters['evaluations'] += len(densities)*ndata
+        dens = None
+    for tesseroid, density in _get_cells(tesseroids, dens):
+        lifo = [[numpy.arange(ndata), tesseroid, 0]]
+        while lifo:
+            counters['max-stack'] = max(counters['max-stack'], len(lifo))
+            points_to_calc, tess, depth = lifo.pop()
+            counters['max-depth'] = max(counters['max-depth'], depth)
+            sizes = [MEAN_EARTH_RADIUS*d2r*(tess.e - tess.w),
+                     MEAN_EARTH_RADIUS*d2r*(tess.n - tess.s),
+                     tess.top - tess.bottom]
+            size = max(sizes)
+            need_divide = _too_close(tess, ratio*size, points, marked,
+                                     points_to_calc)
+            if len(need_divide):
+                marked[need_divide] = True
+                dont_divide = points_to_calc[~marked[points_to_calc]]
+                marked[need_divide] = False
+                if maxorder is not None:
+                    need_divide = _raise_order(tess, points, need_divide,
+                        sizes, ratio, order, maxorder, kernel, G*density,
+                        result, counters)
+                if len(need_divide) and depth == maxdepth:
+                    _depth_limit(tess, points, need_divide, sizes, ratio,
+                        order, maxorder, kernel, G*density, result, counters)
+                elif len(need_divide):
+                    lifo.extend([need_divide, t, depth + 1]
+                                for t in _split(tess))
+                    counters['splits'] += 1
+            else:
+                dont_divide = points_to_calc
+            if len(dont_divide):
+                result[..., dont_divide] += G*density*kernel(
+                    tess, points, dont_divide, nodes, weights)
+                counters['leaves'] += 1
+                counters['evaluations'] += len(dont_divide)
+    return result
+
+def _tol2ratio(component, tol):
+    """
+    Get the smallest distance-size ratio that gives a relative error of at
+    most *tol* for a component.
+
+    Uses the error curves in _error_curves. Takes the worst error among the
+    larger ratios because the error doesn't always decrease with the ratio.
+    Beyond the largest ratio in the table, the error is extrapolated with a
+    power law.
+    """
+    if tol <= 0:
+        raise ValueError("tol must be positive")
+    errors = numpy.maximum.accumulate(_error_curves[component][::-1])[::-1]
+    ok = numpy.nonzero(errors <= tol)[0]
+    if len(ok):
+        return _error_ratios[ok[0]]
+    slope = (numpy.log(errors[-1]/errors[-2])/
+             numpy.log(_error_ratios[-1]/_error_ratios[-2]))
+    return _error_ratios[-1]*(tol/errors[-1])**(1./slope)
+
+def _new_counters():
+    """
+    Make a dict to count the work done by _optimal_discretize:
+
+    * 'splits': number of tesseroids split in 8
+    * 'leaves': number of times a (split) tesseroid was integrated for a group
+      of points
+    * 'evaluations': number of point-tesseroid integrals (sum of the number of
+      points of all leaves)
+    * 'max-stack': largest number of tesseroids waiting in the LIFO
+    * 'max-depth': largest number of times a tesseroid was split
+    * 'depth-limited': number of point-tesseroid integrals done with a higher
+      GLQ order because *maxdepth* was reached
+    """
+    return {'splits':0, 'leaves':0, 'evaluations':0, 'max-stack':0,
+            'max-depth':0, 'depth-limited':0}
+
+def _merge_counters(counters, other):
+    """
+    Add the counts in *other* to *counters*.
+    """
+    for k in other:
+        if k.startswith('max-'):
+            counters[k] = max(counters[k], other[k])
+        else:
+            counters[k] += other[k]
+
+def _output(result, counters, report):
+    """
+    Append the counters to the output of the public functions if *report*.
+    """
+    if report:
+        return result, counters
+    return result
+
+def _get_order(order):
+    """
+    Get the GLQ order of each dimension (lon, lat, r) as a tuple.
+    """
+    if numpy.isscalar(order):
+        order = (order, order, order)
+    order = tuple(int(o) for o in order)
+    if len(order) != 3 or min(order) < 1:
+        raise ValueError("Invalid GLQ order %s" % (str(order)))
+    return order
+
+def _glq(order):
+    """
+    Get the GLQ nodes and weights of each dimension for a given *order*
+    (lon, lat, r).
+
+    The nodes and weights of an order are only computed the first time they
+    are used.
+    """
+    for o in order:
+        if o not in _glq_cache:
+            _glq_cache[o] = numpy.polynomial.legendre.leggauss(o)
+    nodes = tuple(_glq_cache[o][0] for o in order)
+    weights = tuple(_glq_cache[o][1] for o in order)
+    return nodes, weights
+
+def _glq_convergence(along, across, size):
+    """
+    Estimate how fast the error of the GLQ decreases with the order when
+    integrating a dimension of length *size*. *along* and *across* are the
+    distances from the center of the dimension to the computation point,
+    along and perpendicular to it.
+
+    The error of an order n GLQ decays with rho**(-2n), where rho is the sum of
+    the semi-axes of the largest ellipse (with foci at the integration limits)
+    in which the integrand is analytic. The singularity of the kernels is at
+    the computation point so this is the ellipse passing through it.
+    """
+    z = (numpy.abs(along) + 1j*across)/(0.5*size)
+    rho = numpy.abs(z + numpy.sqrt(z - 1)*numpy.sqrt(z + 1))
+    return numpy.maximum(rho, 1. + 10.**(-10))
+
+def _estimate_order(tesseroid, points, index, sizes, ratio, order, maxorder):
+    """
+    Estimate the GLQ order of each dimension needed to integrate the points in
+    *index* with the same error as the base *order* for a point at ratio*size
+    from the tesseroid.
+
+    Returns a list of int arrays (lon, lat, r) with the order for each point.
+    Orders above *maxorder* are returned as maxorder + 1.
+    """
+    d2r = numpy.pi/180.
+    # Position of the points relative to the center of the tesseroid in a
+    # local (North, East, up) frame
+    lat = 0.5*(tesseroid.s + tesseroid.n)
+    lon = 0.5*(tesseroid.w + tesseroid.e)
+    radius = MEAN_EARTH_RADIUS + 0.5*(tesseroid.top + tesseroid.bottom)
+    dlon = (points.lons[index] - lon + 180.) % 360. - 180.
+    east = radius*d2r*dlon*numpy.cos(d2r*lat)
+    north = radius*d2r*(points.lats[index] - lat)
+    up = points.radii[index] - radius
+    offsets = [east, north, up]
+    target = numpy.log(_glq_convergence(0., ratio, 1.))
+    orders = []
+    # The integral in one dimension is the hardest at the nodes of the other
+    # dimensions that are closest to the point
+    gaps = [numpy.maximum(numpy.abs(offsets[i]) - 0.5*sizes[i], 0)
+            for i in xrange(3)]
+    for i in xrange(3):
+        along = offsets[i]
+        across = numpy.sqrt(sum(gaps[j]**2 for j in xrange(3) if j != i))
+        rho = _glq_convergence(along, across, sizes[i])
+        need = numpy.ceil(order[i]*target/numpy.log(rho) - 10.**(-10))
+        # Use one more node than estimated when raising the order to make up
+        # for the approximations in the error estimate
+        need[need > order[i]] += 1
+        orders.append(numpy.clip(need, order[i], maxorder + 1).astype(int))
+    return orders
+
+def _integrate_orders(tesseroid, points, index, orders, kernel, scale, result,
+    counters):
+    """
+    Integrate the points in *index* using the GLQ orders given for each point
+    (as returned by _estimate_order). The effects are added to *result*.
+    """
+    # Group the points by the order they need to call the kernel only once
+    # for each order
+    maxorder = max(o.max() for o in orders)
+    codes = (orders[0]*(maxorder + 1) + orders[1])*(maxorder + 1) + orders[2]
+    for code in numpy.unique(codes):
+        members = codes == code
+        group = index[members]
+        first = numpy.argmax(members)
+        new = (orders[0][first], orders[1][first], orders[2][first])
+        nodes, weights = _glq(new)
+        result[..., group] += scale*kernel(tesseroid, points, group, nodes,
+                                           weights)
+        counters['leaves'] += 1
+        counters['evaluations'] += len(group)
+
+def _raise_order(tesseroid, points, index, sizes, ratio, order, maxorder,
+    kernel, scale, result, counters):
+    """
+    Integrate the points in *index* that are too close to the tesseroid with a
+    higher GLQ order instead of splitting the tesseroid.
+
+    The order of each dimension is raised until the estimated error is the
+    same as with the base *order* for a point at ratio*size from the
+    tesseroid. Only done if the order doesn't exceed *maxorder* and the number
+    of nodes is smaller than the number needed to split the tesseroid down to
+    the required size (at least 8 new tesseroids per level). The effects are
+    added to *result*.
+
+    Returns the points that still need the tesseroid to be split.
+    """
+    orders = _estimate_order(tesseroid, points, index, sizes, ratio, order,
+        maxorder)
+    distances = _distance(tesseroid, points, index)
+    levels = numpy.ceil(numpy.log2(ratio*max(sizes)/distances))
+    split_cost = 8*numpy.prod(order)*levels
+    cost = orders[0]*orders[1]*orders[2]
+    raise_ = (numpy.max(orders, axis=0) <= maxorder) & (cost < split_cost)
+    if numpy.any(raise_):
+        _integrate_orders(tesseroid, points, index[raise_],
+            [o[raise_] for o in orders], kernel, scale, result, counters)
+    return index[~raise_]
+
+def _depth_limit(tesseroid, points, index, sizes, ratio, order, maxorder,
+    kernel, scale, result, counters):
+    """
+    Integrate the points in *index* that are still too close to a tesseroid
+    that can't be split anymore.
+
+    Uses the GLQ order estimated for each point (see _estimate_order) up to
+    *maxorder* (or _depth_limit_order if *maxorder* is None). The effects are
+    added to *result*.
+    """
+    if maxorder is None:
+        maxorder = max(_depth_limit_order, max(order))
+    orders = [numpy.minimum(o, maxorder) for o in _estimate_order(tesseroid,
+              points, index, sizes, ratio, order, maxorder)]
+    _integrate_orders(tesseroid, points, index, orders, kernel, scale, result,
+        counters)
+    counters['depth-limited'] += len(index)
+
+def _split_mesh(mesh, dens, points, ratio):
+    """
+    Separate the cells of a TesseroidMesh that are far from all computation
+    points from the ones that need to be discretized.
+
+    Reads the arrays of bounds, densities and mask of the mesh directly.
+    Masked and zero density cells are skipped. *dens* can be a float or an
+    array with the density of each cell (instead of the ones in the mesh).
+
+    Returns the bounds and densities of the far cells and a list of the close
+    ones (with their density).
+    """
+    if dens is None and 'density' not in mesh.props:
+        return [], [], []
+    if dens is not None:
+        densities = dens*numpy.ones(mesh.size, dtype=numpy.float)
+    else:
+        densities = numpy.asarray(mesh.props['density'], dtype=numpy.float)
+    use = (densities != 0) & ~mesh.get_mask()
+    if not numpy.any(use):
+        return [], [], []
+    bounds = [b[use] for b in mesh.get_cell_bounds()]
+    densities = densities[use]
+    w, e, s, n, top, bottom = bounds
+    d2r = numpy.pi/180.
+    sizes = numpy.max([MEAN_EARTH_RADIUS*d2r*(e - w),
+                       MEAN_EARTH_RADIUS*d2r*(n - s),
+                       top - bottom], axis=0)
+    # Same criterion as _too_close but using the distance to the closest
+    # point. The close cells go through the normal adaptive discretization.
+    center = numpy.transpose(utils.sph2cart(0.5*(w + e), 0.5*(s + n), top))
+    distance = points.tree.query(center)[0]
+    near = distance < ratio*sizes*(1. + 10.**(-6))
+    close = [Tesseroid(w[i], e[i], s[i], n[i], top[i], bottom[i],
+                       {'density':densities[i]})
+             for i in numpy.nonzero(near)[0]]
+    far = ~near
+    return [b[far] for b in bounds], densities[far], close
+
+def _reference_shells(mesh, dens, points, codes):
+    """
+    Split the layers of a global TesseroidMesh into spherical shells and
+    density anomalies.
+
+    The density of the shell of each layer is the most common density of its
+    cells so that most anomalies are zero. Layers with masked cells are left
+    as they are (the shell would fill the masked cells).
+
+    Returns the field of the shells (one row per code in *codes*, in SI) and
+    the anomalous density of each cell of the mesh (None if the mesh has no
+    density).
+    """
+    w, e, s, n, top, bottom = mesh.bounds
+    if (abs(e - w - 360.) > 10.**(-8) or abs(s + 90.) > 10.**(-8) or
+        abs(n - 90.) > 10.**(-8)):
+        raise ValueError("Mesh must cover the whole globe to use shells")
+    result = numpy.zeros((len(codes), points.size), dtype=numpy.float)
+    if dens is None and 'density' not in mesh.props:
+        return result, None
+    if dens is not None:
+        densities = dens*numpy.ones(mesh.size, dtype=numpy.float)
+    else:
+        densities = numpy.array(mesh.props['density'], dtype=numpy.float)
+    nr = mesh.shape[0]
+    dr = mesh.dims[2]
+    densities = densities.reshape((nr, -1))
+    mask = mesh.get_mask().reshape((nr, -1))
+    for k in xrange(nr):
+        if numpy.any(mask[k]):
+            continue
+        values, counts = numpy.unique(densities[k], return_counts=True)
+        reference = values[numpy.argmax(counts)]
+        if reference == 0:
+            continue
+        densities[k] -= reference
+        result += _shell(top + k*dr, top + (k + 1)*dr, reference,
+                         points.radii, codes)
+    return result, densities.ravel()
+
+def _shell(top, bottom, density, radii, codes):
+    """
+    Calculate the field of a spherical shell in SI units (no scaling or sign
+    change).
+
+    Works for points above, inside and below the shell. Only the potential,
+    gz, gxx, gyy and gzz are not zero.
+
+    Returns one row per code in *codes*.
+    """
+    r1, r2 = MEAN_EARTH_RADIUS + bottom, MEAN_EARTH_RADIUS + top
+    # Split the shell at the radius of each point. Only the mass below the
+    # point produces a gravitational attraction.
+    inner = numpy.clip(radii, r1, r2)
+    mass = 4.*numpy.pi*density*(inner**3 - r1**3)/3.
+    values = {}
+    values[0] = G*mass/radii + 2.*numpy.pi*G*density*(r2**2 - inner**2)
+    values[3] = -G*mass/radii**2
+    values[4] = values[7] = values[3]/radii
+    inside = (radii > r1) & (radii < r2)
+    values[9] = 2.*G*mass/radii**3 - 4.*numpy.pi*G*density*inside
+    zeros = numpy.zeros_like(radii)
+    return numpy.array([values.get(c, zeros) for c in codes])
+
+def _get_cells(tesseroids, dens):
+    """
+    Iterate over the tesseroids that have a density. Yields (tesseroid,
+    density) pairs.
+    """
     for tesseroid in tesseroids:
         if (tesseroid is None or
             ('density' not in tesseroid.props and dens is None)):
@@ -123,28 +881,38 @@ def _optimal_discretize(tesseroids, lons, lats, heights, kernel, ratio, dens):
             density = dens
         else:
             density = tesseroid.props['density']
-        lifo = [[numpy.arange(ndata), tesseroid]]
-        while lifo:
-            points_to_calc, tess = lifo.pop()
-            size = max([MEAN_EARTH_RADIUS*d2r*(tess.e - tess.w),
-                        MEAN_EARTH_RADIUS*d2r*(tess.n - tess.s),
-                        tess.top - tess.bottom])
-            distances = _distance(tess, rlons, rlats, radii, points_to_calc)
-            too_close = (distances > 0) & (distances < ratio*size)
-            need_divide = points_to_calc[too_close]
-            dont_divide = points_to_calc[~too_close]
-            if len(need_divide):
-                #if len(lifo) + 8 > maxsize:
-                #    log.warning("Maximum LIFO size reached")
-                #    dont_divide.extend(need_divide)
-                #else:
-                #    lifo.extend([need_divide, t] for t in _split(tess))
-                lifo.extend([need_divide, t] for t in _split(tess))
-            if len(dont_divide):
-                result[dont_divide] += G*density*kernel(
-                    tess, rlons[dont_divide], rlats[dont_divide],
-                    radii[dont_divide], _glq_nodes, _glq_weights)
-    return result
+        yield tesseroid, density
+
+def _get_points(lons, lats, heights):
+    """
+    Make a SphericalPoints out of the computation points if they aren't one
+    already.
+    """
+    if isinstance(lons, SphericalPoints):
+        return lons
+    return SphericalPoints(lons, lats, heights)
+
+def _too_close(tesseroid, distance, points, marked, index):
+    """
+    Find which of the computation points in *index* are closer than *distance*
+    to the tesseroid (but not on top of it).
+
+    Uses a range query on the KD-tree of the *points* to get the candidates.
+    The exact distance is only calculated for the candidates that are in
+    *index*.
+    """
+    center = utils.sph2cart(0.5*(tesseroid.w + tesseroid.e),
+                            0.5*(tesseroid.s + tesseroid.n), tesseroid.top)
+    # Pad the query a bit so that rounding doesn't leave out points right at
+    # the edge. The exact test below takes care of the extra ones.
+    close = points.tree.query_ball_point(center, distance*(1. + 10.**(-6)))
+    if not close:
+        return index[:0]
+    marked[close] = True
+    candidates = index[marked[index]]
+    marked[close] = False
+    distances = _distance(tesseroid, points, candidates)
+    return candidates[(distances > 0) & (distances < distance)]
 
 def _split(tesseroid):
     dlon = 0.5*(tesseroid.e - tesseroid.w)
@@ -158,18 +926,20 @@ def _split(tesseroid):
         for i in wests for j in souths for k in bottoms]
     return split
 
-def _distance(tesseroid, lon, lat, radius, points):
-    lons = lon[points]
-    lats = lat[points]
-    radii = radius[points]
+def _distance(tesseroid, points, index):
+    """
+    Calculate the distance between the computation points in *index* and the
+    center of the top of the tesseroid.
+    """
     d2r = numpy.pi/180.
     tes_radius = tesseroid.top + MEAN_EARTH_RADIUS
     tes_lat = d2r*0.5*(tesseroid.s + tesseroid.n)
     tes_lon = d2r*0.5*(tesseroid.w + tesseroid.e)
-    distance = numpy.sqrt(
-        radii**2 + tes_radius**2 - 2.*radii*tes_radius*(
-            numpy.sin(lats)*numpy.sin(tes_lat) +
-            numpy.cos(lats)*numpy.cos(tes_lat)*
-            numpy.cos(lons - tes_lon)
-        ))
+    radii = points.radii[index]
+    cospsi = (points.sinlat[index]*numpy.sin(tes_lat) +
+              points.coslat[index]*numpy.cos(tes_lat)*(
+                points.coslon[index]*numpy.cos(tes_lon) +
+                points.sinlon[index]*numpy.sin(tes_lon)))
+    distance = numpy.sqrt(points.radii_sqr[index] + tes_radius**2 -
+                          2.*radii*tes_radius*cospsi)
     return distance
@@ -891,7 +891,8 @@ class PrismMesh(object):
         Physical properties of each prism in the mesh.
         Each key should be the name of a physical property. The corresponding
         value should be a list with the values of that particular property on
-        each prism of the mesh.
+        each prism of the mesh (see
+        :meth:`~fatiando.mesher.PrismMesh.addprop`).
 
     Examples:
 
@@ -944,10 +945,10 @@ class PrismMesh(object):
         self.size = size
         self.dims = (dx, dy, dz)
         self.bounds = bounds
-        if props is None:
-            self.props = {}
-        else:
-            self.props = props
+        self.props = {}
+        if props is not None:
+            for p in props:
+                self.addprop(p, props[p])
         # The index of the current prism in an iteration. Needed when mesh is
         # used as an iterator
         self.i = 0
@@ -1002,11 +1003,17 @@ class PrismMesh(object):
         * prop : str
             Name of the physical property.
         * values :  list or array
-            Value of this physical property in each prism of the mesh. For the
-            ordering of prisms in the mesh see
-            :class:`~fatiando.mesher.PrismMesh`
+            Value of this physical property in each cell of the mesh.
+            Will be stored as an array. The first dimension must be the number
+            of cells (use a 2D array for vector properties, e.g.,
+            magnetization vectors). For the ordering of cells in the mesh
+            see :class:`~fatiando.mesher.PrismMesh`
 
         """
+        values = numpy.asarray(values)
+        if values.shape[:1] != (self.size,):
+            raise ValueError("Need one '%s' value per cell of the %s"
+                             % (prop, self.__class__.__name__))
         self.props[prop] = values
 
     def carvetopo(self, x, y, height):
@@ -1098,6 +1105,20 @@ class PrismMesh(object):
             return zs[:-1]
         return zs
 
+    def get_mask(self):
+        """
+        Get the mask of the mesh as a boolean array.
+
+        Returns:
+
+        * mask : array
+            True for the masked cells (see the ``mask`` attribute).
+
+        """
+        mask = numpy.zeros(self.size, dtype=numpy.bool)
+        mask[numpy.array(self.mask, dtype=numpy.int)] = True
+        return mask
+
     def get_layer(self, i):
         """
         Return the set of prisms corresponding to the ith layer of the mesh.
@@ -1204,7 +1225,7 @@ class PrismMesh(object):
             "%d*%g" % (nz, dz)])
         if isstr:
             meshfile.close()
-        values = numpy.fromiter(self.props[prop], dtype='f')
+        values = numpy.array(self.props[prop], dtype='f')
         # Replace the masked cells with a dummy value
         values[self.mask] = -10000000
         reordered = numpy.ravel(numpy.reshape(values, self.shape), order='F')
@@ -1243,7 +1264,34 @@ class TesseroidMesh(PrismMesh):
         Physical properties of each tesseroid in the mesh.
         Each key should be the name of a physical property. The corresponding
         value should be a list with the values of that particular property on
-        each tesseroid of the mesh.
+        each tesseroid of the mesh. Stored as arrays.
+
+    The bounds of all tesseroids and the mask can also be accessed as arrays
+    (see :meth:`~fatiando.mesher.TesseroidMesh.get_cell_bounds` and
+    :meth:`~fatiando.mesher.TesseroidMesh.get_mask`). This is much faster than
+    iterating over the mesh for large meshes and is used by
+    :mod:`fatiando.gravmag.tesseroid`.
+
+    Examples:
+
+        >>> mesh = TesseroidMesh((0, 2, -1, 1, 0, -10), (1, 2, 2),
+        ...     props={'density':[1, 2, 3, 4]})
+        >>> for t in mesh:
+        ...     print t
+        w:0 | e:1 | s:-1 | n:0 | top:0 | bottom:-10 | density:1
+        w:1 | e:2 | s:-1 | n:0 | top:0 | bottom:-10 | density:2
+        w:0 | e:1 | s:0 | n:1 | top:0 | bottom:-10 | density:3
+        w:1 | e:2 | s:0 | n:1 | top:0 | bottom:-10 | density:4
+        >>> print mesh.props['density']
+        [1 2 3 4]
+        >>> w, e, s, n, top, bottom = mesh.get_cell_bounds()
+        >>> print w, e
+        [ 0.  1.  0.  1.] [ 1.  2.  1.  2.]
+        >>> print s, n
+        [-1. -1.  0.  0.] [ 0.  0.  1.  1.]
+        >>> mesh.mask.append(2)
+        >>> print mesh.get_mask()
+        [False False  True False]
 
     """
 
@@ -1254,6 +1302,27 @@ class TesseroidMesh(PrismMesh):
         self.zdown = False
         self.dump = None
 
+    def get_cell_bounds(self):
+        """
+        Get the borders of all tesseroids in the mesh as arrays.
+
+        Same values and ordering as when iterating over the mesh but without
+        creating the tesseroids.
+
+        Returns:
+
+        * bounds : list of arrays
+            ``[w, e, s, n, top, bottom]``. Each array has one value per
+            tesseroid, including the masked ones.
+
+        """
+        k, j, i = numpy.indices(self.shape)
+        dlon, dlat, dr = self.dims
+        w = self.bounds[0] + dlon*i.ravel()
+        s = self.bounds[2] + dlat*j.ravel()
+        top = self.bounds[4] + dr*k.ravel()
+        return [w, w + dlon, s, s + dlat, top, top + dr]
+
 def extract(prop, prisms):
     """
     Extract the values of a physical property from the cells in a list.
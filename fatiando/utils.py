@@ -39,6 +39,8 @@ Miscellaneous utility functions and classes.
   list of arrays
 * :class:`~fatiando.utils.SparseList`: Store only non-zero elements on an
   immutable list
+* :func:`~fatiando.utils.subset`: Copy a data container keeping only some of
+  the data points
 * :func:`~fatiando.utils.sec2hms`: Convert seconds to hours, minutes, and
   seconds
 * :func:`~fatiando.utils.sec2year`: Convert seconds to Julian years
@@ -48,6 +50,7 @@ Miscellaneous utility functions and classes.
 
 """
 import math
+import copy
 
 import numpy
 
@@ -352,6 +355,16 @@ class SparseList(object):
 
     Can iterate over and access elements just like if it were a list.
 
+    The elements are kept in two arrays: the sorted indexes of the elements
+    and their values. Accessing an element is a binary search. Use
+    ``numpy.asarray`` to get all elements in an array at once (much faster
+    than iterating). Setting an element that is not stored yet copies the
+    arrays, so pass all elements to the constructor when possible.
+
+    The values are stored as floats. The ``elements`` attribute is a copy of
+    the elements in a dictionary, so change the list through indexing (or
+    assign a new dictionary to ``elements``).
+
     Parameters:
 
     * size : int
@@ -359,6 +372,9 @@ class SparseList(object):
     * elements : dict
         Dictionary used to initialize the list. Keys are the index of the
         elements and values are their respective values.
+    * indexes, values : lists or arrays
+        Used to initialize the list instead of *elements*. The indexes of the
+        elements and their respective values.
 
     Example::
 
@@ -376,16 +392,54 @@ class SparseList(object):
         >>> for i in l2:
         ...     print i,
         0.0 3.2 0.0 2.8
+        >>> l3 = SparseList(4, indexes=[3, 0], values=[2.8, 3.2])
+        >>> print numpy.asarray(l3)
+        [ 3.2  0.   0.   2.8]
+        >>> l3.elements = {1:5.0}
+        >>> print numpy.asarray(l3)
+        [ 0.  5.  0.  0.]
 
     """
 
-    def __init__(self, size, elements=None):
+    def __init__(self, size, elements=None, indexes=None, values=None):
         self.size = size
         self.i = 0
-        if elements is None:
-            self.elements = {}
-        else:
-            self.elements = elements
+        if elements is not None:
+            indexes, values = elements.keys(), elements.values()
+        if indexes is None:
+            indexes, values = [], []
+        self._store(indexes, values)
+
+    def _store(self, indexes, values):
+        """
+        Sort the indexes and values and keep them in the arrays.
+        """
+        indexes = numpy.asarray(indexes, dtype=numpy.int)
+        values = numpy.asarray(values, dtype=numpy.float)
+        if len(indexes) != len(values):
+            raise ValueError("Need one value per index")
+        if len(indexes) and (indexes.min() < 0 or indexes.max() >= self.size):
+            raise IndexError('index out of range')
+        order = numpy.argsort(indexes, kind='mergesort')
+        indexes, values = indexes[order], values[order]
+        # Repeated indexes keep the last value given, like a dict would
+        last = numpy.append(indexes[1:] != indexes[:-1], True)[:len(indexes)]
+        self.indexes = indexes[last]
+        self.values = values[last]
+
+    @property
+    def elements(self):
+        """
+        Dictionary with the index of the elements (keys) and their values.
+
+        This is a copy of the stored elements. Changing it doesn't change the
+        list. Assign a new dictionary to replace all elements.
+        """
+        return dict(zip(self.indexes.tolist(), self.values.tolist()))
+
+    @elements.setter
+    def elements(self, elements):
+        self._store(elements.keys(), elements.values())
 
     def __str__(self):
         return str(self.elements)
@@ -393,21 +447,42 @@ class SparseList(object):
     def __len__(self):
         return self.size
 
+    def __array__(self, dtype=None):
+        array = numpy.zeros(self.size, dtype=numpy.float)
+        array[self.indexes] = self.values
+        if dtype is not None:
+            array = array.astype(dtype)
+        return array
+
     def __iter__(self):
         self.i = 0
         return self
 
+    def _find(self, index):
+        """
+        Position of index in the indexes array (or where it would be).
+        """
+        return numpy.searchsorted(self.indexes, index)
+
     def __getitem__(self, index):
         if index < 0:
             index = self.size + index
         if index >= self.size or index < 0:
             raise IndexError('index out of range')
-        return self.elements.get(index, 0.)
+        k = self._find(index)
+        if k < len(self.indexes) and self.indexes[k] == index:
+            return float(self.values[k])
+        return 0.
 
     def __setitem__(self, key, value):
         if key >= self.size:
             raise IndexError('index out of range')
-        self.elements[key] = value
+        k = self._find(key)
+        if k < len(self.indexes) and self.indexes[k] == key:
+            self.values[k] = value
+        else:
+            self.indexes = numpy.insert(self.indexes, k, key)
+            self.values = numpy.insert(self.values, k, value)
 
     def next(self):
         if self.i == self.size:
@@ -416,6 +491,48 @@ class SparseList(object):
         self.i += 1
         return res
 
+def subset(data, indexes, attributes):
+    """
+    Make a copy of a data container with only the data points in *indexes*.
+
+    Parameters:
+
+    * data : object
+        The data container (e.g., :class:`fatiando.gravmag.eqlayer.Gz`).
+    * indexes : array, list or slice
+        The data points to keep.
+    * attributes : list of str
+        The names of the attributes of *data* that have one value per data
+        point. Attributes that are not arrays (e.g., a single weight for all
+        points) are left as they are.
+
+    Returns:
+
+    * subset : object
+        A shallow copy of *data* with new arrays for the *attributes* and the
+        ``size`` attribute updated.
+
+    Example::
+
+        >>> class Data(object):
+        ...     pass
+        >>> data = Data()
+        >>> data.x = numpy.array([1., 2., 3., 4.])
+        >>> data.weights = 1.
+        >>> data.size = 4
+        >>> sub = subset(data, [0, 2], ['x', 'weights'])
+        >>> print sub.x, sub.weights, sub.size
+        [ 1.  3.] 1.0 2
+
+    """
+    sub = copy.copy(data)
+    for name in attributes:
+        value = getattr(data, name)
+        if numpy.ndim(value) > 0:
+            setattr(sub, name, numpy.array(value[indexes]))
+    sub.size = len(getattr(sub, attributes[0]))
+    return sub
+
 def sec2hms(seconds):
     """
     Convert seconds into a string with hours, minutes and seconds.
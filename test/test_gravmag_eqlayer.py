@@ -0,0 +1,205 @@
+import numpy as np
+
+from fatiando.mesher import PointGrid
+from fatiando import gravmag, gridder, utils
+
+grid = None
+xp, yp, zp = None, None, None
+inc, dec = None, None
+
+def setup():
+    global grid, xp, yp, zp, inc, dec
+    inc, dec = -30, 50
+    grid = PointGrid([-1000, 1000, -1000, 1000], 200, (12, 15))
+    xp, yp, zp = gridder.regular([-1500, 1500, -1500, 1500], (20, 25), z=-10)
+
+def _columns(func):
+    "Make the sensitivity matrix one source at a time"
+    return np.transpose([func(s) for s in grid])
+
+def test_gz_sensitivity():
+    "gravmag.eqlayer.Gz.sensitivity against gravmag.sphere.gz"
+    data = gravmag.eqlayer.Gz(xp, yp, zp, np.zeros_like(xp))
+    true = _columns(lambda s: gravmag.sphere.gz(xp, yp, zp, [s], dens=1.))
+    sens = data.sensitivity(grid)
+    assert sens.shape == (len(xp), grid.size)
+    assert np.allclose(sens, true, rtol=10**(-10), atol=0)
+
+def test_tf_sensitivity():
+    "gravmag.eqlayer.TotalField.sensitivity against gravmag.sphere.tf"
+    data = gravmag.eqlayer.TotalField(xp, yp, zp, np.zeros_like(xp), inc, dec,
+                                      25, -10)
+    mag = utils.dircos(25, -10)
+    true = _columns(lambda s: gravmag.sphere.tf(xp, yp, zp, [s], inc, dec,
+                                                pmag=mag))
+    sens = data.sensitivity(grid)
+    assert np.allclose(sens, true, rtol=10**(-10), atol=10**(-10))
+
+def test_sensitivity_blocks():
+    "gravmag.eqlayer.Data.sensitivity is the same with threads and float32"
+    data = gravmag.eqlayer.TotalField(xp, yp, zp, np.zeros_like(xp), inc, dec)
+    true = data.sensitivity(grid)
+    blocksize = gravmag.eqlayer.BLOCKSIZE
+    try:
+        # Make sure there are many blocks
+        gravmag.eqlayer.BLOCKSIZE = 5*grid.size
+        threaded = data.sensitivity(grid, njobs=3)
+        single = data.sensitivity(grid, dtype=np.float32)
+    finally:
+        gravmag.eqlayer.BLOCKSIZE = blocksize
+    assert np.all(threaded == true)
+    assert single.dtype == np.float32
+    assert np.allclose(single, true, rtol=10**(-6), atol=0)
+
+def test_transformer():
+    "gravmag.eqlayer.Transformer against gravmag.sphere"
+    eqlayer = gravmag.eqlayer
+    estimate = np.linspace(-10, 10, grid.size)
+    transform = eqlayer.Transformer(grid, estimate)
+    target = eqlayer.Gz(xp, yp, zp - 100, np.zeros_like(xp))
+    true = sum(gravmag.sphere.gz(xp, yp, zp - 100, [s], dens=e)
+               for s, e in zip(grid, estimate))
+    assert np.allclose(transform(target), true, rtol=10**(-10), atol=0)
+    mag = utils.dircos(inc, dec)
+    target = eqlayer.TotalField(xp, yp, zp, np.zeros_like(xp), -90, 0, inc,
+                                dec)
+    true = sum(e*gravmag.sphere.tf(xp, yp, zp, [s], -90, 0, pmag=mag)
+               for s, e in zip(grid, estimate))
+    assert np.allclose(transform(target), true, rtol=10**(-10), atol=10**(-10))
+    blocksize = eqlayer.BLOCKSIZE
+    try:
+        # Make sure there are many blocks
+        eqlayer.BLOCKSIZE = 5*grid.size
+        out = np.empty_like(xp)
+        threaded = eqlayer.Transformer(grid, estimate, njobs=3)(target, out)
+    finally:
+        eqlayer.BLOCKSIZE = blocksize
+    assert threaded is out
+    assert np.allclose(threaded, transform(target), rtol=10**(-12), atol=0)
+
+def test_pel_matrices():
+    "gravmag.eqlayer._pel_matrices against the dense GB matrix"
+    eqlayer = gravmag.eqlayer
+    data = [eqlayer.Gz(xp, yp, zp, np.cos(xp)),
+            eqlayer.TotalField(xp, yp, zp, np.sin(yp), inc, dec)]
+    grids = grid.split((3, 3))
+    gb = np.hstack([np.dot(np.vstack([d.sensitivity(g) for d in data]),
+                           eqlayer._bkmatrix(g, 1))
+                    for g in grids])
+    values = np.hstack([d.data for d in data])
+    model, smooth, right = eqlayer._pel_matrices(data, (3, 3), grid, grids, 1)
+    assert np.allclose(model, np.dot(gb.T, gb), rtol=10**(-10), atol=0)
+    assert np.allclose(right, np.dot(gb.T, values), rtol=10**(-10), atol=0)
+    blocksize = eqlayer.BLOCKSIZE
+    try:
+        # Make sure there are many blocks of data
+        eqlayer.BLOCKSIZE = 10
+        threaded = eqlayer._pel_matrices(data, (3, 3), grid, grids, 1,
+                                         njobs=3)
+    finally:
+        eqlayer.BLOCKSIZE = blocksize
+    for matrix, true in zip(threaded, [model, smooth, right]):
+        assert np.allclose(matrix, true, rtol=10**(-10), atol=0)
+
+def test_fftclassic():
+    "gravmag.eqlayer.fftclassic against gravmag.eqlayer.classic"
+    area = [-1000, 1000, -1500, 1500]
+    layer = PointGrid(area, 200, (16, 11))
+    x, y, z = gridder.regular(area, layer.shape, z=-10)
+    mag = utils.dircos(25, -10)
+    sources = [s for s in PointGrid([-300, 300, -300, 300], 400, (3, 3))]
+    for s in sources:
+        s.props['magnetization'] = mag
+    tf = gravmag.sphere.tf(x, y, z, sources, inc, dec)
+    data = [gravmag.eqlayer.TotalField(x, y, z, tf, inc, dec, 25, -10)]
+    true, truepred = gravmag.eqlayer.classic(data, layer, damping=0.001)
+    estimate, predicted = gravmag.eqlayer.fftclassic(data, layer,
+                                                     damping=0.001)
+    assert len(predicted) == 1
+    assert np.allclose(estimate, true, rtol=0,
+                       atol=10**(-4)*np.abs(true).max())
+    assert np.allclose(predicted[0], truepred[0], rtol=0,
+                       atol=10**(-4)*np.abs(tf).max())
+
+def _scattered_gz():
+    "Make scattered gz data of a few point masses"
+    area = [-1000, 1000, -1500, 1500]
+    x, y, z = gridder.scatter(area, 400, z=-10, seed=0)
+    sources = [s for s in PointGrid([-600, 600, -600, 600], 400, (2, 2))]
+    for s in sources:
+        s.props['density'] = 10.**10
+    gz = gravmag.sphere.gz(x, y, z, sources)
+    return area, [gravmag.eqlayer.Gz(x, y, z, gz)]
+
+def test_windowed_single():
+    "gravmag.eqlayer.windowed with a single window is the classic layer"
+    area, data = _scattered_gz()
+    layer = PointGrid(area, 200, (12, 8))
+    true, truepred = gravmag.eqlayer.classic(data, layer, damping=0.001)
+    estimate, predicted = gravmag.eqlayer.windowed(data, layer, (1, 1),
+                                                   damping=0.001)
+    assert np.allclose(estimate, true, rtol=10**(-10), atol=0)
+    assert np.allclose(predicted[0], truepred[0], rtol=10**(-10), atol=0)
+
+def test_windowed():
+    "gravmag.eqlayer.windowed fits the data and is the same in parallel"
+    area, data = _scattered_gz()
+    layer = PointGrid(area, 250, (24, 16))
+    targets = [gravmag.eqlayer.Gz(data[0].x, data[0].y, data[0].z,
+                                  np.zeros(data[0].size))]
+    estimate, predicted, transformed = gravmag.eqlayer.windowed(data, layer,
+        (3, 2), overlap=0.5, damping=0.001, targets=targets)
+    residuals = data[0].data - predicted[0]
+    assert np.abs(residuals).max() <= 0.01*np.abs(data[0].data).max()
+    assert np.allclose(transformed[0], predicted[0], rtol=10**(-10), atol=0)
+    parallel = gravmag.eqlayer.windowed(data, layer, (3, 2), overlap=0.5,
+                                        damping=0.001, njobs=2)
+    assert np.allclose(parallel[0], estimate, rtol=10**(-10), atol=0)
+    try:
+        gravmag.eqlayer.windowed(data, layer, (5, 2))
+    except ValueError:
+        pass
+    else:
+        assert False, "Didn't raise ValueError for uneven windows"
+
+def test_classicsweep():
+    "gravmag.eqlayer.classicsweep against gravmag.eqlayer.classic"
+    area, data = _scattered_gz()
+    layer = PointGrid(area, 250, (12, 8))
+    dampings = [10.**(-4), 10.**(-2), 1.]
+    estimates, predicted, stats, decomposition = \
+        gravmag.eqlayer.classicsweep(data, layer, dampings)
+    for i, damping in enumerate(dampings):
+        true, truepred = gravmag.eqlayer.classic(data, layer, damping)
+        assert np.allclose(estimates[i], true, rtol=0,
+                           atol=10**(-4)*np.abs(true).max())
+        assert np.allclose(predicted[i][0], truepred[0], rtol=0,
+                           atol=10**(-4)*np.abs(truepred[0]).max())
+        residuals = np.linalg.norm(data[0].data - predicted[i][0])
+        assert np.allclose(stats['residuals'][i], residuals)
+        assert np.allclose(stats['norm'][i], np.linalg.norm(estimates[i]))
+    # More damping fits the data worse
+    assert np.all(np.diff(stats['residuals']) > 0)
+    again = gravmag.eqlayer.classicsweep(data, layer, dampings[1:],
+                                         decomposition=decomposition)
+    assert np.allclose(again[0][0], estimates[1], rtol=10**(-10), atol=0)
+
+def test_pelsweep():
+    "gravmag.eqlayer.pelsweep against gravmag.eqlayer.pel"
+    area, data = _scattered_gz()
+    layer = PointGrid(area, 250, (12, 8))
+    sensitivity = data[0].sensitivity(layer)
+    for dampings, smoothness in [([10.**(-10), 10.**(-5)], [0.01, 0.1]),
+                                 ([10.**(-10)], [0.001, 0.01, 0.1])]:
+        estimates, stats, matrices = gravmag.eqlayer.pelsweep(data, layer,
+            (3, 2), 1, damping=dampings, smoothness=smoothness)
+        for i, s in enumerate(smoothness):
+            for j, d in enumerate(dampings):
+                true, _ = gravmag.eqlayer.pel(data, layer, (3, 2), 1,
+                    damping=d, smoothness=s, matrices=matrices)
+                assert np.allclose(estimates[i][j], true, rtol=0,
+                                   atol=10**(-6)*np.abs(true).max())
+                residuals = np.linalg.norm(data[0].data
+                                           - np.dot(sensitivity, true))
+                assert np.allclose(stats['residuals'][i, j], residuals,
+                                   rtol=10**(-4))
@@ -0,0 +1,42 @@
+import numpy as np
+
+from fatiando import gravmag
+from fatiando.mesher import Tesseroid, TesseroidMesh
+
+model = None
+lons, lats, heights = None, None, None
+components = ['potential', 'gx', 'gy', 'gz', 'gxx', 'gxy', 'gxz', 'gyy',
+              'gyz', 'gzz']
+
+def setup():
+    "Make a small tesseroid model and points at satellite altitude"
+    global model, lons, lats, heights
+    model = [Tesseroid(-10, 0, -5, 5, 0, -20000, {'density':1000}),
+             Tesseroid(5, 15, 10, 20, 1000, -10000, {'density':-500}),
+             Tesseroid(20, 35, -30, -20, 0, -35000, {'density':300})]
+    lons, lats = np.meshgrid(np.linspace(-30, 50, 12),
+                             np.linspace(-45, 40, 10))
+    lons, lats = lons.ravel(), lats.ravel()
+    heights = 400000*np.ones_like(lons)
+
+def test_against_tesseroid():
+    "gravmag.harmonic.fields against gravmag.tesseroid.fields"
+    coefs = gravmag.harmonic.coefficients(model, 150)
+    results = gravmag.harmonic.fields(lons, lats, heights, coefs, components)
+    tess = gravmag.tesseroid.fields(lons, lats, heights, model, components,
+                                    ratio=3)
+    for comp, res, true in zip(components, results, tess):
+        diff = np.abs(res - true).max()/np.abs(true).max()
+        assert diff <= 0.001, 'component %s diff: %g' % (comp, diff)
+        single = getattr(gravmag.harmonic, comp)(lons, lats, heights, coefs)
+        assert np.allclose(single, res, rtol=10**(-10), atol=0)
+
+def test_mesh():
+    "gravmag.harmonic.coefficients of a TesseroidMesh against a list"
+    mesh = TesseroidMesh((-20, 20, -10, 10, 0, -30000), (2, 4, 8))
+    mesh.addprop('density', np.arange(mesh.size, dtype=np.float) - 20)
+    mesh.mask.extend([3, 15, 40])
+    cells = [t for t in mesh if t is not None]
+    for mc, lc in zip(gravmag.harmonic.coefficients(mesh, 40),
+                      gravmag.harmonic.coefficients(cells, 40)):
+        assert np.allclose(mc, lc, rtol=10**(-10), atol=0)
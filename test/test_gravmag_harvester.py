@@ -0,0 +1,218 @@
+import os
+import tempfile
+import shutil
+from StringIO import StringIO
+
+import numpy as np
+
+from fatiando import gravmag, gridder, utils
+from fatiando.mesher import Prism, PrismMesh
+
+data = None
+mesh = None
+locations = None
+
+def setup():
+    "Make synthetic gz and gzz data of two prisms"
+    global data, mesh, locations
+    model = [Prism(200, 500, 250, 750, 200, 600, {'density':1000}),
+             Prism(600, 850, 300, 700, 100, 500, {'density':-800})]
+    bounds = [0, 1000, 0, 1000, 0, 1000]
+    x, y, z = gridder.regular(bounds[:4], (15, 15), z=-1)
+    gz = utils.contaminate(gravmag.prism.gz(x, y, z, model), 0.1, seed=0)
+    gzz = utils.contaminate(gravmag.prism.gzz(x, y, z, model), 1, seed=1)
+    data = [gravmag.harvester.Gz(x, y, z, gz),
+            gravmag.harvester.Gzz(x, y, z, gzz)]
+    mesh = PrismMesh(bounds, (10, 10, 10))
+    locations = [[350, 500, 400, {'density':1000}],
+                 [725, 500, 300, {'density':-800}]]
+
+def _harvest(**kwargs):
+    seeds = gravmag.harvester.sow(locations, mesh)
+    estimate, predicted = gravmag.harvester.harvest(data, seeds, mesh, 0.5,
+                                                    0.0001, **kwargs)
+    return np.array(estimate['density'], dtype=np.float), predicted
+
+def test_cache():
+    "gravmag.harvester.harvest gives the same result with a bounded cache"
+    estimate, predicted = _harvest()
+    tmpdir = tempfile.mkdtemp()
+    try:
+        size = 30*data[0].size*8
+        cache = gravmag.harvester.EffectCache(mesh, data, maxsize=size,
+            disk=tmpdir, disksize=size)
+        cached, cachedpred = _harvest(cache=cache)
+    finally:
+        shutil.rmtree(tmpdir)
+    assert np.all(estimate == cached)
+    for p, c in zip(predicted, cachedpred):
+        assert np.all(p == c)
+    assert cache.size <= size
+    assert cache.stats['evictions'] > 0
+    assert cache.stats['disk-hits'] > 0
+    cache = gravmag.harvester.EffectCache(mesh, data, dtype=np.float32)
+    single, singlepred = _harvest(cache=cache)
+    assert np.sum(estimate != single) <= 0.05*np.sum(estimate != 0)
+
+def test_masked():
+    "gravmag.harvester.harvest doesn't grow into masked cells"
+    masked = PrismMesh(mesh.bounds, mesh.shape)
+    # Mask the top 2 layers
+    masked.mask.extend(range(2*100))
+    seeds = gravmag.harvester.sow(locations, masked)
+    estimate, predicted = gravmag.harvester.harvest(data, seeds, masked, 0.5,
+                                                    0.0001)
+    estimate = np.array(estimate['density'], dtype=np.float)
+    assert np.all(estimate[:200] == 0)
+    assert np.sum(estimate != 0) > len(seeds)
+
+def test_grow():
+    "gravmag.harvester._grow against evaluating each neighbor separately"
+    harvester = gravmag.harvester
+    seeds = harvester.sow(locations, mesh)
+    weighted = [harvester.Gz(d.x, d.y, d.z, d.observed,
+                             weights=np.linspace(0.1, 1, d.size))
+                for d in data[:1]] + data[1:]
+    for accretion, update in enumerate(harvester.iharvest(weighted, seeds,
+                                                          mesh, 0.5, 0.0001)):
+        if accretion == 20:
+            break
+    estimate, predicted, new, neighbors, goal, misfit, regul = update
+    best, bestgoal, bestmisfit, bestregul = harvester._grow(neighbors[0],
+        weighted, predicted, misfit, 0.5, regul, 0.0001)
+    goals = {}
+    for n in neighbors[0].itervalues():
+        pred = [p + e for p, e in zip(predicted, n.effect)]
+        if (misfit - harvester._misfitfunc(weighted, pred))/misfit >= 0.0001:
+            goals[n.i] = (harvester._shapefunc(weighted, pred) +
+                          0.5*(regul + n.distance))
+    assert best.i == min(goals, key=goals.get)
+    assert np.allclose(bestgoal, goals[best.i], rtol=10**(-10), atol=0)
+    assert np.allclose(bestmisfit, harvester._misfitfunc(weighted,
+        [p + e for p, e in zip(predicted, best.effect)]))
+
+def test_heap():
+    "gravmag.harvester.harvest gives the same result with the heap strategy"
+    estimate, predicted = _harvest()
+    heap, heappred = _harvest(strategy='heap')
+    assert np.all(estimate == heap)
+    for p, h in zip(predicted, heappred):
+        assert np.allclose(p, h, rtol=10**(-10), atol=10**(-10))
+
+def test_njobs():
+    "gravmag.harvester.harvest gives the same result with threads"
+    estimate, predicted = _harvest()
+    threaded, threadedpred = _harvest(njobs=3)
+    assert np.all(estimate == threaded)
+    for p, t in zip(predicted, threadedpred):
+        assert np.allclose(p, t, rtol=10**(-10), atol=10**(-10))
+    # A small cache makes the seeds be evaluated in batches
+    cache = gravmag.harvester.EffectCache(mesh, data,
+                                          maxsize=10*data[0].size*8)
+    batched, batchedpred = _harvest(njobs=3, cache=cache)
+    assert np.all(estimate == batched)
+    for p, b in zip(predicted, batchedpred):
+        assert np.allclose(p, b, rtol=10**(-10), atol=10**(-10))
+
+def test_multiscale():
+    "gravmag.harvester.multiscale fits the data as well as harvest"
+    seeds = gravmag.harvester.sow(locations, mesh)
+    estimate, predicted, report = gravmag.harvester.harvest(data, seeds, mesh,
+        0.5, 0.0001, report=True)
+    multi, multipred, multireport = gravmag.harvester.multiscale(data, seeds,
+        mesh, 0.5, 0.0001, factor=2, report=True)
+    multi = np.array(multi['density'], dtype=np.float)
+    assert np.all(multi[[s.i for s in seeds]] == [1000, -800])
+    assert multireport['accretions'] == np.sum(multi != 0) - len(seeds)
+    assert multireport['misfit'] <= 1.2*report['misfit']
+    # Masked cells inside coarse cells that are not masked are left out
+    masked = PrismMesh(mesh.bounds, mesh.shape)
+    seedcells = [s.i for s in seeds]
+    masked.mask = [i for i in xrange(0, masked.size, 7) if i not in seedcells]
+    mseeds = gravmag.harvester.sow(locations, masked)
+    multi, multipred = gravmag.harvester.multiscale(data, mseeds, masked,
+        0.5, 0.0001, factor=2)
+    multi = np.array(multi['density'], dtype=np.float)
+    assert np.sum(multi != 0) > len(mseeds)
+    assert not np.any(multi[masked.mask])
+
+def test_resume():
+    "gravmag.harvester.iharvest resumed from a checkpoint gives the same result"
+    harvester = gravmag.harvester
+    estimate, predicted = _harvest()
+    seeds = harvester.sow(locations, mesh)
+    tmpdir = tempfile.mkdtemp()
+    try:
+        fname = os.path.join(tmpdir, 'state.npz')
+        updates = harvester.checkpoint(harvester.iharvest(data, seeds, mesh,
+            0.5, 0.0001), fname, seeds, every=50)
+        # Stop in the middle of an iteration, after the state was saved
+        for accretion, update in enumerate(updates):
+            if accretion == 131:
+                break
+        for update in harvester.iharvest(data, seeds, mesh, 0.5, 0.0001,
+                                         resume=fname):
+            continue
+    finally:
+        shutil.rmtree(tmpdir)
+    resumed = harvester.fmt_estimate(update[0], mesh.size)
+    resumed = np.array(resumed['density'], dtype=np.float)
+    assert np.all(estimate == resumed)
+    for p, r in zip(predicted, update[1]):
+        assert np.allclose(p, r, rtol=10**(-10), atol=10**(-10))
+
+def test_monitor():
+    "gravmag.harvester.monitor writes the progress of the inversion"
+    harvester = gravmag.harvester
+    seeds = harvester.sow(locations, mesh)
+    cache = harvester.EffectCache(mesh, data)
+    stream = StringIO()
+    updates = harvester.monitor(harvester.iharvest(data, seeds, mesh, 0.5,
+        0.0001, cache=cache), stream, cache=cache, every=20, total=200)
+    for accretions, update in enumerate(updates):
+        continue
+    lines = stream.getvalue().splitlines()
+    assert len(lines) == accretions/20
+    assert lines[0].startswith('accretions: 20 | rate: ')
+    assert 'cache hits: ' in lines[0]
+    assert 'ETA: ' in lines[0]
+
+def test_fmt_estimate():
+    "gravmag.harvester.fmt_estimate has the seeds and all accreted cells"
+    harvester = gravmag.harvester
+    seeds = harvester.sow(locations, mesh)
+    true = np.zeros(mesh.size)
+    for seed in seeds:
+        true[seed.i] = seed.props['density']
+    for update in harvester.iharvest(data, seeds, mesh, 0.5, 0.0001):
+        new = update[2]
+        if new is not None:
+            true[new.i] = new.props['density']
+    estimate = harvester.fmt_estimate(update[0], mesh.size)['density']
+    assert np.all(np.asarray(estimate) == true)
+    assert all(estimate[i] == true[i] for i in xrange(mesh.size))
+    mesh.addprop('density', estimate)
+    assert np.all(mesh.props['density'] == true)
+    del mesh.props['density']
+
+def test_cutoff():
+    "gravmag.harvester.harvest with a weight cutoff predicts all data points"
+    harvester = gravmag.harvester
+    seeds = harvester.sow(locations, mesh)
+    weighted = []
+    for d in data:
+        w = harvester.weights(d.x, d.y, seeds, [300, 300])
+        weighted.append(d.__class__(d.x, d.y, d.z, d.observed, weights=w))
+    assert 0 < np.sum(w < 0.01) < len(w)
+    cache = harvester.EffectCache(mesh, weighted, cutoff=0.01)
+    estimate, predicted = harvester.harvest(weighted, seeds, mesh, 0.5,
+                                            0.0001, cache=cache, cutoff=0.01)
+    estimate = np.array(estimate['density'], dtype=np.float)
+    assert np.sum(estimate != 0) > len(seeds)
+    model = PrismMesh(mesh.bounds, mesh.shape)
+    model.addprop('density', estimate)
+    x, y, z = data[0].x, data[0].y, data[0].z
+    true = [gravmag.prism.gz(x, y, z, model), gravmag.prism.gzz(x, y, z, model)]
+    for p, t in zip(predicted, true):
+        assert len(p) == len(t)
+        assert np.allclose(p, t, rtol=10**(-4), atol=10**(-4)*np.abs(t).max())
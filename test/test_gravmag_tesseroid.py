@@ -1,7 +1,8 @@
 import numpy as np
 
 from fatiando import gravmag
-from fatiando.mesher import Tesseroid
+from fatiando.mesher import Tesseroid, TesseroidMesh
+from fatiando import gridder
 #from fatiando.gravmag import _tesseroid, _ctesseroid
 
 shellmodel = None
@@ -110,3 +111,212 @@ def test_gyz():
     tess = gravmag.tesseroid.gyz(lons, lats, heights, shellmodel)
     diff = np.abs(tess)
     assert np.all(diff <= 10**(-10)), 'diff: %s' % (str(diff))
+
+def test_fields():
+    "gravmag.tesseroid.fields gives the same as the single component functions"
+    lons = np.zeros_like(heights)
+    lats = lons
+    components = ['potential', 'gz', 'gxx', 'gxy', 'gxz', 'gyy', 'gyz', 'gzz']
+    results = gravmag.tesseroid.fields(lons, lats, heights, shellmodel,
+        components, ratio=3)
+    for comp, res in zip(components, results):
+        func = getattr(gravmag.tesseroid, comp)
+        tess = func(lons, lats, heights, shellmodel, ratio=3)
+        assert np.allclose(res, tess, rtol=10**(-10), atol=10**(-10)), \
+            'component %s' % (comp)
+
+def test_global_fields():
+    "gravmag.tesseroid.global_fields against fields on a global mesh"
+    mesh = TesseroidMesh((0, 360, -90, 90, 0, -50000), (1, 6, 12))
+    mesh.addprop('density', 1000*np.random.RandomState(0).rand(mesh.size))
+    mesh.mask.append(5)
+    shape = (5, 12)
+    lons, lats, hs = gridder.regular((10, 340, -60, 60), shape, z=1000000)
+    components = ['potential', 'gz', 'gxz', 'gzz']
+    fast = gravmag.tesseroid.global_fields(lons, lats, hs, shape, mesh,
+        components)
+    slow = gravmag.tesseroid.fields(lons, lats, hs, mesh, components)
+    for comp, f, s in zip(components, fast, slow):
+        diff = np.abs(f - s)/np.abs(s).max()
+        assert np.all(diff <= 10**(-10)), 'component %s diff: %s' % (comp,
+            str(diff))
+    # Latitudes that vary along the rows break the symmetry
+    shape = (2, 12)
+    lons, lats, hs = gridder.regular((10, 340, -30, 30), shape, z=1000000)
+    lats = lats + np.tile(np.linspace(0, 5, 12), 2)
+    try:
+        gravmag.tesseroid.global_fields(lons, lats, hs, shape, mesh, ['gz'])
+    except ValueError:
+        pass
+    else:
+        assert False, "Didn't raise ValueError for varying latitudes"
+
+def test_global_fields_no_density():
+    "gravmag.tesseroid.global_fields returns zeros for a mesh without density"
+    mesh = TesseroidMesh((0, 360, -90, 90, 0, -50000), (1, 6, 12))
+    shape = (5, 12)
+    lons, lats, hs = gridder.regular((10, 340, -60, 60), shape, z=1000000)
+    components = ['potential', 'gz', 'gzz']
+    for shells in [False, True]:
+        results = gravmag.tesseroid.global_fields(lons, lats, hs, shape, mesh,
+            components, shells=shells)
+        for comp, res in zip(components, results):
+            assert res.shape == lons.shape, 'component %s' % (comp)
+            assert np.all(res == 0), 'component %s shells %s' % (comp, shells)
+
+def test_too_close():
+    "gravmag.tesseroid._too_close range query against brute force distances"
+    from fatiando.gravmag.tesseroid import _too_close, _distance
+    rand = np.random.RandomState(42)
+    lons = rand.uniform(-20, 20, 2000)
+    lats = rand.uniform(-20, 20, 2000)
+    hs = rand.uniform(0, 500000, 2000)
+    points = gravmag.tesseroid.SphericalPoints(lons, lats, hs)
+    marked = np.zeros(len(lons), dtype=bool)
+    tess = Tesseroid(-2, 3, -1, 4, 0, -30000)
+    index = np.arange(0, len(lons), 3)
+    for distance in [1000., 200000., 800000., 5000000.]:
+        close = _too_close(tess, distance, points, marked, index)
+        dists = _distance(tess, points, index)
+        true = index[(dists > 0) & (dists < distance)]
+        assert np.array_equal(np.sort(close), true), 'distance %g' % (distance)
+        assert not np.any(marked)
+
+def test_spherical_points():
+    "gravmag.tesseroid SphericalPoints gives same results as passing arrays"
+    lons, lats, heights = gridder.regular((-10, 10, -10, 10), (5, 5), z=250000)
+    points = gravmag.tesseroid.SphericalPoints(lons, lats, heights)
+    model = [Tesseroid(-2, 2, -3, 1, 0, -20000, {'density':1000}),
+             Tesseroid(3, 6, 0, 4, -10000, -50000, {'density':-500})]
+    for f in ['potential', 'gz', 'gxy']:
+        f = getattr(gravmag.tesseroid, f)
+        arrays = f(lons, lats, heights, model)
+        reused = f(points, None, None, model)
+        assert np.array_equal(arrays, reused), f.__name__
+    components = ['gz', 'gzz']
+    arrays = gravmag.tesseroid.fields(lons, lats, heights, model, components)
+    reused = gravmag.tesseroid.fields(points, None, None, model, components)
+    for a, r in zip(arrays, reused):
+        assert np.array_equal(a, r)
+
+def test_order():
+    "gravmag.tesseroid with different GLQ orders per dimension against shell"
+    shell = gravmag.half_sph_shell.gz(heights, top, bottom, density)
+    lons = np.zeros_like(heights)
+    lats = lons
+    for order in [3, (4, 3, 2), (2, 2, 5)]:
+        tess = gravmag.tesseroid.gz(lons, lats, heights, shellmodel,
+            order=order)
+        diff = np.abs((shell - tess)/shell)
+        assert np.all(diff <= 0.01), 'order %s diff: %s' % (str(order),
+            str(diff))
+
+def test_maxorder():
+    "gravmag.tesseroid raising the GLQ order near the surface against shell"
+    hs = np.array([1000., 10000., 50000.])
+    lons = np.zeros_like(hs)
+    lats = lons
+    for comp in ['potential', 'gz', 'gzz']:
+        shell = getattr(gravmag.half_sph_shell, comp)(hs, top, bottom,
+            density)
+        tess = getattr(gravmag.tesseroid, comp)(lons, lats, hs, shellmodel,
+            maxorder=10)
+        diff = np.abs((shell - tess)/shell)
+        assert np.all(diff <= 0.01), '%s diff: %s' % (comp, str(diff))
+
+def test_mesh():
+    "gravmag.tesseroid TesseroidMesh arrays give same results as a list"
+    mesh = TesseroidMesh((-10, 10, -10, 10, 0, -30000), (2, 4, 4))
+    dens = np.random.RandomState(0).uniform(-500, 500, mesh.size)
+    dens[7] = 0
+    mesh.addprop('density', dens)
+    mesh.mask.extend([3, 20])
+    lons, lats, heights = gridder.regular((-15, 15, -15, 15), (4, 4),
+        z=100000)
+    # Some points close to the mesh and some far from all tesseroids
+    heights[::2] = 2000000
+    cells = list(mesh)
+    components = ['potential', 'gz', 'gzz']
+    arrays = gravmag.tesseroid.fields(lons, lats, heights, mesh, components)
+    lists = gravmag.tesseroid.fields(lons, lats, heights, cells, components)
+    for comp, a, l in zip(components, arrays, lists):
+        diff = np.abs(a - l)/np.abs(l).max()
+        assert np.all(diff <= 10**(-10)), '%s diff: %s' % (comp, str(diff))
+    a = gravmag.tesseroid.gx(lons, lats, heights, mesh, dens=10)
+    l = gravmag.tesseroid.gx(lons, lats, heights, cells, dens=10)
+    assert np.all(np.abs(a - l)/np.abs(l).max() <= 10**(-10))
+
+def test_maxdepth():
+    "gravmag.tesseroid limits the splits and reports the work done"
+    hs = np.array([0., 10.])
+    lons = np.zeros_like(hs)
+    lats = lons
+    model = [Tesseroid(-1, 1, -1, 1, 0, -50000, props),
+             Tesseroid(1, 2, -1, 1, 0, -50000, props)]
+    result, report = gravmag.tesseroid.gz(lons, lats, hs, model, maxdepth=6,
+        report=True)
+    assert report['max-depth'] == 6
+    assert report['depth-limited'] > 0
+    assert report['max-stack'] <= 7*6 + 1
+    assert report['splits'] > 0 and report['leaves'] > report['splits']
+    assert np.all(np.isfinite(result))
+    far = gravmag.tesseroid.fields(lons, lats, hs + 10**7, model, ['gz'],
+        maxdepth=0, report=True)[-1]
+    assert far['splits'] == 0 and far['depth-limited'] == 0
+    assert far['evaluations'] == len(model)*len(hs)
+
+def test_tol():
+    "gravmag.tesseroid ratio chosen from a tolerance against half a shell"
+    lons = np.zeros_like(heights)
+    lats = lons
+    for comp, tols in [('potential', [10**(-3), 10**(-5)]),
+                       ('gz', [10**(-2), 10**(-4)]),
+                       ('gzz', [10**(-2), 10**(-3)])]:
+        shell = getattr(gravmag.half_sph_shell, comp)(heights, top, bottom,
+            density)
+        for tol in tols:
+            tess = getattr(gravmag.tesseroid, comp)(lons, lats, heights,
+                shellmodel, tol=tol)
+            diff = np.abs((shell - tess)/shell)
+            assert np.all(diff <= tol), '%s tol %g diff: %s' % (comp, tol,
+                str(diff))
+    ratio = gravmag.tesseroid._tol2ratio
+    assert ratio('gzz', 10**(-3)) > ratio('gz', 10**(-3))
+    assert ratio('gz', 10**(-9)) > ratio('gz', 10**(-8)) > 8
+
+def test_shells():
+    "gravmag.tesseroid.fields with reference shells against without"
+    mesh = TesseroidMesh((-180, 180, -90, 90, 0, -40000), (2, 6, 12))
+    dens = np.ones(mesh.shape)*np.array([2700., 2900.])[:, None, None]
+    dens[0, 2:4, 3:5] = 3000.
+    dens[1, 3, 6] = 2500.
+    mesh.addprop('density', dens.ravel())
+    lons, lats = [i.ravel() for i in np.meshgrid(np.arange(-165, 180, 30.),
+                                                 np.arange(-75, 90, 30.))]
+    heights = 2000000*np.ones_like(lons)
+    comps = ['potential', 'gz', 'gxy', 'gzz']
+    tess = gravmag.tesseroid.fields(lons, lats, heights, mesh, comps,
+                                    report=True)
+    shells = gravmag.tesseroid.fields(lons, lats, heights, mesh, comps,
+                                      shells=True, report=True)
+    assert shells[-1]['leaves'] < 0.1*tess[-1]['leaves']
+    for comp, true, res in zip(comps, tess[:-1], shells[:-1]):
+        diff = np.abs(true - res).max()/np.abs(true - true.mean()).max()
+        assert diff <= 0.005, 'component %s diff: %g' % (comp, diff)
+    grid = gravmag.tesseroid.global_fields(lons, lats, heights, (6, 12), mesh,
+                                           comps, shells=True)
+    for res, true in zip(grid, shells[:-1]):
+        assert np.allclose(res, true, rtol=10**(-10), atol=10**(-10))
+    # The field of a full shell outside of it is the one of a point mass
+    radii = gravmag.tesseroid.MEAN_EARTH_RADIUS + heights
+    mass = 4*np.pi*1000.*(radii[0]**3 - (radii[0] - 2000.)**3)/3.
+    potential = gravmag.tesseroid._shell(heights[0], heights[0] - 2000.,
+                                         1000., radii + 1, [0])[0]
+    assert np.allclose(potential, gravmag.tesseroid.G*mass/(radii + 1))
+    try:
+        gravmag.tesseroid.fields(lons, lats, heights, [mesh[0]], comps,
+                                 shells=True)
+    except ValueError:
+        pass
+    else:
+        assert False, "Didn't raise ValueError for a list of tesseroids"